@@ -0,0 +1,27 @@
+"""stamp qanta keyframes
+
+Revision ID: b0d4f1a6c2e9
+Revises: e5b34c7de483
+Create Date: 2026-10-18 13:40:07.219854
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b0d4f1a6c2e9'
+down_revision = 'e5b34c7de483'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL for the keyframes cached so far, scripts/cache_qanta.py regenerates them
+    op.add_column('qantakeyframe', sa.Column('tokens_hash', sa.String))
+    op.add_column('qantakeyframe', sa.Column('guesser_version', sa.String))
+
+
+def downgrade():
+    op.drop_column('qantakeyframe', 'tokens_hash')
+    op.drop_column('qantakeyframe', 'guesser_version')
@@ -0,0 +1,149 @@
+"""qanta cache to keyframes
+
+Revision ID: e5b34c7de483
+Revises: 9235bd33b17e
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b34c7de483'
+down_revision = '9235bd33b17e'
+branch_labels = None
+depends_on = None
+
+# columns that only change at a keyframe
+EVIDENCE = ('guesses', 'buzz_scores', 'matches', 'matches_highlight')
+
+question = sa.table(
+    'question',
+    sa.column('id', sa.String),
+    sa.column('answer', sa.String),
+    sa.column('length', sa.Integer),
+)
+qantacache = sa.table(
+    'qantacache',
+    sa.column('question_id', sa.String),
+    sa.column('position', sa.Integer),
+    sa.column('answer', sa.String),
+    *[sa.column(x, JSONB) for x in EVIDENCE],
+    sa.column('text_highlight', JSONB),
+)
+qantakeyframe = sa.table(
+    'qantakeyframe',
+    sa.column('question_id', sa.String),
+    sa.column('position', sa.Integer),
+    *[sa.column(x, JSONB) for x in EVIDENCE],
+    sa.column('text_highlight', sa.LargeBinary),
+)
+
+
+def pack_bits(flags) -> bytes:
+    packed = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+
+def unpack_bits(data) -> list:
+    '''the flags of a bitmap, without trailing False'''
+    flags = [bool(data[i >> 3] >> (i & 7) & 1) for i in range(8 * len(data))]
+    while flags and not flags[-1]:
+        flags.pop()
+    return flags
+
+
+def to_keyframes(rows) -> list:
+    '''
+    The qantacache `rows` of one question, in order of position, as
+    keyframes: a new keyframe starts where the evidence changes, or where
+    the highlight of words already displayed changes.
+    '''
+    keyframes = []
+    highlight = None  # of the last keyframe
+    for row in rows:
+        flags = list(row.text_highlight or [])
+        if keyframes:
+            last = keyframes[-1]
+            n = len(highlight)
+            if all(getattr(row, x) == last[x] for x in EVIDENCE) \
+                    and flags[:n] == highlight and not any(flags[n:]):
+                continue
+        highlight = flags
+        keyframe = {x: getattr(row, x) for x in EVIDENCE}
+        keyframe.update(question_id=row.question_id, position=row.position, text_highlight=pack_bits(flags))
+        keyframes.append(keyframe)
+    return keyframes
+
+
+def upgrade():
+    op.create_table(
+        'qantakeyframe',
+        sa.Column('question_id', sa.String, sa.ForeignKey('question.id'), primary_key=True),
+        sa.Column('position', sa.Integer, primary_key=True),
+        *[sa.Column(x, JSONB) for x in EVIDENCE],
+        sa.Column('text_highlight', sa.LargeBinary),
+    )
+
+    bind = op.get_bind()
+    question_ids = [x for x, in bind.execute(sa.select(qantacache.c.question_id).distinct())]
+    for question_id in question_ids:
+        rows = bind.execute(
+            sa.select(qantacache)
+            .where(qantacache.c.question_id == question_id)
+            .order_by(qantacache.c.position)
+        ).fetchall()
+        op.bulk_insert(qantakeyframe, to_keyframes(rows))
+
+    op.drop_table('qantacache')
+
+
+def downgrade():
+    op.create_table(
+        'qantacache',
+        sa.Column('question_id', sa.String, sa.ForeignKey('question.id'), primary_key=True),
+        sa.Column('position', sa.Integer, primary_key=True),
+        sa.Column('answer', sa.String, nullable=False),
+        sa.Column('guesses', JSONB),
+        sa.Column('buzz_scores', JSONB),
+        sa.Column('matches', JSONB),
+        sa.Column('text_highlight', JSONB),
+        sa.Column('matches_highlight', JSONB),
+    )
+
+    bind = op.get_bind()
+    questions = {
+        x.id: x for x in bind.execute(
+            sa.select(question)
+            .where(question.c.id.in_(sa.select(qantakeyframe.c.question_id)))
+        )
+    }
+    for question_id, q in questions.items():
+        keyframes = bind.execute(
+            sa.select(qantakeyframe)
+            .where(qantakeyframe.c.question_id == question_id)
+            .order_by(qantakeyframe.c.position)
+        ).fetchall()
+        rows = []
+        for i, keyframe in enumerate(keyframes):
+            end = keyframes[i + 1].position if i + 1 < len(keyframes) else max(q.length, keyframe.position) + 1
+            flags = unpack_bits(keyframe.text_highlight or b'')
+            for position in range(keyframe.position, end):
+                row = {x: getattr(keyframe, x) for x in EVIDENCE}
+                row.update(
+                    question_id=question_id,
+                    position=position,
+                    answer=q.answer,
+                    # one flag per displayed word, as cache_qanta.py wrote them
+                    text_highlight=flags + [False] * (position - len(flags)),
+                )
+                rows.append(row)
+        op.bulk_insert(qantacache, rows)
+
+    op.drop_table('qantakeyframe')
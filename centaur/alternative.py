@@ -1,6 +1,4 @@
 import pickle
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from collections import defaultdict
 
 # from db import QBDB
@@ -108,6 +106,9 @@ alternative_answers.update({
 
 
 def create_alternatives():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = ['https://spreadsheets.google.com/feeds']
     credentials = ServiceAccountCredentials.from_json_keyfile_name('API Project-21af541bdeea.json', scope)
     gc = gspread.authorize(credentials)
@@ -141,6 +142,9 @@ def create_alternatives():
 
 
 def read_alternatives():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = ['https://spreadsheets.google.com/feeds']
     credentials = ServiceAccountCredentials.from_json_keyfile_name('API Project-21af541bdeea.json', scope)
     gc = gspread.authorize(credentials)
@@ -0,0 +1,309 @@
+'''
+Answer equivalence for judging buzzes.
+
+Every acceptable answer of a question is reduced to a key that ignores
+case, accents, punctuation and spacing: the canonical answer, the
+`alternative_answers` of the question meta, and the aliases of
+`centaur/alternative.py`. The keys are computed once per question bank,
+so judging a guess is a single set lookup.
+
+Guesses that miss are matched again allowing a few typos, through a
+BK-tree of the keys of the question. The number of edits accepted grows
+with the length of the key, see `settings.TYPO_TOLERANCE`. A guess that
+is itself the key of another answer, of any question of the database or
+of the alias table, is never a typo: "Manet" is not a misspelled "Monet".
+These keys are fixed when the index is built, so that a guess is judged
+the same whichever questions have been added since.
+'''
+import re
+
+import numpy as np
+from sqlalchemy import and_, bindparam, func
+
+from centaur.config import settings
+from centaur.utils import normalize_answer
+from centaur.alternative import alternative_answers
+from centaur.models import Question, Record
+
+
+# disambiguation like "cyrano de bergerac (play)" or "newton (surname)"
+QUALIFIER_PATTERN = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+NO_ANSWER = 'TIME_OUT'
+
+
+def answer_key(text: str) -> str:
+    return normalize_answer(text).replace(' ', '')
+
+
+def answer_keys(text: str) -> set:
+    '''keys of `text` with and without a trailing qualifier'''
+    keys = {answer_key(text), answer_key(QUALIFIER_PATTERN.sub(' ', text))}
+    keys.discard('')
+    return keys
+
+
+def max_edits(length: int, tolerance=settings.TYPO_TOLERANCE) -> int:
+    '''edits accepted in a key of `length` characters'''
+    edits = 0
+    for min_length, n in tolerance:
+        if length >= min_length:
+            edits = n
+    return edits
+
+
+def edit_distance(a: str, b: str, bound: int = None) -> int:
+    '''Levenshtein distance, or `bound + 1` as soon as it exceeds `bound`'''
+    if bound is not None and abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        if bound is not None and min(current) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1]
+
+
+def _edit_distances(a: list, b: list) -> np.ndarray:
+    n = len(a)
+    len_a = np.array([len(x) for x in a])
+    len_b = np.array([len(x) for x in b])
+    codes_a = np.zeros((n, len_a.max()), dtype=np.int32)
+    codes_b = np.zeros((n, len_b.max()), dtype=np.int32)
+    for i, (x, y) in enumerate(zip(a, b)):
+        codes_a[i, :len(x)] = [ord(c) for c in x]
+        codes_b[i, :len(y)] = [ord(c) for c in y]
+
+    # rows of the DP table over all pairs, padding past the end of a string
+    # does not change the cells the result is read from
+    previous = np.tile(np.arange(codes_b.shape[1] + 1, dtype=np.int32), (n, 1))
+    distances = previous[np.arange(n), len_b].copy()  # for empty `a`
+    for i in range(codes_a.shape[1]):
+        current = np.empty_like(previous)
+        current[:, 0] = i + 1
+        substitution = previous[:, :-1] + (codes_a[:, i: i + 1] != codes_b)
+        deletion = previous[:, 1:] + 1
+        best = np.minimum(substitution, deletion)
+        for j in range(codes_b.shape[1]):
+            current[:, j + 1] = np.minimum(best[:, j], current[:, j] + 1)
+        previous = current
+        done = len_a == i + 1
+        distances[done] = previous[done, len_b[done]]
+    return distances
+
+
+def edit_distances(a: list, b: list) -> np.ndarray:
+    '''Levenshtein distance of each pair `a[i]`, `b[i]`, computed for all pairs at once'''
+    distances = np.zeros(len(a), dtype=np.int32)
+    # pairs of similar lengths together, so that little time goes to padding
+    groups = dict()
+    for i, (x, y) in enumerate(zip(a, b)):
+        groups.setdefault((len(x) // 4, len(y) // 4), []).append(i)
+    for rows in groups.values():
+        distances[rows] = _edit_distances([a[i] for i in rows], [b[i] for i in rows])
+    return distances
+
+
+class BKTree:
+    '''Keys of one question, searchable by edit distance.'''
+
+    __slots__ = ('root', 'max_length')
+
+    def __init__(self, keys=()):
+        self.root = None  # (key, {distance: child})
+        self.max_length = 0
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str):
+        self.max_length = max(self.max_length, len(key))
+        if self.root is None:
+            self.root = (key, dict())
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(key, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (key, dict())
+                return
+            node = child
+
+    def search(self, word: str, radius: int) -> list:
+        '''(distance, key) of the keys within `radius` edits of `word`'''
+        found = []
+        nodes = [] if self.root is None else [self.root]
+        while len(nodes) > 0:
+            key, children = nodes.pop()
+            distance = edit_distance(word, key)
+            if distance <= radius:
+                found.append((distance, key))
+            for d, child in children.items():
+                if distance - radius <= d <= distance + radius:
+                    nodes.append(child)
+        return found
+
+
+def answer_texts(rows):
+    '''canonical and alternative answers of (id, answer, meta) question rows'''
+    for _, answer, meta in rows:
+        yield answer
+        yield from (meta or {}).get('alternative_answers', [])
+
+
+class AnswerIndex:
+    '''Keys of the acceptable answers of each question.'''
+
+    def __init__(self, aliases: dict = alternative_answers, tolerance=settings.TYPO_TOLERANCE, vocabulary=()):
+        # answer key -> alias keys from the alias table
+        self.aliases = dict()
+        for answer, alternatives in aliases.items():
+            keys = set()
+            for alternative in alternatives:
+                keys |= answer_keys(alternative)
+            for key in answer_keys(answer):
+                self.aliases.setdefault(key, set()).update(keys)
+        # keys of every answer known, guesses that are one of them are not typos
+        self.known = set(self.aliases)
+        for keys in self.aliases.values():
+            self.known |= keys
+        for text in vocabulary:
+            self.known |= answer_keys(text)
+        self.accepted = dict()  # question_id -> frozenset of keys
+        self.trees = dict()  # question_id -> BKTree of the keys that accept typos
+        self.tolerance = tolerance
+        self.radius = max(n for _, n in tolerance)
+
+    @classmethod
+    def load(cls, db):
+        '''index of every question in the database, without loading the question text'''
+        rows = db.query(Question.id, Question.answer, Question.meta).all()
+        index = cls(vocabulary=answer_texts(rows))
+        for question_id, answer, meta in rows:
+            index.add(question_id, answer, (meta or {}).get('alternative_answers', []))
+        return index
+
+    @classmethod
+    def load_vocabulary(cls, db):
+        '''empty index knowing the answers of every question in the database'''
+        return cls(vocabulary=answer_texts(db.query(Question.id, Question.answer, Question.meta)))
+
+    def __len__(self):
+        return len(self.accepted)
+
+    def __contains__(self, question_id: str):
+        return question_id in self.accepted
+
+    def add(self, question_id: str, answer: str, alternatives=()):
+        keys = set()
+        for text in [answer] + list(alternatives):
+            keys |= answer_keys(text)
+        for key in list(keys):
+            keys |= self.aliases.get(key, set())
+        self.accepted[question_id] = frozenset(keys)
+        self.trees[question_id] = BKTree(x for x in keys if self.max_edits(x) > 0)
+
+    def max_edits(self, key: str) -> int:
+        return max_edits(len(key), self.tolerance)
+
+    def add_questions(self, questions):
+        for question in questions:
+            if question.id not in self.accepted:
+                self.add(question.id, question.answer, (question.meta or {}).get('alternative_answers', []))
+
+    def judge(self, question_id: str, guess: str) -> bool:
+        if guess is None:
+            return False
+        accepted = self.accepted.get(question_id, ())
+        guess_keys = answer_keys(guess)
+        if any(key in accepted for key in guess_keys):
+            return True
+        if any(key in self.known for key in guess_keys):
+            return False
+        tree = self.trees.get(question_id)
+        if tree is None or tree.root is None:
+            return False
+        for guess_key in guess_keys:
+            if len(guess_key) > tree.max_length + self.radius:
+                continue
+            for distance, key in tree.search(guess_key, self.radius):
+                if distance <= self.max_edits(key):
+                    return True
+        return False
+
+    def judge_all(self, question_ids: list, guesses: list) -> np.ndarray:
+        '''
+        `judge` of many guesses at once: exact keys are looked up one by
+        one, the edit distances of the others to the keys of their
+        question are computed together.
+        '''
+        results = np.zeros(len(guesses), dtype=bool)
+        pairs_guess, pairs_key, pairs_row = [], [], []
+        for row, (question_id, guess) in enumerate(zip(question_ids, guesses)):
+            accepted = self.accepted.get(question_id)
+            if guess is None or accepted is None:
+                continue
+            guess_keys = answer_keys(guess)
+            if any(key in accepted for key in guess_keys):
+                results[row] = True
+                continue
+            if any(key in self.known for key in guess_keys):
+                continue
+            for key in accepted:
+                edits = self.max_edits(key)
+                for guess_key in guess_keys:
+                    if edits > 0 and abs(len(key) - len(guess_key)) <= edits:
+                        pairs_guess.append(guess_key)
+                        pairs_key.append(key)
+                        pairs_row.append(row)
+
+        if len(pairs_row) > 0:
+            distances = edit_distances(pairs_guess, pairs_key)
+            edits = np.array([self.max_edits(x) for x in pairs_key])
+            matched = np.array(pairs_row)[distances <= edits]
+            results[matched] = True
+        return results
+
+
+def rejudge_records(db, index: AnswerIndex, dry_run: bool = False) -> list:
+    '''
+    Judge the guesses of the Record table again with `index`, e.g. after
+    the alias table changed, and update `Record.result` where it differs.
+
+    Each distinct (question, guess, result) is judged once and updated in
+    one statement, records are never loaded as objects. Scores are not
+    recomputed. Returns (question_id, guess, old result, new result,
+    number of records) of the changes, without committing.
+    '''
+    rows = db.query(Record.question_id, Record.guess, Record.result, func.count(Record.id)) \
+        .filter(Record.guess.isnot(None)) \
+        .filter(Record.guess != NO_ANSWER) \
+        .filter(Record.result.isnot(None)) \
+        .group_by(Record.question_id, Record.guess, Record.result)
+
+    rows = [x for x in rows if x[0] in index]
+    results = index.judge_all([x[0] for x in rows], [x[1] for x in rows])
+    changes = []
+    for (question_id, guess, result, count), new_result in zip(rows, results):
+        if int(new_result) != result:
+            changes.append((question_id, guess, result, int(new_result), count))
+
+    updates = [
+        {'b_question_id': x[0], 'b_guess': x[1], 'b_result': x[2], 'b_new_result': x[3]}
+        for x in changes
+    ]
+    if len(updates) > 0 and not dry_run:
+        table = Record.__table__
+        statement = table.update() \
+            .where(and_(
+                table.c.question_id == bindparam('b_question_id'),
+                table.c.guess == bindparam('b_guess'),
+                table.c.result == bindparam('b_result'),
+            )) \
+            .values(result=bindparam('b_new_result'))
+        db.execute(statement, updates)
+    return changes
@@ -0,0 +1,175 @@
+'''
+Answer autocomplete served by the game server, instead of every browser
+downloading the whole answer list and fuzzy searching it on each keystroke.
+
+The index is built once at startup from the answer vocabulary written by
+`scripts/update_answers.py`, and shared by all rooms.
+'''
+import json
+import heapq
+import logging
+from bisect import bisect_left
+
+import numpy as np
+from twisted.web.resource import Resource
+
+from centaur.utils import normalize_answer
+
+
+logger = logging.getLogger('autocomplete')
+
+MAX_K = 50
+PRECOMPUTED_PREFIX = 3  # top completions of prefixes up to this length are stored
+MAX_POSTING = 2000  # trigrams in more answers than this are ignored by the fuzzy match
+MIN_SIMILARITY = 0.4  # share of the trigrams of the query an answer must contain
+
+
+def trigrams(text: str) -> set:
+    text = f' {text} '
+    return {text[i: i + 3] for i in range(len(text) - 2)}
+
+
+def answer_vocabulary(db, tournament_str: str, vocabulary: list = ()) -> list:
+    '''
+    `vocabulary` extended with the answers and alternative answers of the
+    questions of a tournament, title-cased and without duplicates.
+    '''
+    from centaur.models import Question
+
+    answers = list(vocabulary)
+    seen = set(answers)
+    questions = db.query(Question).filter(Question.tournament.startswith(tournament_str)).all()
+    for question in questions:
+        alternatives = (question.meta or {}).get('alternative_answers', [])
+        for answer in [question.answer] + list(alternatives):
+            answer = answer.strip().title()
+            if answer not in seen:
+                seen.add(answer)
+                answers.append(answer)
+    return answers
+
+
+class AnswerCompleter:
+    '''
+    Ranked completions of a partially typed answer.
+
+    Answers matching the query as a prefix of a word come first, those
+    matching at the first word before the others, shorter answers first.
+    If there are not enough of them, answers sharing trigrams with the
+    query fill the rest, so that typos still find something.
+    '''
+
+    def __init__(self, answers, k: int = 10):
+        self.answers = []  # display form
+        self.normalized = []
+        seen = set()
+        for answer in answers:
+            normalized = normalize_answer(answer)
+            if normalized == '' or normalized in seen:
+                continue
+            seen.add(normalized)
+            self.answers.append(answer)
+            self.normalized.append(normalized)
+
+        # the normalized answer from each word on, sorted, for prefix search
+        suffixes = []
+        for i, normalized in enumerate(self.normalized):
+            start = 0
+            while start != -1:
+                suffixes.append((normalized[start:], start > 0, i))
+                start = normalized.find(' ', start)
+                start = start + 1 if start != -1 else -1
+        suffixes.sort()
+        self.keys = [x[0] for x in suffixes]
+        self.entries = [(x[1], x[2]) for x in suffixes]  # (matched after first word, answer id)
+
+        postings = dict()  # trigram -> answer ids
+        for i, normalized in enumerate(self.normalized):
+            for gram in trigrams(normalized):
+                postings.setdefault(gram, []).append(i)
+        self.postings = {
+            gram: np.array(ids, dtype=np.int32)
+            for gram, ids in postings.items()
+            if len(ids) <= MAX_POSTING
+        }
+        self.lengths = np.array([len(x) for x in self.normalized], dtype=np.int32)
+
+        self.k = k
+        self.top = dict()  # short prefix -> best answer ids
+        prefixes = set()
+        for key in self.keys:
+            for n in range(1, PRECOMPUTED_PREFIX + 1):
+                prefixes.add(key[:n])
+        for prefix in prefixes:
+            self.top[prefix] = self._prefix_matches(prefix, MAX_K)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self.answers)
+
+    def _rank(self, late: bool, i: int):
+        return (late, len(self.normalized[i]), i)
+
+    def _prefix_matches(self, prefix: str, k: int) -> list:
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        best = dict()  # answer id -> whether it only matches after the first word
+        for late, i in self.entries[lo:hi]:
+            best[i] = best.get(i, True) and late
+        ranked = heapq.nsmallest(k, best.items(), key=lambda x: self._rank(x[1], x[0]))
+        return [i for i, late in ranked]
+
+    def _fuzzy_matches(self, query: str, k: int, exclude) -> list:
+        '''answers containing most trigrams of `query`, shorter ones first'''
+        grams = trigrams(query)
+        postings = [self.postings[x] for x in grams if x in self.postings]
+        if len(postings) == 0:
+            return []
+        hits = np.bincount(np.concatenate(postings), minlength=len(self.answers))
+        ids = np.flatnonzero(hits >= MIN_SIMILARITY * len(grams))
+        n = k + len(exclude)
+        if len(ids) > n:
+            # enough of the most similar ones, ties broken by length below
+            ids = ids[np.argpartition(-hits[ids], n)[:n]]
+        scored = sorted(zip((-hits[ids]).tolist(), self.lengths[ids].tolist(), ids.tolist()))
+        return [i for _, _, i in scored if i not in exclude][:k]
+
+    def complete(self, text: str, k: int = None) -> list:
+        '''up to `k` answers completing `text`, best first'''
+        k = min(k or self.k, MAX_K)
+        query = normalize_answer(text)
+        if query == '':
+            return []
+        if query in self.top:
+            ids = self.top[query][:k]
+        else:
+            ids = self._prefix_matches(query, k)
+        if len(ids) < k and len(query) >= 3:
+            ids = ids + self._fuzzy_matches(query, k - len(ids), set(ids))
+        return [self.answers[i] for i in ids]
+
+
+class AutocompleteResource(Resource):
+    '''GET /autocomplete?q=<text>&k=<n> returns a JSON list of answers'''
+
+    isLeaf = True
+
+    def __init__(self, completer: AnswerCompleter):
+        Resource.__init__(self)
+        self.completer = completer
+
+    def render_GET(self, request):
+        text = request.args.get(b'q', [b''])[0].decode('utf-8', 'ignore')
+        try:
+            k = int(request.args.get(b'k', [b'0'])[0])
+        except ValueError:
+            k = 0
+        request.setHeader(b'content-type', b'application/json; charset=utf-8')
+        # the page is served from another port
+        request.setHeader(b'access-control-allow-origin', b'*')
+        request.setHeader(b'cache-control', b'public, max-age=3600')
+        return json.dumps(self.completer.complete(text, k)).encode('utf-8')
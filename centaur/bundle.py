@@ -0,0 +1,233 @@
+'''
+Precompiled render bundles.
+
+Everything `stream_next` sends for a question position is a function of
+the QantaKeyframe of that position: the word highlights and the
+display panels (top guesses, rendered matches, autopilot prediction).
+`build_bundle` renders them offline for a set of questions and writes a
+single binary file, which the server memory-maps at startup. At runtime
+only bells and per-player overlays are added.
+
+File layout, little-endian:
+
+    magic 'QBRB', u16 version, u32 index size, JSON index, question blobs
+
+The index maps question id -> [offset, size, tokens_hash, guesser_version]
+of its blob, the stamp of the keyframes it was built from. A blob is
+
+    u32 n_positions, u32 n_keyframes
+    u16 keyframe index of positions 1..n_positions (0xffff if missing)
+    n_keyframes * (u32 position, u32 n_highlight, u32 highlight offset,
+                   u32 panels offset, u32 panels size)
+    highlight bitmaps and UTF-8 JSON panels, offsets relative to the blob
+'''
+import os
+import glob
+import json
+import mmap
+import time
+import struct
+import logging
+from collections import namedtuple
+
+from centaur.renderer import render_panels, EMPTY_PANELS
+from centaur.cache_snapshot import QantaSnapshot, pack_bits, unpack_bits, cache_stamp
+
+
+logger = logging.getLogger('bundle')
+
+MAGIC = b'QBRB'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+BLOB_HEADER = struct.Struct('<II')
+KEYFRAME = struct.Struct('<IIIII')
+MISSING = 0xffff
+
+# a keyframe read from a bundle, with its panels already rendered
+BundleKeyframe = namedtuple('BundleKeyframe', [
+    'position',  # first position that uses this keyframe
+    'text_highlight',  # tuple of bools, positions past its end are not highlighted
+    'panels',
+])
+
+
+def compile_question(snapshot: QantaSnapshot) -> bytes:
+    '''the bundle blob of one question'''
+    n_positions = len(snapshot)
+    n_keyframes = len(snapshot.keyframes)
+    if n_keyframes >= MISSING:
+        raise ValueError(f'{snapshot.question_id} has too many keyframes for a bundle')
+
+    frame_of = [MISSING if x is None else x for x in snapshot.frame_of[1:]]
+    table_size = BLOB_HEADER.size + 2 * n_positions + KEYFRAME.size * n_keyframes
+
+    table = []
+    data = bytearray()
+    for keyframe in snapshot.keyframes:
+        highlight = pack_bits(keyframe.text_highlight)
+        panels = json.dumps(render_panels(keyframe)).encode('utf-8')
+        highlight_offset = table_size + len(data)
+        data += highlight
+        panels_offset = table_size + len(data)
+        data += panels
+        table.append(KEYFRAME.pack(
+            keyframe.position,
+            len(keyframe.text_highlight),
+            highlight_offset,
+            panels_offset,
+            len(panels),
+        ))
+
+    return b''.join([
+        BLOB_HEADER.pack(n_positions, n_keyframes),
+        struct.pack(f'<{n_positions}H', *frame_of),
+        *table,
+        bytes(data),
+    ])
+
+
+def build_bundle(db, questions, path: str, tournament: str = None) -> dict:
+    '''
+    Render the keyframes of `questions` into a bundle at `path`.
+    The file is replaced atomically, so running servers keep the bundle
+    they mapped. Returns the index.
+    '''
+    blobs = []
+    stamps = dict()  # question id -> stamp of its keyframes
+    index = {
+        'tournament': tournament,
+        'built': time.time(),
+        'questions': dict(),
+    }
+    for question in questions:
+        snapshot = QantaSnapshot.load(db, question.id)
+        if len(snapshot.keyframes) == 0:
+            logger.warning(f'{question.id} has no keyframes, skipping')
+            continue
+        blobs.append((question.id, compile_question(snapshot)))
+        stamps[question.id] = list(cache_stamp(db, question.id))
+
+    # offsets depend on the size of the index, which depends on the offsets
+    offsets_size = 0
+    while True:
+        offset = HEADER.size + offsets_size
+        for question_id, blob in blobs:
+            index['questions'][question_id] = [offset, len(blob)] + stamps[question_id]
+            offset += len(blob)
+        encoded = json.dumps(index).encode('utf-8')
+        if len(encoded) == offsets_size:
+            break
+        offsets_size = len(encoded)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for question_id, blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return index
+
+
+class BundledSnapshot:
+    '''
+    A question of a render bundle, with the interface of `QantaSnapshot`
+    the server uses. Keyframes are decoded from the mapped file the first
+    time they are read.
+    '''
+
+    __slots__ = ('question_id', 'buffer', 'offset', 'n_positions', 'n_keyframes', 'decoded')
+
+    def __init__(self, question_id: str, buffer, offset: int):
+        self.question_id = question_id
+        self.buffer = buffer
+        self.offset = offset
+        self.n_positions, self.n_keyframes = BLOB_HEADER.unpack_from(buffer, offset)
+        self.decoded = [None] * self.n_keyframes
+
+    def __len__(self):
+        return self.n_positions
+
+    def _frame_index(self, position: int):
+        if position <= 0 or position > self.n_positions:
+            return None
+        offset = self.offset + BLOB_HEADER.size + 2 * (position - 1)
+        index = struct.unpack_from('<H', self.buffer, offset)[0]
+        return None if index == MISSING else index
+
+    def _decode(self, index: int) -> BundleKeyframe:
+        keyframe = self.decoded[index]
+        if keyframe is None:
+            offset = self.offset + BLOB_HEADER.size + 2 * self.n_positions + KEYFRAME.size * index
+            position, n_highlight, highlight_offset, panels_offset, panels_size = \
+                KEYFRAME.unpack_from(self.buffer, offset)
+            highlight_offset += self.offset
+            panels_offset += self.offset
+            highlight = self.buffer[highlight_offset: highlight_offset + (n_highlight + 7) // 8]
+            panels = self.buffer[panels_offset: panels_offset + panels_size]
+            keyframe = self.decoded[index] = BundleKeyframe(
+                position=position,
+                text_highlight=unpack_bits(highlight, n_highlight),
+                panels=json.loads(panels.decode('utf-8')),
+            )
+        return keyframe
+
+    def keyframe(self, position: int):
+        index = self._frame_index(position)
+        return None if index is None else self._decode(index)
+
+    def panels(self, position: int) -> dict:
+        index = self._frame_index(position)
+        return EMPTY_PANELS if index is None else self._decode(index).panels
+
+
+class RenderBundle:
+    '''A memory-mapped bundle file.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise ValueError(f'{path} is not a version {VERSION} render bundle')
+        index = json.loads(self.buffer[HEADER.size: HEADER.size + index_size].decode('utf-8'))
+        self.tournament = index['tournament']
+        self.built = index['built']
+        self.offsets = {k: v[0] for k, v in index['questions'].items()}
+        # bundles built before stamps never match
+        self.stamps = {k: tuple(v[2:4]) if len(v) >= 4 else ('', '') for k, v in index['questions'].items()}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, question_id: str):
+        return question_id in self.offsets
+
+    def stamp(self, question_id: str) -> tuple:
+        '''(tokens_hash, guesser_version) of the keyframes the question was built from'''
+        return self.stamps.get(question_id)
+
+    def get(self, question_id: str):
+        '''a new `BundledSnapshot` of the question, None if not in the bundle'''
+        offset = self.offsets.get(question_id)
+        if offset is None:
+            return None
+        return BundledSnapshot(question_id, self.buffer, offset)
+
+    def close(self):
+        self.buffer.close()
+
+
+def load_bundles(directory: str) -> list:
+    '''open every `*.bundle` file in `directory`, skipping unreadable ones'''
+    bundles = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.bundle'))):
+        try:
+            bundles.append(RenderBundle(path))
+        except (OSError, ValueError, struct.error):
+            logger.warning(f'cannot read render bundle {path}', exc_info=True)
+            continue
+        logger.info(f'render bundle {path}: {len(bundles[-1])} questions')
+    return bundles
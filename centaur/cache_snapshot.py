@@ -0,0 +1,252 @@
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+from centaur.models import Question, QantaKeyframe
+from centaur.renderer import render_panels, EMPTY_PANELS
+
+
+logger = logging.getLogger('cache_snapshot')
+
+
+# evidence shared by a run of consecutive positions
+Keyframe = namedtuple('Keyframe', [
+    'position',  # first position that uses this keyframe
+    'guesses',
+    'buzz_scores',
+    'matches',
+    'matches_highlight',
+    'text_highlight',  # tuple of bools, positions past its end are not highlighted
+])
+
+# the guesser output at one position, what used to be a QantaCache row
+CacheEntry = namedtuple('CacheEntry', [
+    'position',
+    'guesses',
+    'buzz_scores',
+    'matches',
+    'matches_highlight',
+    'text_highlight',
+])
+
+
+def pack_bits(flags) -> bytes:
+    packed = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+
+def unpack_bits(data, n: int) -> tuple:
+    return tuple(bool(data[i >> 3] >> (i & 7) & 1) for i in range(n))
+
+
+def extends(keyframe: Keyframe, entry) -> bool:
+    '''whether `entry` can be read from `keyframe` without loss'''
+    if (
+        entry.guesses != keyframe.guesses
+        or entry.buzz_scores != keyframe.buzz_scores
+        or entry.matches != keyframe.matches
+        or entry.matches_highlight != keyframe.matches_highlight
+    ):
+        return False
+    highlight = entry.text_highlight or []
+    n = len(keyframe.text_highlight)
+    return tuple(highlight[:n]) == keyframe.text_highlight and not any(highlight[n:])
+
+
+def compress(entries) -> list:
+    '''
+    The keyframes of the per-position `entries` of a question, in order of
+    position: a keyframe starts wherever an entry differs from the previous
+    keyframe.
+    '''
+    keyframes = []
+    for entry in entries:
+        if not keyframes or not extends(keyframes[-1], entry):
+            keyframes.append(Keyframe(
+                position=entry.position,
+                guesses=entry.guesses,
+                buzz_scores=entry.buzz_scores,
+                matches=entry.matches,
+                matches_highlight=entry.matches_highlight,
+                text_highlight=tuple(entry.text_highlight or ()),
+            ))
+    return keyframes
+
+
+def hash_tokens(tokens, length: int) -> str:
+    '''hash of the words a question is cached from, changes when the question is edited'''
+    return hashlib.sha1(json.dumps([length, tokens], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def keyframe_records(question_id: str, keyframes, tokens_hash: str = None, guesser_version: str = None) -> list:
+    '''QantaKeyframe columns of `keyframes`, for bulk inserts'''
+    return [
+        dict(
+            question_id=question_id,
+            position=x.position,
+            guesses=x.guesses,
+            buzz_scores=x.buzz_scores,
+            matches=x.matches,
+            matches_highlight=x.matches_highlight,
+            text_highlight=pack_bits(x.text_highlight),
+            tokens_hash=tokens_hash,
+            guesser_version=guesser_version,
+        )
+        for x in keyframes
+    ]
+
+
+def cache_stamp(db, question_id: str) -> tuple:
+    '''(tokens_hash, guesser_version) of the keyframes of a question, Nones without keyframes or stamps'''
+    row = db.query(QantaKeyframe.tokens_hash, QantaKeyframe.guesser_version) \
+        .filter(QantaKeyframe.question_id == question_id) \
+        .first()
+    return (None, None) if row is None else (row.tokens_hash, row.guesser_version)
+
+
+class QantaSnapshot:
+    '''
+    The guesser output of one question, indexed by position.
+
+    The guesser only runs every few positions, so consecutive positions
+    share the same guesses, matches and highlights (the text highlight only
+    grows by trailing `False`s). Each run is stored once as a `Keyframe`,
+    in the database as a QantaKeyframe row, and positions point into the
+    list of keyframes: reading a position is two list lookups.
+    '''
+
+    __slots__ = ('question_id', 'keyframes', 'frame_of', 'rendered')
+
+    def __init__(self, question_id: str, keyframes, frame_of):
+        self.question_id = question_id
+        self.keyframes = keyframes
+        self.frame_of = frame_of  # position -> keyframe index, positions start at 1
+        self.rendered = dict()  # keyframe index -> display panels
+
+    @classmethod
+    def from_keyframes(cls, question_id: str, keyframes, length: int):
+        '''each keyframe lasts until the next one, the last one until `length`'''
+        keyframes = list(keyframes)
+        if len(keyframes) > 0:
+            length = max(length, keyframes[-1].position)
+        frame_of = [None] * (length + 1)
+        for index, keyframe in enumerate(keyframes):
+            end = keyframes[index + 1].position if index + 1 < len(keyframes) else length + 1
+            frame_of[keyframe.position: end] = [index] * (end - keyframe.position)
+        return cls(question_id, keyframes, frame_of)
+
+    @classmethod
+    def from_entries(cls, question_id: str, entries):
+        '''from per-position entries; positions without an entry have no keyframe'''
+        entries = sorted(entries, key=lambda x: x.position)
+        keyframes = compress(entries)
+        frame_of = [None] * ((entries[-1].position if entries else 0) + 1)
+        index = -1
+        for entry in entries:
+            if index + 1 < len(keyframes) and keyframes[index + 1].position == entry.position:
+                index += 1
+            frame_of[entry.position] = index
+        return cls(question_id, keyframes, frame_of)
+
+    @classmethod
+    def load(cls, db, question_id: str):
+        rows = db.query(QantaKeyframe, Question.length) \
+            .join(Question, Question.id == QantaKeyframe.question_id) \
+            .filter(QantaKeyframe.question_id == question_id) \
+            .order_by(QantaKeyframe.position) \
+            .all()
+        keyframes = [
+            Keyframe(
+                position=row.position,
+                guesses=row.guesses,
+                buzz_scores=row.buzz_scores,
+                matches=row.matches,
+                matches_highlight=row.matches_highlight,
+                text_highlight=unpack_bits(row.text_highlight or b'', 8 * len(row.text_highlight or b'')),
+            )
+            for row, _ in rows
+        ]
+        return cls.from_keyframes(question_id, keyframes, rows[0][1] if rows else 0)
+
+    def __len__(self):
+        return len(self.frame_of) - 1
+
+    def keyframe(self, position: int):
+        if position <= 0 or position >= len(self.frame_of):
+            return None
+        index = self.frame_of[position]
+        return None if index is None else self.keyframes[index]
+
+    def panels(self, position: int) -> dict:
+        '''display panels of the keyframe of `position`, rendered once'''
+        index = self.frame_of[position] if 0 < position < len(self.frame_of) else None
+        if index is None:
+            return EMPTY_PANELS
+        panels = self.rendered.get(index)
+        if panels is None:
+            panels = self.rendered[index] = render_panels(self.keyframes[index])
+        return panels
+
+    def __getitem__(self, position: int):
+        keyframe = self.keyframe(position)
+        if keyframe is None:
+            return None
+        return CacheEntry(
+            position=position,
+            guesses=keyframe.guesses,
+            buzz_scores=keyframe.buzz_scores,
+            matches=keyframe.matches,
+            matches_highlight=keyframe.matches_highlight,
+            text_highlight=keyframe.text_highlight,
+        )
+
+
+class SnapshotCache:
+    '''
+    Snapshots shared by the rooms of one server. A snapshot is loaded when
+    the first room starts the question and dropped when the last room
+    playing it releases it.
+
+    Questions found in one of the precompiled render `bundles` are read
+    from the bundle instead of the database, if the bundle was built from
+    the keyframes in the database: a question regenerated since by
+    scripts/cache_qanta.py has another stamp and is loaded from the
+    database.
+    '''
+
+    def __init__(self, bundles=()):
+        self.bundles = list(bundles)
+        self.snapshots = dict()  # question_id -> QantaSnapshot
+        self.users = dict()  # question_id -> number of rooms using it
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def acquire(self, db, question_id: str) -> QantaSnapshot:
+        snapshot = self.snapshots.get(question_id)
+        if snapshot is None:
+            bundles = [x for x in self.bundles if question_id in x]
+            if len(bundles) > 0:
+                stamp = cache_stamp(db, question_id)
+                bundles = [x for x in bundles if x.stamp(question_id) == stamp]
+                if len(bundles) == 0:
+                    logger.info(f'render bundles of {question_id} are stale, loading it from the database')
+            if len(bundles) > 0:
+                snapshot = bundles[0].get(question_id)
+            else:
+                snapshot = QantaSnapshot.load(db, question_id)
+            self.snapshots[question_id] = snapshot
+        self.users[question_id] = self.users.get(question_id, 0) + 1
+        return snapshot
+
+    def release(self, question_id: str):
+        if question_id not in self.users:
+            return
+        self.users[question_id] -= 1
+        if self.users[question_id] <= 0:
+            self.users.pop(question_id)
+            self.snapshots.pop(question_id, None)
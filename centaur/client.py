@@ -1,134 +1,196 @@
-import json
-import pickle
 import logging
 import numpy as np
 from twisted.internet import reactor
 from autobahn.twisted.websocket import WebSocketClientFactory, \
     WebSocketClientProtocol, connectWS
 
-from util import VIZ
-from util import MSG_TYPE_NEW, MSG_TYPE_RESUME, \
+from centaur.utils import MSG_TYPE_NEW, MSG_TYPE_RESUME, MSG_TYPE_END, \
     MSG_TYPE_BUZZING_REQUEST, MSG_TYPE_BUZZING_ANSWER, \
     MSG_TYPE_BUZZING_GREEN, MSG_TYPE_BUZZING_RED, \
-    MSG_TYPE_RESULT_MINE
-from expected_wins import ExpectedWins
+    MSG_TYPE_RESULT_MINE, PROTOCOL_SNAPSHOT
+from centaur.expected_wins import ExpectedWins
+from centaur import codec
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('client')
 
+# explanations the buzzing model was fit on: guess, highlight, evidence
+VIZ = ['Alternatives', 'Highlights_Question', 'Evidence']
+
+
+class PlayerFactory(WebSocketClientFactory):
+    '''
+    Shared by all simulated players of a process: the expected wins model
+    and the answers of the questions, question id -> answer. Without the
+    answer of a question, players answer it with a placeholder.
+    '''
+
+    def __init__(self, url: str, answers: dict = None, ew: ExpectedWins = None, protocol: str = PROTOCOL_SNAPSHOT,
+                 codecs=('msgpack', 'cbor', 'json')):
+        WebSocketClientFactory.__init__(self, url)
+        self.answers = answers or dict()
+        self.ew = ew or ExpectedWins()
+        self.player_protocol = protocol  # format of RESUME messages asked from the server
+        self.codecs = codecs  # encodings of messages accepted, most preferred first
+        self.buzzing_positions = dict()  # (probability, length) -> position
+
+    def buzzing_position(self, prob: float, length: int) -> int:
+        '''back solve the buzzing position that has expected wins `prob`'''
+        key = (prob, length)
+        if key not in self.buzzing_positions:
+            self.buzzing_positions[key] = self.ew.solve(prob, length)
+        return self.buzzing_positions[key]
+
 
 class PlayerProtocol(WebSocketClientProtocol):
 
     def onOpen(self):
+        self.player_id = None
+        self.player_name = 'QANTA'
         self.qid = None
-        self.text = ''
+        self.length = 0
         self.position = 0
         self.answer = 'Chubakka'
+        self.correct_answer = None
         self.buzzed = False
         self.enabled_viz = {t: False for t in VIZ}
-        self.ew_score = ExpectedWins()
-        with open('data/pace_questions.pkl', 'rb') as f:
-            self.questions = pickle.load(f)
-            self.questions = {x.qid: x for x in self.questions}
+        self.ew_score = self.factory.ew
+        self.start_new_round = False  # ask the server to start a round when joining a paused room
+        self.codec = codec.JSON  # what we send, until the server sends a binary frame
+        self.chosen_codec = codec.JSON
 
     def onClose(self, wasClean, code, reason):
         logger.warning('Connection closed')
 
+    def send(self, msg: dict):
+        self.sendMessage(self.codec.encode(msg), self.codec.binary)
+
+    def choose_codec(self, offered) -> str:
+        '''the first of our codecs that the server offered and we have installed'''
+        for name in self.factory.codecs:
+            if name in offered and name in codec.CODECS:
+                return name
+        return codec.JSON.name
+
     def new_question(self, msg):
-        logger.info('')
-        logger.info('New question')
-        self.qid = msg['qid']
-        self.text = ''
-        self.position = 0
-        self.buzzed = False
-        self.enabled_viz = msg['enabled_viz']
-        self.question = self.questions[self.qid]
-        self.correct_answer = self.question.answer.replace('_', ' ')
-        self.answer = 'Answer Placeholder'
-        msg = {
+        # the server picks an id and name for new players
+        if self.player_id is None:
+            self.player_id = msg.get('player_id')
+            self.player_name = msg.get('player_name', self.player_name)
+        if 'codecs' in msg:
+            self.chosen_codec = codec.CODECS[self.choose_codec(msg['codecs'])]
+        if msg['qid'] != self.qid:
+            logger.info('New question {}'.format(msg['qid']))
+            self.qid = msg['qid']
+            self.position = 0
+            self.buzzed = False
+            self.correct_answer = self.factory.answers.get(self.qid)
+            self.answer = 'Answer Placeholder'
+        self.length = msg.get('length', self.length)
+        reply = {
             'type': MSG_TYPE_NEW,
             'qid': self.qid,
-            'player_name': 'QANTA',
-            'player_id': 'QANTA',
+            'player_id': self.player_id,
+            'player_name': self.player_name,
+            'player_email': f'{self.player_name}@qanta.org',
+            'protocol': self.factory.player_protocol,
+            'codec': self.chosen_codec.name,
         }
-        self.sendMessage(json.dumps(msg).encode('utf-8'))
+        if self.start_new_round:
+            reply['start_new_round'] = self.qid == 'PAUSED'
+            self.start_new_round = False
+        self.send(reply)
+
+    def set_explanations(self, msg):
+        config = msg.get('explanation_config') or dict()
+        self.enabled_viz = {t: bool(config.get(t, False)) for t in VIZ}
 
     def buzz(self):
         if self.buzzed:
             return False
 
         if self.position > 10:
-            if sum(self.enabled_viz.values()) > 1:
+            if sum(self.enabled_viz.values()) > 1 and self.correct_answer is not None:
                 self.answer = self.correct_answer
             return True
         else:
             return False
 
     def update_question(self, msg):
-        if 'text' not in msg:
+        # countdown messages at the end of the question have no new word
+        if 'text' not in msg and 'token' not in msg:
             return
-        print(msg['text'].split()[-1], end=' ', flush=True)
-        self.text += ' ' + msg['text']
+        self.set_explanations(msg)
+        self.position = msg['position']
         if self.buzz():
-            logger.info("\nBuzzing on answer: {}".format(self.answer))
-            msg = {
+            logger.info("Buzzing on answer: {}".format(self.answer))
+            self.send({
                 'type': MSG_TYPE_BUZZING_REQUEST,
                 'text': 'buzzing',
                 'qid': self.qid,
                 'position': self.position
-            }
-            self.sendMessage(json.dumps(msg).encode('utf-8'))
+            })
             self.buzzed = True
         else:
-            msg = {
+            self.send({
                 'type': MSG_TYPE_RESUME,
                 'text': 'not buzzing',
                 'qid': self.qid,
                 'position': self.position
-            }
-            self.sendMessage(json.dumps(msg).encode('utf-8'))
-        self.position += 1
+            })
 
     def send_answer(self, msg):
         logger.info('Answering: {}'.format(self.answer))
-        msg = {
+        self.send({
             'type': MSG_TYPE_BUZZING_ANSWER,
             'text': self.answer,
             'qid': self.qid,
             'position': self.position
-        }
-        self.sendMessage(json.dumps(msg).encode('utf-8'))
+        })
+
+    def buzz_denied(self, msg):
+        logger.info('Not buzzing')
+
+    def handle_result(self, msg):
+        result = 'correct' if msg['result'] else 'wrong'
+        logger.info('Answer is {}'.format(result))
+
+    def end_of_question(self, msg):
+        logger.info('Answer was {}'.format(msg.get('answer')))
 
     def onMessage(self, payload, isBinary):
-        msg = json.loads(payload.decode('utf-8'))
+        if isBinary:
+            # the server accepted our codec, answer in it too
+            self.codec = self.chosen_codec
+            msg = self.codec.decode(payload)
+        else:
+            msg = codec.JSON.decode(payload)
         if msg['type'] == MSG_TYPE_NEW:
-            if msg['qid'] != 0:
-                self.new_question(msg)
+            self.new_question(msg)
         elif msg['type'] == MSG_TYPE_RESUME:
             self.update_question(msg)
+        elif msg['type'] == MSG_TYPE_END:
+            self.end_of_question(msg)
         elif msg['type'] == MSG_TYPE_BUZZING_GREEN:
             self.send_answer(msg)
         elif msg['type'] == MSG_TYPE_BUZZING_RED:
-            logger.info('Not buzzing')
+            self.buzz_denied(msg)
         elif msg['type'] == MSG_TYPE_RESULT_MINE:
-            result = 'correct' if msg['result'] else 'wrong'
-            logger.info('Answer is {}'.format(result))
+            self.handle_result(msg)
 
 
 class SimulatedPlayerProtocol(PlayerProtocol):
 
-    def onOpen(self):
-        super().onOpen()
-        self.weight = np.array([
-            0.3,  # baseline
-            0.21,  # guess
-            0.18,  # highlight
-            0.71,  # evidence
-            0.21 + 0.18 + 0.025,  # guess + highlight
-            0.21 + 0.71 - 0.08,  # guess + evidence
-            0.18 + 0.71 - 0.02,  # highlight + evidence
-            0.21 + 0.18 + 0.71 + 0.02  # everything
-        ])
+    weight = np.array([
+        0.3,  # baseline
+        0.21,  # guess
+        0.18,  # highlight
+        0.71,  # evidence
+        0.21 + 0.18 + 0.025,  # guess + highlight
+        0.21 + 0.71 - 0.08,  # guess + evidence
+        0.18 + 0.71 - 0.02,  # highlight + evidence
+        0.21 + 0.18 + 0.71 + 0.02  # everything
+    ])
 
     def featurize(self) -> np.ndarray:
         viz = (
@@ -148,16 +210,16 @@ class SimulatedPlayerProtocol(PlayerProtocol):
         ])
 
     def buzz(self):
-        if self.buzzed:
+        if self.buzzed or self.length == 0:
             return False
 
         # get probability of correct from regression
         prob = 1 / (1 + np.exp(-self.weight @ self.featurize()))
         # back solve buzzing position
-        buzzing_position = self.ew_score.solve(prob, self.question.length)
+        buzzing_position = self.factory.buzzing_position(float(prob), self.length)
 
         if self.position > buzzing_position:
-            if np.random.binomial(1, prob):
+            if np.random.binomial(1, prob) and self.correct_answer is not None:
                 self.answer = self.correct_answer
             return True
         else:
@@ -165,8 +227,8 @@ class SimulatedPlayerProtocol(PlayerProtocol):
 
 
 if __name__ == '__main__':
-    # factory = WebSocketClientFactory(u"ws://play.qanta.org:9000")
-    factory = WebSocketClientFactory(u"ws://localhost:9000")
+    # factory = PlayerFactory(u"ws://play.qanta.org:9000")
+    factory = PlayerFactory(u"ws://localhost:9000")
     factory.protocol = SimulatedPlayerProtocol
     connectWS(factory)
     reactor.run()
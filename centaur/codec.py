@@ -0,0 +1,192 @@
+'''
+Encodings of the WebSocket messages, negotiated per connection.
+
+The server offers the names of its codecs in the first NEW message and a
+client picks one in its reply, like the RESUME `protocol`. JSON text
+frames are the default and the fallback. Binary codecs replace the
+top-level keys of a message with small integers from `KEYS`; keys that
+are not listed are sent as strings.
+
+A codec encodes the part of a message shared by all recipients once with
+`prepare`, and `join`s it with the per-player overlay of each recipient,
+see `Room.broadcast`.
+'''
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+# top-level message keys -> integer keys of the binary codecs. Append only,
+# clients decode by position.
+KEYS = [
+    'type', 'qid', 'position', 'length', 'text', 'token', 'sent_at',
+    'can_buzz', 'explanation_config', 'guesses', 'matches',
+    'matches_highlighted', 'autopilot_prediction', 'highlight', 'highlights',
+    'tokens', 'bells', 'text_highlighted', 'info_text', 'history_entries',
+    'player_list', 'player_id', 'player_name', 'player_email', 'room_id',
+    'task_completed', 'tournament', 'question_index', 'n_questions',
+    'protocol', 'protocols', 'codec', 'codecs', 'answer', 'result', 'guess',
+    'score', 'start_new_round', 'chosen_round',
+]
+KEY_IDS = {key: i for i, key in enumerate(KEYS)}
+
+
+class Codec:
+    '''encodes a message dict to the payload of one frame, and back'''
+
+    name = None
+    binary = True
+
+    def encode(self, msg: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> dict:
+        raise NotImplementedError
+
+    def prepare(self, msg: dict):
+        '''encode `msg` before its overlay is known'''
+        return msg
+
+    def join(self, prepared, overlay: dict) -> bytes:
+        '''the payload of the prepared message updated with `overlay`'''
+        return self.encode(dict(prepared, **overlay))
+
+
+class JsonCodec(Codec):
+
+    name = 'json'
+    binary = False
+
+    def encode(self, msg: dict) -> bytes:
+        if orjson is not None:
+            # like json.dumps, accept int keys and numpy floats (scores of the expected wins model)
+            return orjson.dumps(msg, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(msg).encode('utf-8')
+
+    def decode(self, payload: bytes) -> dict:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload.decode('utf-8'))
+
+    def prepare(self, msg: dict) -> bytes:
+        # the object without its closing brace, ready for more members
+        body = self.encode(msg)
+        return body[:-1] + b',' if len(body) > 2 else b'{'
+
+    def join(self, prepared: bytes, overlay: dict) -> bytes:
+        return prepared + self.encode(overlay)[1:]
+
+
+class MapCodec(Codec):
+    '''
+    Binary codecs with integer keys. A prepared message is the number of
+    its entries and their encoding, without the map header, so that the
+    overlay entries can be appended.
+    '''
+
+    def dumps(self, obj) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, payload: bytes):
+        raise NotImplementedError
+
+    def map_header(self, n: int) -> bytes:
+        raise NotImplementedError
+
+    def entries(self, msg: dict) -> bytes:
+        return self.dumps({KEY_IDS.get(k, k): v for k, v in msg.items()})[len(self.map_header(len(msg))):]
+
+    def encode(self, msg: dict) -> bytes:
+        return self.dumps({KEY_IDS.get(k, k): v for k, v in msg.items()})
+
+    def decode(self, payload: bytes) -> dict:
+        msg = self.loads(payload)
+        return {KEYS[k] if isinstance(k, int) and k < len(KEYS) else k: v for k, v in msg.items()}
+
+    def prepare(self, msg: dict):
+        return len(msg), self.entries(msg)
+
+    def join(self, prepared, overlay: dict) -> bytes:
+        n, entries = prepared
+        return self.map_header(n + len(overlay)) + entries + self.entries(overlay)
+
+
+class MsgpackCodec(MapCodec):
+
+    name = 'msgpack'
+
+    def __init__(self):
+        # reused, messages are only encoded on the reactor thread
+        self.packer = msgpack.Packer(use_bin_type=True)
+
+    def dumps(self, obj) -> bytes:
+        return self.packer.pack(obj)
+
+    def loads(self, payload: bytes):
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+    def map_header(self, n: int) -> bytes:
+        if n < 16:
+            return bytes([0x80 | n])
+        if n < 0x10000:
+            return b'\xde' + n.to_bytes(2, 'big')
+        return b'\xdf' + n.to_bytes(4, 'big')
+
+
+class CborCodec(MapCodec):
+
+    name = 'cbor'
+
+    def dumps(self, obj) -> bytes:
+        return cbor2.dumps(obj)
+
+    def loads(self, payload: bytes):
+        return cbor2.loads(payload)
+
+    def map_header(self, n: int) -> bytes:
+        if n < 24:
+            return bytes([0xa0 | n])
+        if n < 0x100:
+            return b'\xb8' + bytes([n])
+        if n < 0x10000:
+            return b'\xb9' + n.to_bytes(2, 'big')
+        return b'\xba' + n.to_bytes(4, 'big')
+
+
+JSON = JsonCodec()
+CODECS = {JSON.name: JSON}  # name -> codec, of the libraries installed
+
+
+def register(codec: Codec):
+    CODECS[codec.name] = codec
+
+
+if msgpack is not None:
+    register(MsgpackCodec())
+if cbor2 is not None:
+    register(CborCodec())
+
+
+def available(preference) -> list:
+    '''names in `preference` that are installed, in order'''
+    return [x for x in preference if x in CODECS]
+
+
+def get(name: str, preference) -> Codec:
+    '''the codec called `name` if it is allowed by `preference` and installed, else JSON'''
+    if name in preference and name in CODECS:
+        return CODECS[name]
+    return JSON
@@ -1,7 +1,55 @@
-CODE_DIR = '/fs/clip-quiz/shifeng/centaur'
-DATA_DIR = f'{CODE_DIR}/data'
+import os
+import ast
+
+
+def env(name: str, default):
+    '''`default`, or the value of the environment variable CENTAUR_<name>'''
+    value = os.environ.get(f'CENTAUR_{name}')
+    if value is None:
+        return default
+    if isinstance(default, str):
+        return value
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes')
+    return type(default)(ast.literal_eval(value))
+
+
+# every setting can be overridden from the environment, e.g.
+# CENTAUR_SQLALCHEMY_DATABASE_URL=sqlite:// for an in-memory database
+CODE_DIR = env('CODE_DIR', '/fs/clip-quiz/shifeng/centaur')
+DATA_DIR = env('DATA_DIR', f'{CODE_DIR}/data')
 # SQLALCHEMY_DATABASE_URL = 'postgresql+psycopg2://shifeng@localhost:5433/augment'
-SQLALCHEMY_DATABASE_URL = 'postgresql+psycopg2://shifeng@0.tcp.ngrok.io:13974/augment'
-USE_MULTIPROCESSING = True
-USER_STATS_CACHE = True
-MP_CONTEXT = 'fork'
+SQLALCHEMY_DATABASE_URL = env('SQLALCHEMY_DATABASE_URL', 'postgresql+psycopg2://shifeng@0.tcp.ngrok.io:13974/augment')
+# connection pool of each process, not used by SQLite
+DB_POOL_SIZE = env('DB_POOL_SIZE', 5)
+DB_MAX_OVERFLOW = env('DB_MAX_OVERFLOW', 10)  # connections opened beyond the pool when it is exhausted
+DB_POOL_RECYCLE = env('DB_POOL_RECYCLE', 1800)  # seconds before a connection is replaced, under server-side idle timeouts
+DB_POOL_PRE_PING = env('DB_POOL_PRE_PING', True)  # test connections on checkout, replacing dropped ones
+USE_MULTIPROCESSING = env('USE_MULTIPROCESSING', True)
+USER_STATS_CACHE = env('USER_STATS_CACHE', True)
+MP_CONTEXT = env('MP_CONTEXT', 'fork')
+WRITE_BEHIND_RETRIES = env('WRITE_BEHIND_RETRIES', 3)  # attempts per transaction of the write-behind writer
+WRITE_BEHIND_RETRY_DELAY = env('WRITE_BEHIND_RETRY_DELAY', 1.0)  # seconds, doubled after each failed attempt
+WRITE_BEHIND_MAX_BATCHES = env('WRITE_BEHIND_MAX_BATCHES', 50)  # questions committed in one transaction
+WRITE_BEHIND_DEAD_LETTER = env('WRITE_BEHIND_DEAD_LETTER', f'{DATA_DIR}/dead_letter.jsonl')  # writes that cannot be committed
+MAX_ROOMS = env('MAX_ROOMS', 64)  # rooms hosted by one server process
+ROOM_IDLE_TIMEOUT = env('ROOM_IDLE_TIMEOUT', 300)  # seconds an empty room is kept before it is closed
+WORKER_HEARTBEAT_INTERVAL = env('WORKER_HEARTBEAT_INTERVAL', 2.0)  # seconds between heartbeats of a launcher worker
+WORKER_HEARTBEAT_MISSES = env('WORKER_HEARTBEAT_MISSES', 5)  # missed heartbeats before the launcher restarts a worker
+WORKER_START_TIMEOUT = env('WORKER_START_TIMEOUT', 60.0)  # seconds a new worker has to send its first heartbeat
+RENDER_BUNDLE_DIR = env('RENDER_BUNDLE_DIR', f'{DATA_DIR}/bundles')  # precompiled render bundles mapped by the server
+ANSWER_VOCABULARY = env('ANSWER_VOCABULARY', 'web/answers.0515.json')  # written by scripts/update_answers.py, served by /autocomplete
+# (minimum answer length, edits accepted) for typos in answers, lengths without spaces
+TYPO_TOLERANCE = env('TYPO_TOLERANCE', ((0, 0), (8, 1), (14, 2)))
+WHEEL_RESOLUTION = env('WHEEL_RESOLUTION', 0.05)  # seconds per tick of the timing wheel of the room timers
+WHEEL_SLOTS = env('WHEEL_SLOTS', 512)
+WHEEL_MAX_CATCHUP = env('WHEEL_MAX_CATCHUP', 10)  # missed ticks replayed after a stall, beyond that their calls run once
+CODECS = env('CODECS', ('msgpack', 'cbor', 'json'))  # encodings offered to clients, fastest first, see centaur/codec.py
+GUESSER_URL = env('GUESSER_URL', 'http://0.0.0.0:6000')  # guesser service queried by centaur/machine_client.py
+GUESSER_TIMEOUT = env('GUESSER_TIMEOUT', 60.0)  # seconds per request to the guesser
+GUESSER_VERSION = env('GUESSER_VERSION', 'qanta-1')  # change when the guesser service is retrained, cached questions are regenerated
+GUESSER = env('GUESSER', 'http')  # 'http' for the service at GUESSER_URL, 'tfidf' for the in-process index at GUESSER_INDEX
+GUESSER_INDEX = env('GUESSER_INDEX', f'{DATA_DIR}/guesser_index.npz')  # built by scripts/build_guesser_index.py
+GUESSER_BATCH = env('GUESSER_BATCH', 256)  # texts scored per matrix product by the in-process guesser
+CACHE_WORKERS = env('CACHE_WORKERS', 8)  # questions cached concurrently by scripts/cache_qanta.py
+CACHE_BATCH_ROWS = env('CACHE_BATCH_ROWS', 1000)  # QantaKeyframe rows per bulk insert of scripts/cache_qanta.py
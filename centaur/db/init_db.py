@@ -0,0 +1,60 @@
+'''
+Database engines, and the schema of new databases for local runs on
+SQLite:
+
+    python -m centaur.db.init_db sqlite:///centaur.db
+
+The server creates the schema by itself when `SQLALCHEMY_DATABASE_URL` is
+a SQLite URL, including `sqlite://` for an in-memory database. Postgres
+databases are created and migrated with alembic.
+'''
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.engine import make_url
+
+from centaur.config import settings
+from centaur.db.base_class import Base
+import centaur.models  # noqa, registers the tables on Base
+
+
+def init_db(engine):
+    '''create the tables that do not exist yet'''
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def create_db_engine(url: str):
+    '''
+    Engine for `url`, with the pool of the settings. SQLite connections
+    are shared with the write-behind thread, and an in-memory database is
+    a single connection so that every session sees the same data. That
+    connection must not be used by two threads at once: the server does
+    not commit on a thread of its own then, see `single_connection`.
+    '''
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+
+    kwargs = {'connect_args': {'check_same_thread': False}}
+    if url.database in (None, '', ':memory:'):
+        kwargs['poolclass'] = StaticPool
+    return create_engine(url, **kwargs)
+
+
+def single_connection(engine) -> bool:
+    '''whether every session of `engine` shares one connection'''
+    return isinstance(engine.pool, StaticPool)
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite:///centaur.db'
+    engine = init_db(create_db_engine(url))
+    print(f'created the tables of {engine.url}: {", ".join(sorted(Base.metadata.tables))}')
@@ -1,13 +1,33 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import event
 from sqlalchemy import exc
 
 from centaur.config import settings
+from centaur.db.init_db import create_db_engine, init_db
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_db_engine(settings.SQLALCHEMY_DATABASE_URL)
+# objects stay readable after their session is closed, without a refetch
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+
+@contextmanager
+def session_scope(session_factory=SessionLocal):
+    '''
+    A session for one unit of work, e.g. one event of a room: committed
+    at the end, rolled back if it raises, and closed either way, so that
+    a failed transaction does not leak into the next one.
+    '''
+    session = session_factory()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 
 @event.listens_for(engine, "connect")
@@ -25,3 +45,8 @@ def checkout(dbapi_connection, connection_record, connection_proxy):
             "attempting to check out in pid %s" %
             (connection_record.info['pid'], pid)
         )
+
+
+# local SQLite databases get their schema here, Postgres is migrated with alembic
+if engine.dialect.name == 'sqlite':
+    init_db(engine)
@@ -0,0 +1,6 @@
+from sqlalchemy import JSON
+from sqlalchemy.dialects import postgresql
+
+
+# JSONB on Postgres, the generic JSON type (text) on SQLite and others
+JSONType = JSON().with_variant(postgresql.JSONB(), 'postgresql')
@@ -0,0 +1,96 @@
+from twisted.internet.defer import Deferred
+
+
+class DeferredRegistry:
+    '''
+    Deferreds waiting for a player's latest response to have `key` set to
+    `value`, indexed by player and by `(key, value)` so that a response
+    only resolves the waits of its sender.
+
+    A deferred is removed from the registry as soon as it fires, either
+    because the response arrived or because it timed out.
+    '''
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.waits = dict()  # player -> key -> value -> [deferred]
+
+    def __len__(self):
+        return sum(
+            len(deferreds)
+            for by_key in self.waits.values()
+            for by_value in by_key.values()
+            for deferreds in by_value.values()
+        )
+
+    @staticmethod
+    def matches(player, key, value) -> bool:
+        return (
+            player.active
+            and player.response is not None
+            and key in player.response
+            and player.response.get(key, None) == value
+        )
+
+    def wait(self, player, key, value, timeout: float = None) -> Deferred:
+        '''
+        Get a deferred that fires when `player` responds with `key` set to
+        `value`. It fires right away if the latest response already
+        matches, and errbacks with `TimeoutError` after `timeout` seconds.
+        '''
+        deferred = Deferred()
+        if self.matches(player, key, value):
+            deferred.callback(None)
+            return deferred
+
+        by_value = self.waits.setdefault(player, dict()).setdefault(key, dict())
+        by_value.setdefault(value, []).append(deferred)
+        if timeout is not None:
+            deferred.addTimeout(timeout, self.clock)
+        # passes the result through, so callers' callbacks still see it
+        deferred.addBoth(self._remove, player, key, value, deferred)
+        return deferred
+
+    def _remove(self, result, player, key, value, deferred):
+        by_key = self.waits.get(player)
+        if by_key is None:
+            return result
+        by_value = by_key.get(key, {})
+        deferreds = by_value.get(value, [])
+        if deferred in deferreds:
+            deferreds.remove(deferred)
+        if len(deferreds) == 0:
+            by_value.pop(value, None)
+        if len(by_value) == 0:
+            by_key.pop(key, None)
+        if len(by_key) == 0:
+            self.waits.pop(player, None)
+        return result
+
+    def cancel(self):
+        '''cancel every wait, their errbacks get a `CancelledError`'''
+        waits, self.waits = self.waits, dict()
+        for by_key in waits.values():
+            for by_value in by_key.values():
+                for deferreds in by_value.values():
+                    for deferred in deferreds:
+                        deferred.cancel()
+
+    def check(self, player):
+        '''fire the deferreds that the latest response of `player` resolves'''
+        by_key = self.waits.get(player)
+        if by_key is None or not player.active or player.response is None:
+            return
+        for key in list(by_key):
+            if key not in player.response or key not in by_key:
+                continue
+            try:
+                deferreds = by_key[key].pop(player.response[key], None)
+            except TypeError:
+                # unhashable value in the response, cannot match
+                continue
+            if deferreds is None:
+                continue
+            for deferred in deferreds:
+                if not deferred.called:
+                    deferred.callback(None)
@@ -0,0 +1,336 @@
+'''
+Run the game server as several worker processes behind one router.
+
+    python -m centaur.launcher --workers 4 --port 9000
+
+Each worker is a `BroadcastServerFactory` listening on loopback and owns
+the rooms that hash to it. The router accepts every WebSocket connection
+on the public port, reads the path of the handshake to find the room, and
+splices the TCP connection to the worker that owns the room.
+
+Workers are forked from the launcher before any reactor exists. Database
+connections inherited across the fork are discarded by the pid check in
+`centaur/db/session.py`. Workers send a heartbeat with their rooms and
+players to the launcher, which serves them as JSON on `--health-port`
+and restarts workers that die or stop reporting. Worker i serves its
+metrics on loopback port `--health-port` + 1 + i.
+'''
+import os
+import sys
+import json
+import time
+import zlib
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from centaur.config import settings
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('launcher')
+
+MAX_HEADER_BYTES = 16 * 1024  # a WebSocket handshake is far smaller than this
+
+
+def worker_for_room(room_id: str, n_workers: int) -> int:
+    '''index of the worker that owns `room_id`, same in every process'''
+    return zlib.crc32(room_id.encode('utf-8')) % n_workers
+
+
+def reset_signals():
+    '''drop the handlers inherited from the launcher, twisted installs its own'''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def run_worker(index: int, port: int, conn, heartbeat_interval: float, metrics_port: int = None):
+    '''entry point of a worker process'''
+    reset_signals()
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from twisted.web.server import Site
+    from autobahn.twisted.websocket import listenWS
+    from centaur.server import BroadcastServerFactory, BroadcastServerProtocol
+    from centaur.metrics import MetricsResource
+
+    factory = BroadcastServerFactory(f'ws://127.0.0.1:{port}')
+    factory.protocol = BroadcastServerProtocol
+    listenWS(factory, interface='127.0.0.1')
+    if metrics_port is not None:
+        reactor.listenTCP(metrics_port, Site(MetricsResource()), interface='127.0.0.1')
+
+    def heartbeat():
+        rooms = {
+            room_id: sum(x.active for x in room.players.values())
+            for room_id, room in factory.rooms.items()
+        }
+        try:
+            conn.send({
+                'index': index,
+                'pid': os.getpid(),
+                'port': port,
+                'time': time.time(),
+                'rooms': rooms,
+                'players': sum(rooms.values()),
+                'snapshots': len(factory.snapshots),
+                'tick_lateness': factory.wheel.max_lateness,
+            })
+        except (BrokenPipeError, EOFError, OSError):
+            # launcher is gone
+            reactor.stop()
+
+    LoopingCall(heartbeat).start(heartbeat_interval)
+    logger.info(f'[worker {index}] pid {os.getpid()} listening on 127.0.0.1:{port}')
+    reactor.run()
+
+
+def run_router(port: int, worker_ports: list, web_port: int = None):
+    '''entry point of the router process'''
+    reset_signals()
+    from twisted.internet import reactor, protocol
+    from twisted.protocols import portforward
+    from twisted.web.server import Site
+    from twisted.web.static import File
+    from centaur.utils import parse_room_id
+    from centaur.autocomplete import AnswerCompleter, AutocompleteResource
+
+    class WorkerClient(portforward.ProxyClient):
+
+        def connectionMade(self):
+            # replay the handshake read while picking the worker
+            self.transport.write(self.factory.handshake)
+            portforward.ProxyClient.connectionMade(self)
+
+    class WorkerClientFactory(portforward.ProxyClientFactory):
+        protocol = WorkerClient
+
+    class RouterProtocol(portforward.ProxyServer):
+        '''buffers the handshake until the path is known, then proxies bytes'''
+
+        def connectionMade(self):
+            self.buffer = b''
+            self.client = None  # factory of the connection to the worker
+
+        def dataReceived(self, data):
+            if self.peer is not None:
+                self.peer.transport.write(data)
+                return
+            if self.client is not None:
+                # read before the worker connection was made
+                self.client.handshake += data
+                return
+            self.buffer += data
+            if self.buffer.find(b'\r\n\r\n') == -1:
+                if len(self.buffer) > MAX_HEADER_BYTES:
+                    self.transport.loseConnection()
+                return
+
+            request_line = self.buffer.split(b'\r\n', 1)[0].decode('latin-1').split()
+            path = request_line[1] if len(request_line) > 1 else '/'
+            room_id = parse_room_id(path)
+            worker_port = worker_ports[worker_for_room(room_id, len(worker_ports))]
+
+            self.client = WorkerClientFactory()
+            self.client.setServer(self)
+            self.client.handshake = self.buffer
+            self.buffer = b''
+            self.transport.pauseProducing()
+            reactor.connectTCP('127.0.0.1', worker_port, self.client)
+
+    factory = protocol.ServerFactory()
+    factory.protocol = RouterProtocol
+    reactor.listenTCP(port, factory)
+    if web_port is not None:
+        webdir = File('web/index.html')
+        webdir.putChild(b'autocomplete', AutocompleteResource(AnswerCompleter.load(settings.ANSWER_VOCABULARY)))
+        reactor.listenTCP(web_port, Site(webdir))
+    logger.info(f'[router] pid {os.getpid()} on :{port} -> {worker_ports}')
+    reactor.run()
+
+
+class Launcher:
+    '''Forks and supervises the workers and the router.'''
+
+    def __init__(
+        self,
+        n_workers: int,
+        port: int = 9000,
+        health_port: int = None,
+        web_port: int = None,
+        heartbeat_interval: float = settings.WORKER_HEARTBEAT_INTERVAL,
+        start_timeout: float = settings.WORKER_START_TIMEOUT,
+    ):
+        self.n_workers = n_workers
+        self.port = port
+        self.worker_ports = [port + 1 + i for i in range(n_workers)]
+        self.health_port = health_port
+        # each worker serves its own /metrics after the health port
+        self.metrics_ports = [
+            None if health_port is None else health_port + 1 + i
+            for i in range(n_workers)
+        ]
+        self.web_port = web_port
+        self.heartbeat_interval = heartbeat_interval
+        self.start_timeout = start_timeout
+        self.context = multiprocessing.get_context(settings.MP_CONTEXT)
+        self.workers = [None] * n_workers  # index -> Process
+        self.conns = [None] * n_workers  # index -> launcher end of the heartbeat pipe
+        self.health = [dict() for _ in range(n_workers)]  # index -> latest heartbeat
+        self.started = [0.0] * n_workers
+        self.restarts = [0] * n_workers
+        self.router = None
+        self.health_server = None
+        self.stopping = False
+
+    def start_worker(self, index: int):
+        conn, child_conn = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.worker_ports[index], child_conn, self.heartbeat_interval, self.metrics_ports[index]),
+            name=f'centaur-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.workers[index] = process
+        self.conns[index] = conn
+        self.health[index] = dict()
+        self.started[index] = time.time()
+
+    def start(self):
+        for i in range(self.n_workers):
+            self.start_worker(i)
+        self.router = self.context.Process(
+            target=run_router,
+            args=(self.port, self.worker_ports, self.web_port),
+            name='centaur-router',
+            daemon=True,
+        )
+        self.router.start()
+        if self.health_port is not None:
+            self.start_health_server()
+
+    def report(self) -> dict:
+        now = time.time()
+        workers = []
+        for i, process in enumerate(self.workers):
+            beat = self.health[i]
+            workers.append({
+                'index': i,
+                'pid': process.pid if process is not None else None,
+                'port': self.worker_ports[i],
+                'metrics_port': self.metrics_ports[i],
+                'alive': process is not None and process.is_alive(),
+                'restarts': self.restarts[i],
+                'heartbeat_age': round(now - beat['time'], 3) if 'time' in beat else None,
+                'rooms': beat.get('rooms', {}),
+                'players': beat.get('players', 0),
+                'snapshots': beat.get('snapshots', 0),
+                'tick_lateness': beat.get('tick_lateness', 0.0),
+            })
+        return {
+            'router': {'pid': self.router.pid, 'alive': self.router.is_alive(), 'port': self.port},
+            'workers': workers,
+        }
+
+    def start_health_server(self):
+        launcher = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = json.dumps(launcher.report()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.health_server = ThreadingHTTPServer(('127.0.0.1', self.health_port), HealthHandler)
+        thread = threading.Thread(target=self.health_server.serve_forever, daemon=True)
+        thread.start()
+
+    def poll(self, timeout: float):
+        '''read heartbeats for up to `timeout` seconds and restart dead workers'''
+        conns = [x for x in self.conns if x is not None]
+        for conn in wait(conns, timeout=timeout):
+            try:
+                while conn.poll():
+                    beat = conn.recv()
+                    self.health[beat['index']] = beat
+            except (EOFError, OSError):
+                index = self.conns.index(conn)
+                self.conns[index] = None
+
+        if self.stopping:
+            return
+        now = time.time()
+        grace = self.heartbeat_interval * settings.WORKER_HEARTBEAT_MISSES
+        for i, process in enumerate(self.workers):
+            if 'time' in self.health[i]:
+                late = now - self.health[i]['time'] > grace + self.heartbeat_interval
+            else:
+                # no heartbeat before the imports and the reactor are done
+                late = now - self.started[i] > self.start_timeout
+            if process.is_alive() and not late:
+                continue
+            logger.warning(f'worker {i} (pid {process.pid}) is unresponsive, restarting')
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+            if self.conns[i] is not None:
+                self.conns[i].close()
+            self.restarts[i] += 1
+            self.start_worker(i)
+
+    def stop(self):
+        self.stopping = True
+        for process in self.workers + [self.router]:
+            if process is not None and process.is_alive():
+                # twisted stops the reactor on SIGTERM, which flushes pending writes
+                process.terminate()
+        for process in self.workers + [self.router]:
+            if process is not None:
+                process.join(timeout=10)
+        if self.health_server is not None:
+            self.health_server.shutdown()
+
+    def run(self):
+
+        def handle_signal(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+        try:
+            self.start()
+            while not self.stopping:
+                self.poll(self.heartbeat_interval)
+        finally:
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='run the game server as several worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--health-port', type=int, default=9100)
+    parser.add_argument('--web-port', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if 'twisted.internet.reactor' in sys.modules:
+        raise RuntimeError('the reactor must not be installed before forking workers')
+
+    Launcher(args.workers, args.port, args.health_port, args.web_port).run()
+
+
+if __name__ == '__main__':
+    main()
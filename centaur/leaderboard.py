@@ -0,0 +1,87 @@
+from centaur.models import Player, PlayerRoundStat
+
+
+class Standing:
+
+    __slots__ = ('player_id', 'player_name', 'player_email', 'qb_score', 'ew_score',
+                 'questions_answered', 'questions_correct')
+
+    def __init__(self, player_id: str, player_name: str = None, player_email: str = None):
+        self.player_id = player_id
+        self.player_name = player_name
+        self.player_email = player_email
+        self.qb_score = 0
+        self.ew_score = 0
+        self.questions_answered = set()
+        self.questions_correct = set()
+
+
+class Leaderboard:
+    '''
+    Scores of the players in one room and round, kept in memory.
+
+    Seeded once from `PlayerRoundStat` when the round starts, then updated
+    by the server at the end of every question, with the same results as
+    the round stats, so producing the player list does not touch the
+    database.
+    '''
+
+    def __init__(self, room_id: str = None):
+        self.room_id = room_id
+        self.standings = dict()  # player_id -> Standing
+
+    @classmethod
+    def load(cls, db, room_id: str):
+        leaderboard = cls(room_id)
+        rows = db.query(PlayerRoundStat, Player.name, Player.email) \
+            .join(Player, Player.id == PlayerRoundStat.player_id) \
+            .filter(PlayerRoundStat.room_id == room_id)
+        for round_stat, name, email in rows:
+            standing = leaderboard.get(round_stat.player_id, name, email)
+            standing.qb_score = round_stat.qb_score
+            standing.ew_score = round_stat.ew_score
+            standing.questions_answered = set(round_stat.questions_answered)
+            standing.questions_correct = set(round_stat.questions_correct)
+        return leaderboard
+
+    def get(self, player_id: str, player_name: str = None, player_email: str = None) -> Standing:
+        standing = self.standings.get(player_id)
+        if standing is None:
+            standing = self.standings[player_id] = Standing(player_id)
+        if player_name is not None:
+            standing.player_name = player_name
+        if player_email is not None:
+            standing.player_email = player_email
+        return standing
+
+    def add(self, player, question_id: str, qb_score: int, ew_score: float, result: bool):
+        '''record the scored buzz of `player` on `question_id`'''
+        standing = self.get(player.player_id, player.player_name, player.player_email)
+        standing.qb_score += qb_score
+        standing.ew_score += ew_score
+        standing.questions_answered.add(question_id)
+        if result:
+            standing.questions_correct.add(question_id)
+
+    def player_list(self, players) -> list:
+        '''the sorted player list of the active ones among `players`'''
+        player_list = []
+        for player in players:
+            if not player.active:
+                continue
+            standing = self.get(player.player_id, player.player_name, player.player_email)
+            player_list.append({
+                'player_id': player.player_id,
+                'player_name': player.player_name,
+                'score': standing.qb_score,
+                'ew_score': round(standing.ew_score, 2),
+                'questions_answered': len(standing.questions_answered),
+                'questions_correct': len(standing.questions_correct),
+                'active': True,
+            })
+        player_list = sorted(player_list, key=lambda x: (x['active'], x['score']), reverse=True)
+        return player_list
+
+    def ranking(self) -> list:
+        '''standings of everyone in the round, by decreasing score'''
+        return sorted(self.standings.values(), key=lambda x: -x.qb_score)
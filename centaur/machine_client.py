@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 from nltk.corpus import stopwords as sw
 
 from centaur.utils import tokenize_question
+from centaur.config import settings
 
 stopwords = set(sw.words('english'))
 
@@ -15,6 +16,8 @@ logger = logging.getLogger('guesser_buzzer_client')
 
 class ThresholdBuzzer:
 
+    version = 'threshold-0.05'  # change with the rule below
+
     def __init__(self):
         self.step = 0
 
@@ -34,10 +37,50 @@ class ThresholdBuzzer:
             return [0, 1]
 
 
+class HttpGuesser:
+    '''
+    The guesser service at `url`. One keep-alive connection for all
+    calls; a Session is not thread safe, use one HttpGuesser per thread.
+    '''
+
+    def __init__(self, url: str = None):
+        self.url = url or settings.GUESSER_URL
+        self.session = requests.Session()
+        self.version = settings.GUESSER_VERSION
+
+    def post(self, path: str, text: str):
+        response = self.session.post(self.url + path, data={'text': text}, timeout=settings.GUESSER_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def guess(self, texts: list) -> list:
+        '''answer -> score for each text'''
+        return [self.post('/api/centaur_answer_question', x) for x in texts]
+
+    def highlight(self, texts: list) -> list:
+        '''for each text, passages that match it with the matched words in <em>'''
+        return [self.post('/api/get_highlights', x) for x in texts]
+
+
+def make_guesser(name: str = settings.GUESSER, url: str = None, index: str = None):
+    '''the guesser backend called `name`, see `settings.GUESSER`'''
+    if name == 'http':
+        return HttpGuesser(url)
+    if name == 'tfidf':
+        from centaur.tfidf_guesser import TfidfGuesser
+        return TfidfGuesser.load(index or settings.GUESSER_INDEX)
+    raise ValueError(f'unknown guesser {name}')
+
+
 class GuesserBuzzer:
 
-    def __init__(self, buzzer_model_dir='data/neo_0.npz'):
+    def __init__(self, buzzer_model_dir='data/neo_0.npz', url: str = None, guesser=None):
         self.buzzer = ThresholdBuzzer()
+        # backend with guess(texts) and highlight(texts), the service at `url` by default
+        self.guesser = guesser or HttpGuesser(url)
+        self.requests = 0  # calls to the guesser, one per text guessed or highlighted
+        # stamped on the cached questions, see scripts/cache_qanta.py
+        self.version = f'{self.guesser.version}/{self.buzzer.version}'
 
         self.ok_to_buzz = True
         self.answer = ''
@@ -52,13 +95,23 @@ class GuesserBuzzer:
         self.matches = []
 
     def buzz(self, tokens, position):
-        text = ' '.join(tokens)
-
-        guesses = requests.post(
-            'http://0.0.0.0:6000/api/centaur_answer_question',
-            data={'text': text},
-        ).json()
+        return next(self.buzz_prefixes(tokens, [position]))
 
+    def buzz_prefixes(self, tokens, positions):
+        '''
+        `buzz` at each of `positions` of the question `tokens`, with one
+        batched call to the guesser. Yields the buzz scores; the guesses and
+        matches of a position are read from the model after its yield.
+        '''
+        texts = [' '.join(tokens[:x]) for x in positions]
+        all_guesses = self.guesser.guess(texts)
+        all_matches = self.guesser.highlight(texts)
+        self.requests += 2 * len(texts)
+        for position, guesses, matches in zip(positions, all_guesses, all_matches):
+            yield self.observe(tokens, position, guesses, matches)
+
+    def observe(self, tokens, position, guesses, matches):
+        '''update the model with the guesser output at `position`, and buzz'''
         guesses = sorted(guesses.items(), key=lambda x: x[1])[::-1]
         if len(guesses) > 0:
             guesses = guesses[:5]
@@ -74,10 +127,7 @@ class GuesserBuzzer:
             if isinstance(buzz_scores, np.ndarray):
                 buzz_scores = buzz_scores.tolist()
 
-        self.matches = requests.post(
-            'http://0.0.0.0:6000/api/get_highlights',
-            data={'text': text},
-        ).json()
+        self.matches = matches
 
         text_highlight, tokenized_matches, matches_highlight = self.get_matched(tokens, position, self.matches)
         self.text_highlight = text_highlight
@@ -0,0 +1,185 @@
+'''
+Latency and traffic metrics of the game server, in the Prometheus text
+format on `/metrics` of the web `Site`.
+
+Recording a value is a bisect and two additions; nothing is formatted
+until the endpoint is scraped. Gauges read their value from a callback at
+scrape time.
+'''
+import math
+import threading
+from bisect import bisect_left
+
+from twisted.web.resource import Resource
+
+
+# seconds, from a fraction of a millisecond to a few seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+def format_labels(names, values) -> str:
+    if len(names) == 0:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class HistogramChild:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        # the write-behind thread observes too
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, count: int = 1):
+        '''record `count` observations of `value`'''
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += count
+            self.sum += value * count
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self.children = dict()  # label values -> HistogramChild
+        if len(self.labelnames) == 0:
+            self.children[()] = HistogramChild(self.buckets)
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values) -> HistogramChild:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float, count: int = 1):
+        self.children[()].observe(value, count)
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames + ('le',), values + (format_value(bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge:
+    '''a value read at scrape time from `function`, a dict of label values -> value'''
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        (REGISTRY if registry is None else registry).register(self)
+
+    def samples(self):
+        for values, value in sorted(self.function().items()):
+            if not isinstance(values, tuple):
+                values = (values,)
+            yield f'{self.name}{format_labels(self.labelnames, values)} {format_value(value)}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = dict()  # name -> metric
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def unregister(self, name: str):
+        self.metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STREAM_NEXT_SECONDS = Histogram(
+    'centaur_stream_next_seconds',
+    'Time spent in Room.stream_next for one word tick.',
+)
+TICK_LATENESS_SECONDS = Histogram(
+    'centaur_tick_lateness_seconds',
+    'How late ticks of the timing wheel ran after their scheduled time.',
+)
+DB_SECONDS = Histogram(
+    'centaur_db_seconds',
+    'Time spent in database work, by operation.',
+    labelnames=('operation',),
+)
+ENCODE_SECONDS = Histogram(
+    'centaur_encode_seconds',
+    'Time spent encoding one outgoing message, for all its recipients.',
+)
+MESSAGE_BYTES = Histogram(
+    'centaur_message_bytes',
+    'Size of outgoing messages, one observation per recipient, by message type and codec.',
+    buckets=BYTES_BUCKETS,
+    labelnames=('type', 'codec'),
+)
+BUZZ_TO_GREEN_SECONDS = Histogram(
+    'centaur_buzz_to_green_seconds',
+    'Time from receiving a buzz request to sending the green light.',
+)
+
+
+def watch_rooms(factory):
+    '''export the number of active players of each room of `factory`'''
+    def players():
+        return {
+            room_id: sum(x.active for x in room.players.values())
+            for room_id, room in factory.rooms.items()
+        }
+    Gauge('centaur_room_players', 'Active players in each room.', players, labelnames=('room',))
+
+
+class MetricsResource(Resource):
+    '''GET /metrics'''
+
+    isLeaf = True
+
+    def __init__(self, registry: Registry = REGISTRY):
+        Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.registry.render().encode('utf-8')
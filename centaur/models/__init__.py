@@ -1,5 +1,5 @@
 from .player import Player, Features
 from .question import Question
 from .record import Record
-from .qanta_cache import QantaCache
+from .qanta_keyframe import QantaKeyframe
 from .round_stat import PlayerRoundStat
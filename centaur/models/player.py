@@ -1,8 +1,8 @@
 from sqlalchemy import Column, String, Integer, ForeignKey
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
 
 from centaur.db.base_class import Base
+from centaur.db.types import JSONType
 
 
 class Player(Base):
@@ -12,9 +12,9 @@ class Player(Base):
     email = Column(String, index=True)
     mediator_name = Column(String)
     score = Column(Integer)
-    questions_seen = Column(JSONB)
-    questions_answered = Column(JSONB)
-    questions_correct = Column(JSONB)
+    questions_seen = Column(JSONType)
+    questions_answered = Column(JSONType)
+    questions_correct = Column(JSONType)
 
     records = relationship('Record', order_by='Record.date', back_populates='player')
     # features = relationship('Features', back_populates='player', uselist=False)
@@ -22,14 +22,14 @@ class Player(Base):
 
 class Features(Base):
     id = Column(String, ForeignKey(Player.id, ondelete="CASCADE"), primary_key=True, index=True)
-    enabled_explanation = Column(JSONB)
-    enabled_config = Column(JSONB)
+    enabled_explanation = Column(JSONType)
+    enabled_config = Column(JSONType)
     n_seen = Column(Integer)
     n_answered = Column(Integer)
     n_correct = Column(Integer)
-    n_seen_by_explanation = Column(JSONB)
-    n_seen_by_config = Column(JSONB)
-    n_answered_by_explanation = Column(JSONB)
-    n_answered_by_config = Column(JSONB)
-    n_correct_by_explanation = Column(JSONB)
-    n_correct_by_config = Column(JSONB)
+    n_seen_by_explanation = Column(JSONType)
+    n_seen_by_config = Column(JSONType)
+    n_answered_by_explanation = Column(JSONType)
+    n_answered_by_config = Column(JSONType)
+    n_correct_by_explanation = Column(JSONType)
+    n_correct_by_config = Column(JSONType)
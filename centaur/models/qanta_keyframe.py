@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, Integer, LargeBinary, ForeignKey
+from sqlalchemy.orm import relationship
+
+from centaur.db.base_class import Base
+from centaur.db.types import JSONType
+from centaur.models import Question
+
+
+class QantaKeyframe(Base):
+    '''
+    Guesser output of a question from `position` until the next keyframe,
+    or the end of the question. `text_highlight` is a bitmap of the words,
+    see `centaur.cache_snapshot.pack_bits`.
+
+    All keyframes of a question carry the same stamp: the hash of the
+    tokens and the version of the guesser they were made from, NULL for
+    keyframes cached before stamps.
+    '''
+    question_id = Column(String, ForeignKey(Question.id), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    guesses = Column(JSONType)
+    buzz_scores = Column(JSONType)
+    matches = Column(JSONType)
+    matches_highlight = Column(JSONType)
+    text_highlight = Column(LargeBinary)
+    tokens_hash = Column(String)
+    guesser_version = Column(String)
+
+    question = relationship("Question", back_populates="keyframes")
@@ -1,8 +1,8 @@
 from sqlalchemy import Column, String, Integer, Float, ForeignKey, TIMESTAMP
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
 
 from centaur.db.base_class import Base
+from centaur.db.types import JSONType
 from centaur.models import Player, Question
 
 
@@ -19,7 +19,7 @@ class Record(Base):
     explanation_config = Column(String)
     mediator_name = Column(String)
     room_id = Column(String)
-    player_list = Column(JSONB)
+    player_list = Column(JSONType)
     date = Column(TIMESTAMP(timezone=True))
 
     player = relationship("Player", back_populates="records")
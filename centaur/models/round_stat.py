@@ -1,7 +1,7 @@
 from sqlalchemy import Column, String, Integer, Float, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
 
 from centaur.db.base_class import Base
+from centaur.db.types import JSONType
 from centaur.models import Player
 
 
@@ -10,5 +10,5 @@ class PlayerRoundStat(Base):
     room_id = Column(String, primary_key=True, nullable=False, index=True)
     qb_score = Column(Integer)
     ew_score = Column(Float)
-    questions_answered = Column(JSONB)
-    questions_correct = Column(JSONB)
+    questions_answered = Column(JSONType)
+    questions_correct = Column(JSONType)
@@ -0,0 +1,284 @@
+import json
+import time
+import logging
+from datetime import datetime
+
+from twisted.internet import threads
+from twisted.internet.defer import Deferred, succeed, maybeDeferred
+from twisted.python.threadpool import ThreadPool
+from sqlalchemy.exc import OperationalError, InterfaceError, DisconnectionError
+
+from centaur import metrics
+from centaur.config import settings
+from centaur.models import Player, Record, PlayerRoundStat
+
+
+logger = logging.getLogger('persistence')
+
+# errors of the connection rather than of the data, worth retrying later
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError)
+
+
+class QuestionWrites:
+    '''
+    Everything `_end_of_question` persists for one question: player score
+    updates, new records and round-stat increments. Values are copied when
+    added, so the server can keep mutating its players.
+    '''
+
+    def __init__(self):
+        self.players = dict()  # player_id -> fields to update
+        self.records = []  # column -> value for each new Record
+        self.round_stats = []  # (player_id, room_id, qb_score, ew_score, answered, correct)
+
+    def __len__(self):
+        return len(self.players) + len(self.records) + len(self.round_stats)
+
+    def to_json(self) -> dict:
+        return {'players': self.players, 'records': self.records, 'round_stats': self.round_stats}
+
+    def update_player(self, player_id: str, **fields):
+        fields = {k: list(v) if isinstance(v, list) else v for k, v in fields.items()}
+        self.players.setdefault(player_id, dict()).update(fields)
+
+    def add_record(self, **fields):
+        self.records.append(dict(fields))
+
+    def add_round_stat(
+        self,
+        player_id: str,
+        room_id: str,
+        qb_score: int = 0,
+        ew_score: float = 0,
+        answered: str = None,
+        correct: str = None,
+    ):
+        '''increment the round stat, `answered` and `correct` are question ids'''
+        self.round_stats.append((player_id, room_id, qb_score, ew_score, answered, correct))
+
+    def apply(self, session):
+        '''add all writes to `session` and flush them, without committing'''
+        if len(self.players) > 0:
+            players = session.query(Player).filter(Player.id.in_(list(self.players))).all()
+            players = {x.id: x for x in players}
+            for player_id, fields in self.players.items():
+                if player_id not in players:
+                    logger.warning(f'player {player_id} not in db, skipping update')
+                    continue
+                for key, value in fields.items():
+                    setattr(players[player_id], key, value)
+
+        if len(self.records) > 0:
+            session.bulk_insert_mappings(Record, self.records)
+
+        stats = dict()  # (player_id, room_id) -> PlayerRoundStat
+        for room_id in set(x[1] for x in self.round_stats):
+            player_ids = [x[0] for x in self.round_stats if x[1] == room_id]
+            rows = session.query(PlayerRoundStat) \
+                .filter(PlayerRoundStat.room_id == room_id) \
+                .filter(PlayerRoundStat.player_id.in_(player_ids)) \
+                .all()
+            stats.update({(x.player_id, x.room_id): x for x in rows})
+
+        for player_id, room_id, qb_score, ew_score, answered, correct in self.round_stats:
+            round_stat = stats.get((player_id, room_id))
+            if round_stat is None:
+                round_stat = PlayerRoundStat(
+                    player_id=player_id,
+                    room_id=room_id,
+                    qb_score=0,
+                    ew_score=0,
+                    questions_answered=[],
+                    questions_correct=[],
+                )
+                session.add(round_stat)
+                stats[(player_id, room_id)] = round_stat
+            round_stat.qb_score += qb_score
+            round_stat.ew_score += ew_score
+            if answered is not None:
+                round_stat.questions_answered = round_stat.questions_answered + [answered]
+            if correct is not None:
+                round_stat.questions_correct = round_stat.questions_correct + [correct]
+
+        # later batches in the same transaction query these rows again
+        session.flush()
+
+
+class WriteBehindWriter:
+    '''
+    Commits `QuestionWrites` off the reactor thread, in the order they were
+    submitted. A single writer thread is used; batches that pile up while
+    it is busy are committed together in one transaction, up to
+    `max_batches` of them.
+
+    A failed transaction is retried `max_retries` times with exponential
+    backoff. If it still fails, each of its batches is committed alone, so
+    that one bad batch does not hold back the others. A batch that fails
+    alone on the connection is kept and retried after `retry_delay`
+    seconds; one that fails on its data is appended to the `dead_letter`
+    file with the error, and dropped.
+
+    Without `threaded`, batches are committed on the reactor thread when
+    they are submitted, for databases whose one connection cannot be
+    shared between threads.
+    '''
+
+    def __init__(
+        self,
+        session_factory,
+        clock,
+        max_retries: int = settings.WRITE_BEHIND_RETRIES,
+        retry_delay: float = settings.WRITE_BEHIND_RETRY_DELAY,
+        max_batches: int = settings.WRITE_BEHIND_MAX_BATCHES,
+        dead_letter: str = settings.WRITE_BEHIND_DEAD_LETTER,
+        threaded: bool = True,
+    ):
+        self.session_factory = session_factory
+        self.clock = clock
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_batches = max_batches
+        self.dead_letter = dead_letter
+        self.threaded = threaded
+        self.pool = ThreadPool(minthreads=1, maxthreads=1, name='write-behind')
+        self.pending = []  # batches not committed yet
+        self.running = None  # deferred of the transaction in flight
+        self.writing = []  # batches of the transaction in flight
+        self.retry_call = None
+        self.waiters = []  # deferreds of flush()
+        self.stopped = False
+
+    def start(self):
+        if self.threaded:
+            self.pool.start()
+        self.clock.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def stop(self):
+        '''flush pending writes, then stop the writer thread'''
+        self.stopped = True
+        d = self.flush()
+        if self.threaded:
+            d.addBoth(lambda _: self.pool.stop())
+        return d
+
+    def submit(self, writes: QuestionWrites):
+        if len(writes) > 0:
+            self.pending.append(writes)
+            self._kick()
+
+    def pending_player(self, player_id: str) -> dict:
+        '''
+        Fields of the player in the batches not committed yet, the latest
+        value of each. A player who reconnects before their last update is
+        committed would otherwise read, and later write back, stale values.
+        '''
+        fields = dict()
+        for writes in self.writing + self.pending:
+            fields.update(writes.players.get(player_id, {}))
+        return fields
+
+    def flush(self) -> Deferred:
+        '''get a deferred that fires once every submitted batch is committed or given up'''
+        if self.running is None and len(self.pending) == 0:
+            return succeed(None)
+        if self.retry_call is not None and self.retry_call.active():
+            self.retry_call.cancel()
+            self.retry_call = None
+            self._kick()
+        d = Deferred()
+        self.waiters.append(d)
+        return d
+
+    def _kick(self):
+        if self.running is not None or len(self.pending) == 0:
+            return
+        batches, self.pending = self.pending[:self.max_batches], self.pending[self.max_batches:]
+        self.writing = batches
+        if self.threaded:
+            self.running = threads.deferToThreadPool(self.clock, self.pool, self._write, batches, self.stopped)
+        else:
+            self.running = maybeDeferred(self._write, batches, self.stopped)
+        self.running.addCallbacks(self._written, self._failed, errbackArgs=(batches,))
+
+    def _commit(self, batches, attempts: int):
+        '''runs in the writer thread, raises the error of the last attempt'''
+        for attempt in range(attempts):
+            session = self.session_factory()
+            start = time.perf_counter()
+            try:
+                for writes in batches:
+                    writes.apply(session)
+                session.commit()
+                metrics.DB_SECONDS.labels('end_of_question').observe(time.perf_counter() - start)
+                return
+            except Exception:
+                session.rollback()
+                if attempt + 1 == attempts:
+                    raise
+                logger.warning(f'write of {len(batches)} batches failed, attempt {attempt + 1}', exc_info=True)
+                time.sleep(self.retry_delay * 2 ** attempt)
+            finally:
+                session.close()
+
+    def _write(self, batches, stopped: bool) -> list:
+        '''runs in the writer thread, returns the batches to retry later'''
+        try:
+            self._commit(batches, self.max_retries)
+            return []
+        except Exception as e:
+            if len(batches) == 1:
+                failed = [(batches[0], e)]
+            else:
+                logger.error(f'write of {len(batches)} batches failed, writing them one by one')
+                failed = []
+                for writes in batches:
+                    try:
+                        self._commit([writes], 1)
+                    except Exception as error:
+                        failed.append((writes, error))
+
+        retry = []
+        for writes, error in failed:
+            if isinstance(error, TRANSIENT_ERRORS) and not stopped:
+                retry.append(writes)
+            else:
+                self._drop(writes, error)
+        return retry
+
+    def _drop(self, writes: QuestionWrites, error: Exception):
+        '''runs in the writer thread'''
+        logger.error(f'dropping a batch of {len(writes.records)} records: {error!r}')
+        try:
+            with open(self.dead_letter, 'a') as f:
+                entry = dict(writes.to_json(), time=str(datetime.now()), error=repr(error))
+                f.write(json.dumps(entry, default=str) + '\n')
+        except OSError:
+            logger.error(f'cannot write to {self.dead_letter}, lost records {writes.records}', exc_info=True)
+
+    def _written(self, retry):
+        self.running = None
+        self.writing = []
+        if len(retry) > 0:
+            logger.error(f'write of {len(retry)} batches failed, retry in {self.retry_delay}s')
+            self.pending = retry + self.pending
+            self.retry_call = self.clock.callLater(self.retry_delay, self._kick)
+        else:
+            self._kick()
+        self._notify()
+
+    def _failed(self, failure, batches):
+        # _write handles its errors, this is a bug of the writer: do not retry it
+        self.running = None
+        self.writing = []
+        logger.error(f'dropping {len(batches)} batches after failure: {failure.getErrorMessage()}')
+        for writes in batches:
+            logger.error(f'lost records {writes.records}')
+        self._kick()
+        self._notify()
+
+    def _notify(self):
+        if self.running is not None or len(self.pending) > 0:
+            return
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.callback(None)
@@ -0,0 +1,138 @@
+from centaur.utils import BELL, highlight_template
+
+
+class QuestionRenderer:
+    '''
+    Incrementally renders the displayed question text, both plain and
+    highlighted, with buzzing bells.
+
+    Each word tick only appends the new tokens. The rendered text is rebuilt
+    from scratch only when the guesser changes the highlight of words that
+    are already displayed, which can only happen at a cache keyframe.
+
+    Tokens are kept as lists of spans, joined when the text is read and
+    only once per change.
+    '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.spans_plain = []
+        self.spans_highlighted = []
+        self.text = None  # joined spans, until the next change
+        self.bell_positions = set()
+        self.flags = []  # highlight flag of each rendered token
+        self.source = None  # highlight the flags were last read from
+        self.resets = 0  # number of times the text was re-rendered
+
+    def _append(self, i: int, flag: bool):
+        '''render token at index `i`, followed by its bell if any'''
+        token = self.tokens[i]
+        self.spans_plain.append(token + ' ')
+        self.spans_highlighted.append((highlight_template.format(token) if flag else token) + ' ')
+        self.flags.append(flag)
+        self.text = None
+        if i + 1 in self.bell_positions:
+            self._append_bell()
+
+    def _append_bell(self):
+        self.spans_plain.append(BELL)
+        self.spans_highlighted.append(BELL)
+        self.text = None
+
+    def _reset(self):
+        self.resets += 1
+        self.spans_plain = []
+        self.spans_highlighted = []
+        self.flags = []
+        self.text = None
+
+    def _join(self):
+        if self.text is None:
+            self.text = ''.join(self.spans_plain), ''.join(self.spans_highlighted)
+        return self.text
+
+    @property
+    def text_plain(self) -> str:
+        return self._join()[0]
+
+    @property
+    def text_highlighted(self) -> str:
+        return self._join()[1]
+
+    def advance(self, position: int, highlight=()):
+        '''
+        Render the first `position` tokens of the question.
+        Tokens past the end of `highlight` are not highlighted.
+        '''
+        position = min(position, len(self.tokens))
+        if highlight is not self.source:
+            n = min(len(self.flags), len(highlight))
+            if list(highlight[:n]) != self.flags[:n] or any(self.flags[n:]):
+                self._reset()
+            self.source = highlight
+
+        if position < len(self.flags):
+            self._reset()
+
+        for i in range(len(self.flags), position):
+            self._append(i, i < len(highlight) and bool(highlight[i]))
+        self.position = position
+
+    def add_bell(self, position: int):
+        '''mark a buzz after the token at `position`'''
+        if position in self.bell_positions:
+            return
+        self.bell_positions.add(position)
+        if 0 < position <= len(self.flags):
+            if position == len(self.flags):
+                self._append_bell()
+            else:
+                # bell in the middle of the rendered text, re-render
+                flags = self.flags
+                self._reset()
+                for i, flag in enumerate(flags):
+                    self._append(i, flag)
+
+
+def render_matches(matches, matches_highlight):
+    '''matches of a cache entry for display, both plain and highlighted'''
+    matches_plain = []
+    matches_highlighted = []
+    for i, (match, high) in enumerate(zip(matches, matches_highlight)):
+        matches_plain.append('')
+        matches_highlighted.append('')
+        for x, y in zip(match, high):
+            matches_plain[i] += x + ' '
+            x = highlight_template.format(x) if y else x
+            matches_highlighted[i] += x + ' '
+    return matches_plain, matches_highlighted
+
+
+def render_panels(entry) -> dict:
+    '''
+    Guesses, matches and autopilot prediction of a cache entry for display.
+    Only the top 5 guesses are shown, with scores normalized to sum to one.
+    '''
+    matches_plain, matches_highlighted = render_matches(entry.matches, entry.matches_highlight)
+
+    autopilot_prediction = False
+    guesses = entry.guesses
+    if len(guesses) >= 5:
+        guesses = guesses[:5]
+        score_sum = sum([s for x, s in guesses])
+        if score_sum > 0:
+            guesses = [(x, s / score_sum) for x, s in guesses]
+        if guesses[0][1] - guesses[1][1] > 0.05:
+            autopilot_prediction = True
+
+    return {
+        'guesses': guesses,
+        'matches': matches_plain,
+        'matches_highlighted': matches_highlighted,
+        'autopilot_prediction': autopilot_prediction,
+    }
+
+
+# panels of positions without a keyframe: before the guesser first ran, or not cached
+EMPTY_PANELS = {'guesses': [], 'matches': [], 'matches_highlighted': [], 'autopilot_prediction': False}
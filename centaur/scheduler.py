@@ -0,0 +1,159 @@
+import sys
+import time
+import traceback
+
+from centaur.config import settings
+
+
+class WheelCall:
+    '''A call scheduled on a `TimingWheel`, like twisted's `IDelayedCall`.'''
+
+    __slots__ = ('tick', 'func', 'args', 'kwargs', 'called', 'cancelled')
+
+    def __init__(self, tick: int, func, args, kwargs):
+        self.tick = tick
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.called = False
+        self.cancelled = False
+
+    def active(self) -> bool:
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimingWheel:
+    '''
+    Hashed timing wheel driving the timers of all rooms from one periodic
+    tick, instead of one reactor timer per room and per word.
+
+    Delays are rounded to `resolution` seconds and counted from the tick
+    being run, not from the current time, so a chain of word ticks keeps
+    its pace when the reactor is late. The tick itself is scheduled
+    against the monotonic clock from the time the wheel started, so its
+    lateness does not add up either; if a tick comes late, the ticks it
+    missed run right away, in order.
+
+    After a stall of more than `max_catchup` ticks, the missed ticks are
+    not replayed: their calls run once, in order, and the calls they make
+    are counted from the current time, so that a room does not send the
+    words of the whole stall in a burst.
+
+    The wheel stops ticking when nothing is scheduled.
+    '''
+
+    def __init__(
+        self,
+        clock,
+        resolution: float = settings.WHEEL_RESOLUTION,
+        n_slots: int = settings.WHEEL_SLOTS,
+        max_catchup: int = settings.WHEEL_MAX_CATCHUP,
+        now=time.monotonic,
+    ):
+        self.clock = clock
+        self.resolution = resolution
+        self.slots = [[] for _ in range(n_slots)]
+        self.max_catchup = max_catchup
+        self.now = now
+        self.start = None  # time of tick 0
+        self.tick = 0  # last tick run
+        self.pending = 0  # calls in the slots, including cancelled ones
+        self.timer = None
+        self.running = False
+
+        self.ticks = 0
+        self.skipped = 0  # ticks not replayed after stalls
+        self.lateness = 0.0  # seconds the last tick ran after its time
+        self.max_lateness = 0.0
+        self.observers = []  # called with the lateness of every tick
+
+    def __len__(self):
+        return self.pending
+
+    def call_later(self, delay: float, func, *args, **kwargs) -> WheelCall:
+        '''
+        Run `func` `delay` seconds from now. Called from a call of the
+        wheel, the delay is counted from the time of the current tick.
+        '''
+        if self.start is None:
+            self.start = self.now()
+            self.tick = 0
+        if self.running:
+            elapsed = self.tick * self.resolution
+        else:
+            elapsed = self.now() - self.start
+        tick = max(self.tick + 1, int(round((elapsed + delay) / self.resolution)))
+        call = WheelCall(tick, func, args, kwargs)
+        self.slots[call.tick % len(self.slots)].append(call)
+        self.pending += 1
+        if self.timer is None and not self.running:
+            self._schedule()
+        return call
+
+    def _schedule(self):
+        delay = self.start + (self.tick + 1) * self.resolution - self.now()
+        self.timer = self.clock.callLater(max(0.0, delay), self._run)
+
+    def _run(self):
+        self.timer = None
+        self.running = True
+        try:
+            due = int((self.now() - self.start) / self.resolution + 1e-9)
+            if due - self.tick > self.max_catchup and self.pending > 0:
+                self._skip_to(due)
+            while self.tick < due and self.pending > 0:
+                self.tick += 1
+                self._run_tick()
+        finally:
+            self.running = False
+
+        if self.pending > 0:
+            self._schedule()
+        else:
+            self.start = None
+
+    def _skip_to(self, due: int):
+        '''move the calls of the missed ticks to tick `due`, the next one run'''
+        self.lateness = self.now() - (self.start + (self.tick + 1) * self.resolution)
+        self.max_lateness = max(self.max_lateness, self.lateness)
+        for observer in self.observers:
+            observer(self.lateness)
+
+        missed = []
+        for slot in self.slots:
+            missed.extend(x for x in slot if x.tick < due)
+            slot[:] = [x for x in slot if x.tick >= due]
+        # stable, the calls of one tick keep their order
+        missed.sort(key=lambda x: x.tick)
+        for call in missed:
+            call.tick = due
+        slot = self.slots[due % len(self.slots)]
+        slot[:0] = missed
+        self.skipped += due - self.tick - 1
+        self.tick = due - 1
+
+    def _run_tick(self):
+        self.lateness = self.now() - (self.start + self.tick * self.resolution)
+        self.max_lateness = max(self.max_lateness, self.lateness)
+        self.ticks += 1
+        for observer in self.observers:
+            observer(self.lateness)
+
+        slot = self.slots[self.tick % len(self.slots)]
+        due = [x for x in slot if x.tick == self.tick]
+        if len(due) == 0:
+            return
+        # calls made now go into later ticks of this slot, never this one
+        slot[:] = [x for x in slot if x.tick != self.tick]
+        self.pending -= len(due)
+        for call in due:
+            if call.cancelled:
+                continue
+            call.called = True
+            try:
+                call.func(*call.args, **call.kwargs)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
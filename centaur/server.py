@@ -1,23 +1,24 @@
 import sys
 import json
+import time
 import uuid
 import random
 import logging
 import traceback
 from tqdm import tqdm
-from functools import partial
 from datetime import datetime
 from haikunator import Haikunator
 
 from twisted.internet import reactor
+from twisted.internet.defer import CancelledError
 from twisted.web.server import Site
 from twisted.web.static import File
-from twisted.internet.defer import Deferred
 from autobahn.twisted.websocket import (
     WebSocketServerFactory,
     WebSocketServerProtocol,
     listenWS
 )
+from autobahn.websocket.types import ConnectionDeny
 
 from centaur.utils import (
     MSG_TYPE_NEW,
@@ -35,7 +36,6 @@ from centaur.utils import (
     BADGE_WRONG,
     BADGE_BUZZ,
     NEW_LINE,
-    BELL,
     ANSWER_TIME_OUT,
     SECOND_PER_WORD,
     PLAYER_RESPONSE_TIME_OUT,
@@ -44,12 +44,27 @@ from centaur.utils import (
     THRESHOLD,
     EXPLANATIONS,
     ALLOW_PLAYER_CHOICE,
+    PROTOCOL_SNAPSHOT,
+    PROTOCOL_DELTA,
     boldify,
-    highlight_template,
+    parse_room_id,
 )
 from centaur.mediator import RandomDynamicMediator
-from centaur.db.session import SessionLocal
-from centaur.models import Question, Player, Record, QantaCache, PlayerRoundStat
+from centaur.config import settings
+from centaur.db.session import SessionLocal, session_scope, engine
+from centaur.db.init_db import single_connection
+from centaur.models import Question, Player
+from centaur.cache_snapshot import SnapshotCache
+from centaur.bundle import load_bundles
+from centaur.renderer import QuestionRenderer, EMPTY_PANELS
+from centaur.deferreds import DeferredRegistry
+from centaur.scheduler import TimingWheel
+from centaur import metrics
+from centaur import codec
+from centaur.persistence import QuestionWrites, WriteBehindWriter
+from centaur.leaderboard import Leaderboard
+from centaur.autocomplete import AnswerCompleter, AutocompleteResource
+from centaur.answers import AnswerIndex
 from centaur.expected_wins import ExpectedWins
 
 
@@ -58,14 +73,23 @@ logger = logging.getLogger('server')
 haikunator = Haikunator()
 EW = ExpectedWins()
 
+# per-player fields added to every message that carries a qid
+OVERLAY_KEYS = ('can_buzz', 'explanation_config')
+
 
 class BroadcastServerProtocol(WebSocketServerProtocol):
 
+    room = None
+
+    def onConnect(self, request):
+        # the room is picked by the URL path, e.g. ws://host:9000/room_2
+        self.room_id = self.factory.route(request.path)
+
     def onOpen(self):
         self.factory.register(self)
 
     def onMessage(self, payload, isBinary):
-        self.factory.receive(payload, self)
+        self.factory.receive(payload, self, isBinary)
 
     def connectionLost(self, reason):
         WebSocketServerProtocol.connectionLost(self, reason)
@@ -109,6 +133,9 @@ class PlayerClient:
         self.questions_correct = []
         self.task_completed = False  # answered all questions
         self.before_half_correct = 0
+        self.protocol = PROTOCOL_SNAPSHOT  # format of RESUME messages
+        self.codec = codec.JSON  # encoding of messages, picked by the client
+        self.buzz_requested = None  # perf_counter() of the pending buzz request
 
         self.mediator = RandomDynamicMediator()
 
@@ -122,40 +149,69 @@ class PlayerClient:
     def sendMessage(self, msg: dict):
         if self.active:
             if 'qid' in msg:
+                # copy so the overlay does not leak into the shared message
+                msg = dict(msg)
                 msg['can_buzz'] = self.can_buzz(msg['qid'])
                 msg['explanation_config'] = self.explanation_config
-            self.client.sendMessage(json.dumps(msg).encode('utf-8'))
+            start = time.perf_counter()
+            payload = self.codec.encode(msg)
+            metrics.ENCODE_SECONDS.observe(time.perf_counter() - start)
+            metrics.MESSAGE_BYTES.labels(str(msg.get('type')), self.codec.name).observe(len(payload))
+            self.client.sendMessage(payload, self.codec.binary)
+
+    def sendPayload(self, payload: bytes):
+        '''send a message already encoded with `self.codec`'''
+        if self.active:
+            self.client.sendMessage(payload, self.codec.binary)
 
 
-class BroadcastServerFactory(WebSocketServerFactory):
+class Room:
+    '''
+    One game room: its question stream, players, pending waits and timers.
+    The write-behind writer, question bank and guesser snapshots are
+    shared with the other rooms through the factory.
 
-    def __init__(self, url: str):
-        WebSocketServerFactory.__init__(self, url)
-        self.db = SessionLocal()
+    When the last player leaves, the room is paused: its timers and waits
+    are cancelled and its snapshot released. The factory closes it if
+    nobody comes back within `ROOM_IDLE_TIMEOUT` seconds.
+    '''
+
+    def __init__(self, room_id: str, factory):
+        self.factory = factory
+        self.writer = factory.writer
 
         self.round_number_list = [3, 4, 6, 8, 9, 10]
         # self.round_number_list = [1]
         self.round_number_index = None
         self.question_index = None
         self.question = None
+        self.snapshot = None  # guesser keyframes of the current question
+        self.cache_entry = None  # keyframe of the current position
 
         self.socket_to_player = dict()  # client.peer -> Player
         self.players = dict()  # player_id -> Player
-        self.deferreds = []
+        self.deferreds = DeferredRegistry(reactor)  # waits for player responses
         self.position = 0
         self.info_text = ''
         self.history_entries = []
         self.player_list = []
-        self.bell_positions = []
+        self.renderer = None  # incremental display of the current question
+        self.panels = None  # guesses & matches of the current keyframe
+        self.delta_panels = None  # panels & renderer state of the last delta frame
+        self.delta_resets = 0
 
         # to get new user started in the middle of a round
         self.latest_resume_msg = None
         self.latest_buzzing_msg = None
 
         self.all_paused = True  # everyone is stopped
+        self.idle = False  # paused since the last player left
+        self.timer = None  # next step of the question stream on the wheel
+        self.close_call = None  # closes the room if it stays idle
 
-        self.room_id_base = 'room_1'
+        self.room_id_base = room_id
         self.room_id_and_round = None
+        self.leaderboard = Leaderboard()  # scores of the current round
 
     def register(self, client):
         if client.peer not in self.socket_to_player:
@@ -168,6 +224,8 @@ class BroadcastServerFactory(WebSocketServerFactory):
                 'player_id': new_player.player_id,
                 'player_name': new_player.player_name,
                 'player_email': new_player.player_email,
+                'protocols': [PROTOCOL_SNAPSHOT, PROTOCOL_DELTA],
+                'codecs': codec.available(settings.CODECS),
             }
             new_player.sendMessage(msg)
 
@@ -193,30 +251,42 @@ class BroadcastServerFactory(WebSocketServerFactory):
                         new_player.position_start = self.position
                         self.players[player_id] = new_player
 
-                        player_in_db = self.db.query(Player).get(player_id)
-                        if player_in_db is not None:
-                            new_player.score = player_in_db.score
-                            new_player.questions_seen = player_in_db.questions_seen
-                            new_player.questions_answered = player_in_db.questions_answered
-                            new_player.questions_correct = player_in_db.questions_correct
-                            new_player.task_completed = len(set(player_in_db.questions_answered)) >= THRESHOLD
-                        else:
-                            logger.info(f'{self.room_id_base} add player {new_player.player_id} to db')
-                            player_in_db = Player(
-                                id=new_player.player_id,
-                                ip_addr=new_player.client.peer,
-                                name=new_player.player_name,
-                                email=new_player.player_email,
-                                mediator_name=new_player.mediator.__class__.__name__,
-                                score=0,
-                                questions_seen=[],
-                                questions_answered=[],
-                                questions_correct=[],
-                            )
-                            self.db.add(player_in_db)
-                            self.db.commit()
+                        with session_scope() as db:
+                            player_in_db = db.query(Player).get(player_id)
+                            if player_in_db is not None:
+                                # updates of a player removed recently may not be committed yet
+                                pending = self.writer.pending_player(player_id)
+                                new_player.score = pending.get('score', player_in_db.score)
+                                new_player.questions_seen = list(pending.get('questions_seen', player_in_db.questions_seen))
+                                new_player.questions_answered = list(pending.get('questions_answered', player_in_db.questions_answered))
+                                new_player.questions_correct = list(pending.get('questions_correct', player_in_db.questions_correct))
+                                new_player.task_completed = len(set(new_player.questions_answered)) >= THRESHOLD
+                            else:
+                                logger.info(f'{self.room_id_base} add player {new_player.player_id} to db')
+                                db.add(Player(
+                                    id=new_player.player_id,
+                                    ip_addr=new_player.client.peer,
+                                    name=new_player.player_name,
+                                    email=new_player.player_email,
+                                    mediator_name=new_player.mediator.__class__.__name__,
+                                    score=0,
+                                    questions_seen=[],
+                                    questions_answered=[],
+                                    questions_correct=[],
+                                ))
                         logger.info(f"{self.room_id_base} [register] new player {player_name} {player_email} ({client.peer})")
 
+                    # format of RESUME messages chosen by the client
+                    protocol = new_player.response.get('protocol', PROTOCOL_SNAPSHOT)
+                    if protocol not in (PROTOCOL_SNAPSHOT, PROTOCOL_DELTA):
+                        protocol = PROTOCOL_SNAPSHOT
+                    self.players[player_id].protocol = protocol
+                    # the reply is JSON, later messages use the codec chosen in it
+                    self.players[player_id].codec = codec.get(new_player.response.get('codec'), settings.CODECS)
+
+                    if self.idle:
+                        self.resume()
+
                     if new_player.response.get('start_new_round', False):
                         self.all_paused = False
 
@@ -247,7 +317,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
                     # keep player up to date
                     if self.latest_resume_msg is not None:
-                        self.players[player_id].sendMessage(self.latest_resume_msg)
+                        self.players[player_id].sendMessage(self.get_snapshot_msg(self.players[player_id]))
                     if self.latest_buzzing_msg is not None:
                         self.players[player_id].sendMessage(self.latest_buzzing_msg)
 
@@ -269,19 +339,8 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
             # check if the qid returned by the player client matches the current one
             qid = 'PAUSED' if self.question is None else self.question.id
-            condition = partial(
-                self.check_player_response,
-                player=new_player,
-                key='qid',
-                value=qid,
-            )
-            if condition():
-                callback(None)
-            else:
-                deferred = Deferred()
-                deferred.addTimeout(PLAYER_RESPONSE_TIME_OUT, reactor)
-                deferred.addCallbacks(callback, errback)
-                self.deferreds.append((deferred, condition))
+            deferred = self.deferreds.wait(new_player, 'qid', qid, PLAYER_RESPONSE_TIME_OUT)
+            deferred.addCallbacks(callback, errback)
 
     def unregister(self, client=None, player=None):
         if player is None:
@@ -289,36 +348,119 @@ class BroadcastServerFactory(WebSocketServerFactory):
         if player is not None:
             player.active = False
             logger.info(f"{self.room_id_base} [unregister] player {player.player_name} inactive")
+        if not self.idle and not self.active():
+            self.pause()
+            self.factory.close_later(self)
+
+    def active(self) -> bool:
+        '''whether a connected player is still in the room'''
+        return any(x.active for x in self.socket_to_player.values())
+
+    def pause(self):
+        '''
+        Stop the question stream once the last player has left. The
+        question being played is abandoned, the next one starts when
+        someone comes back.
+        '''
+        logger.info(f'{self.room_id_base} [rooms] everyone left, pausing')
+        self.idle = True
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.deferreds.cancel()
+        self.release_snapshot()
+
+    def resume(self):
+        logger.info(f'{self.room_id_base} [rooms] resuming')
+        self.idle = False
+        if self.question is not None and not self.all_paused:
+            self.new_question()
+
+    def call_later(self, delay: float, func, *args):
+        '''schedule the next step of the question stream, replacing the pending one'''
+        if self.idle:
+            return
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = self.factory.wheel.call_later(delay, func, *args)
+
+    def release_snapshot(self):
+        if self.snapshot is not None:
+            self.factory.snapshots.release(self.question.id)
+            self.snapshot = None
+
+    def broadcast(self, msg: dict, players=None):
+        '''
+        Send `msg` to `players` (all players by default).
+
+        The shared body is encoded once per codec and joined with each
+        player's `can_buzz` and `explanation_config` overlay, same as
+        `PlayerClient.sendMessage`. Players with the same codec and
+        overlay get the same bytes.
+        '''
+        if players is None:
+            players = self.players.values()
+        players = [x for x in players if x.active]
+        if len(players) == 0:
+            return
+
+        message_type = str(msg.get('type'))
+        start = time.perf_counter()
+        if 'qid' not in msg:
+            payloads = dict()  # codec name -> bytes
+            for player in players:
+                if player.codec.name not in payloads:
+                    payloads[player.codec.name] = player.codec.encode(msg)
+            metrics.ENCODE_SECONDS.observe(time.perf_counter() - start)
+            for player in players:
+                payload = payloads[player.codec.name]
+                metrics.MESSAGE_BYTES.labels(message_type, player.codec.name).observe(len(payload))
+                player.sendPayload(payload)
+            return
+
+        body = {k: v for k, v in msg.items() if k not in OVERLAY_KEYS}
+        prepared = dict()  # codec name -> body encoded once
+        encoded_configs = dict()  # id(explanation_config) -> json, to tell configs apart
+        payloads = dict()  # (codec name, can_buzz, explanation_config json) -> bytes
+        recipients = dict()  # payload key -> players
+        for player in players:
+            config = player.explanation_config
+            encoded_config = encoded_configs.get(id(config))
+            if encoded_config is None:
+                encoded_config = encoded_configs[id(config)] = json.dumps(config)
+            key = (player.codec.name, player.can_buzz(msg['qid']), encoded_config)
+            if key not in payloads:
+                if key[0] not in prepared:
+                    prepared[key[0]] = player.codec.prepare(body)
+                payloads[key] = player.codec.join(prepared[key[0]], {'can_buzz': key[1], 'explanation_config': config})
+                recipients[key] = []
+            recipients[key].append(player)
+        metrics.ENCODE_SECONDS.observe(time.perf_counter() - start)
+
+        for key, payload in payloads.items():
+            metrics.MESSAGE_BYTES.labels(message_type, key[0]).observe(len(payload), len(recipients[key]))
+            for player in recipients[key]:
+                player.sendPayload(payload)
 
     def check_player_response(self, player, key, value):
-        return (
-            player.active
-            and player.response is not None
-            and key in player.response
-            and player.response.get(key, None) == value
-        )
-
-    def check_deferreds(self):
-        ids = []
-        for i, (deferred, cond) in enumerate(self.deferreds):
-            if deferred.called:
-                continue
-            elif cond():
-                deferred.callback(None)
-            else:
-                ids.append(i)
-        self.deferreds = [self.deferreds[i] for i in ids]
+        return DeferredRegistry.matches(player, key, value)
 
-    def receive(self, msg, client):
+    def receive(self, payload, client, isBinary=False):
+        player = self.socket_to_player.get(client.peer)
+        # text frames are JSON, binary frames use the codec the player picked
+        decoder = player.codec if isBinary and player is not None else codec.JSON
         try:
-            msg = json.loads(msg.decode('utf-8'))
-        except TypeError:
-            logger.error("Message must be json string.")
+            msg = decoder.decode(payload)
+        except (TypeError, ValueError):
+            logger.error(f"Cannot decode {decoder.name} message from {client.peer}")
             return
-        if client.peer in self.socket_to_player:
-            player = self.socket_to_player[client.peer]
+        if player is not None:
             player.response = msg
-            self.check_deferreds()
+            if player.buzz_requested is None and msg.get('type') == MSG_TYPE_BUZZING_REQUEST \
+                    and self.question is not None and player.can_buzz(self.question.id):
+                # requests of players who cannot buzz are denied, not timed
+                player.buzz_requested = time.perf_counter()
+            self.deferreds.check(player)
         else:
             logger.warning("Unknown source {}:\n{}".format(client.peer, msg))
 
@@ -370,14 +512,17 @@ class BroadcastServerFactory(WebSocketServerFactory):
         round_number = self.round_number_list[self.round_number_index]
         round_str = f'0{round_number}' if round_number < 10 else str(round_number)
         tournament_str = f'spring_novice_round_{round_str}'
-        self.questions = self.db.query(Question).filter(Question.tournament.startswith(tournament_str)).all()
+        self.questions = self.factory.get_questions(tournament_str)
         logger.info('*********** new round *************')
         logger.info(f'{self.room_id_base} Loaded {len(self.questions)} questions for {tournament_str} (round {self.round_number_index + 1})')
 
         self.room_id_and_round = f'{self.room_id_base}_{tournament_str}'
+        start = time.perf_counter()
+        with session_scope() as db:
+            self.leaderboard = Leaderboard.load(db, self.room_id_and_round)
+        metrics.DB_SECONDS.labels('leaderboard').observe(time.perf_counter() - start)
 
-        for player_id, player in self.players.items():
-            player.sendMessage({'type': MSG_TYPE_NEW_ROUND})
+        self.broadcast({'type': MSG_TYPE_NEW_ROUND})
 
         self.question_index = None
         self.all_paused = False
@@ -386,41 +531,25 @@ class BroadcastServerFactory(WebSocketServerFactory):
     def end_of_round(self):
         self.all_paused = True
 
-        player_qb_scores = {}
-        player_ew_scores = {}
-        for player in self.db.query(Player):
-            round_stat = self.db.query(PlayerRoundStat).get((player.id, self.room_id_and_round))
-            if round_stat is not None:
-                player_qb_scores[player.id] = round_stat.qb_score
-                player_ew_scores[player.id] = round_stat.ew_score
-
         print('===================', self.room_id_and_round, '/', self.round_number_index + 1)
-        for i, (player_id, qb_score) in enumerate(sorted(player_qb_scores.items(), key=lambda x: -x[1])):
-            player = self.db.query(Player).get(player_id)
-            print('{:<3}  {:<20}  {:<50}  {:<3}  {:<5}'.format(i, player.name, player.email, qb_score, player_ew_scores[player_id]))
+        for i, standing in enumerate(self.leaderboard.ranking()):
+            print('{:<3}  {:<20}  {:<50}  {:<3}  {:<5}'.format(
+                i, str(standing.player_name), str(standing.player_email), standing.qb_score, standing.ew_score))
         print('===================')
         print()
         pause_msg = f'{self.room_id_base} Round {self.round_number_index+1} complete. Please visit </br><a href="https://cutt.ly/human_ai_spring_novice">https://cutt.ly/human_ai_spring_novice</a></br>for next round room assignment'
         print(pause_msg)
 
-        for player_id, player in self.players.items():
-            player.sendMessage({
-                'type': MSG_TYPE_COMPLETE,
-                'message': pause_msg,
-            })
+        self.broadcast({
+            'type': MSG_TYPE_COMPLETE,
+            'message': pause_msg,
+        })
 
         try:
             admin_player = [x for x in self.players.values() if x.player_name == 'ihsgnef'][0]
         except IndexError:
             return
 
-        condition = partial(
-            self.check_player_response,
-            admin_player,
-            'type',
-            MSG_TYPE_NEW_ROUND,
-        )
-
         def callback(x):
             chosen_round = int(admin_player.response.get('chosen_round', 0))
             # next round index = chosen_round - 1
@@ -433,24 +562,28 @@ class BroadcastServerFactory(WebSocketServerFactory):
         def errback(x):
             logger.info('{self.room_id_base} failed to start new round')
 
-        if condition():
-            callback(None)
-        else:
-            deferred = Deferred()
-            # deferred.addTimeout(ANSWER_TIME_OUT, reactor)
-            deferred.addCallbacks(callback, errback)
-            self.deferreds.append((deferred, condition))
+        deferred = self.deferreds.wait(admin_player, 'type', MSG_TYPE_NEW_ROUND)
+        deferred.addCallbacks(callback, errback)
 
     def new_question(self):
         try:
+            self.release_snapshot()
             self.question = self.get_next_question()
             if self.question is None:
                 self.end_of_round()
                 return
 
             self.info_text = ''
-            self.bell_positions = []
+            self.renderer = QuestionRenderer(self.question.tokens)
+            self.panels = None
+            self.delta_panels = None
+            self.delta_resets = 0
             self.position = 0
+            start = time.perf_counter()
+            with session_scope() as db:
+                self.snapshot = self.factory.snapshots.acquire(db, self.question.id)
+            metrics.DB_SECONDS.labels('snapshot').observe(time.perf_counter() - start)
+            self.cache_entry = None
             self.latest_resume_msg = None
             self.latest_buzzing_msg = None
 
@@ -485,25 +618,10 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
             self.update_explanation_config()
 
+            self.broadcast(msg)
             for player in self.players.values():
-                msg['explanation_config'] = player.explanation_config
-                player.sendMessage(msg)
-                condition = partial(
-                    self.check_player_response,
-                    player=player,
-                    key='qid',
-                    value=self.question.id,
-                )
-                callback = make_callback(player)
-                errback = make_errback(player)
-
-                if condition():
-                    callback(None)
-                else:
-                    deferred = Deferred()
-                    deferred.addTimeout(PLAYER_RESPONSE_TIME_OUT, reactor)
-                    deferred.addCallbacks(callback, errback)
-                    self.deferreds.append((deferred, condition))
+                deferred = self.deferreds.wait(player, 'qid', self.question.id, PLAYER_RESPONSE_TIME_OUT)
+                deferred.addCallbacks(make_callback(player), make_errback(player))
         except Exception:
             traceback.print_exc(file=sys.stdout)
 
@@ -516,44 +634,16 @@ class BroadcastServerFactory(WebSocketServerFactory):
             # start streaming question
             self.stream_next()
 
-        reactor.callLater(SECOND_PER_WORD, calllater)
+        self.call_later(SECOND_PER_WORD, calllater)
 
     def get_display_question(self):
         '''
         Get the current question text for display, both plain and highlighted,
         with visual elements like buzzing bells.
         '''
-        text_plain = ''
-        text_highlighted = ''
-
-        words = self.question.tokens[:self.position]
-        highlight = self.cache_entry.text_highlight
-
-        for i, (x, y) in enumerate(zip(words, highlight)):
-            text_plain += x + ' '
-            x = highlight_template.format(x) if y else x
-            text_highlighted += x + ' '
-            if i + 1 in self.bell_positions:
-                text_plain += BELL
-                text_highlighted += BELL
-        return text_plain, text_highlighted
-
-    def get_display_matches(self):
-        '''
-        Get the current matches for display, both plain and highlighted.
-        '''
-        matches = self.cache_entry.matches
-        highlights = self.cache_entry.matches_highlight
-        matches_plain = []
-        matches_highlighted = []
-        for i, (match, high) in enumerate(zip(matches, highlights)):
-            matches_plain.append('')
-            matches_highlighted.append('')
-            for x, y in zip(match, high):
-                matches_plain[i] += x + ' '
-                x = highlight_template.format(x) if y else x
-                matches_highlighted[i] += x + ' '
-        return matches_plain, matches_highlighted
+        highlight = () if self.cache_entry is None else self.cache_entry.text_highlight
+        self.renderer.advance(self.position, highlight)
+        return self.renderer.text_plain, self.renderer.text_highlighted
 
     def last_chance(self, countdown):
         buzzing_ids = []
@@ -575,11 +665,17 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     'position': self.position,
                     'length': self.question.length,
                 }
-                for player in self.players.values():
-                    player.sendMessage(msg)
-                reactor.callLater(SECOND_PER_WORD, self.last_chance, countdown - 1)
+                self.broadcast(msg)
+                self.call_later(SECOND_PER_WORD, self.last_chance, countdown - 1)
 
     def stream_next(self):
+        start = time.perf_counter()
+        try:
+            self._stream_next()
+        finally:
+            metrics.STREAM_NEXT_SECONDS.observe(time.perf_counter() - start)
+
+    def _stream_next(self):
         end_of_question = self.position == self.question.length
 
         self.latest_buzzing_msg = None
@@ -598,22 +694,10 @@ class BroadcastServerFactory(WebSocketServerFactory):
                 self.last_chance(6)
             else:
                 self.position += 1
-                self.cache_entry = self.db.query(QantaCache).get((self.question.id, self.position))
+                self.cache_entry = self.snapshot.keyframe(self.position)
 
                 text_plain, text_highlighted = self.get_display_question()
-                matches_plain, matches_highlighted = self.get_display_matches()
-                score_for_buzz, score_for_wait = self.cache_entry.buzz_scores
-                autopilot_prediction = score_for_buzz > score_for_wait
-
-                autopilot_prediction = False
-                guesses = self.cache_entry.guesses
-                if len(guesses) >= 5:
-                    guesses = guesses[:5]
-                    score_sum = sum([s for x, s in guesses])
-                    if score_sum > 0:
-                        guesses = [(x, s / score_sum) for x, s in guesses]
-                    if guesses[0][1] - guesses[1][1] > 0.05:
-                        autopilot_prediction = True
+                panels = self.get_display_panels()
 
                 msg = {
                     'type': MSG_TYPE_RESUME,
@@ -622,58 +706,79 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     'text_highlighted': text_highlighted,
                     'position': self.position,
                     'length': self.question.length,
-                    'guesses': guesses,
-                    'matches': matches_plain,
-                    'matches_highlighted': matches_highlighted,
-                    'autopilot_prediction': autopilot_prediction,
+                    'sent_at': time.time(),  # for clients measuring delivery latency
                 }
+                msg.update(panels)
                 self.latest_resume_msg = msg
                 self.pbar.update(1)
+
+                snapshot_players, delta_players = [], []
                 for player in self.players.values():
-                    player.sendMessage(msg)
-                reactor.callLater(SECOND_PER_WORD, self.stream_next)
+                    if player.protocol == PROTOCOL_DELTA:
+                        delta_players.append(player)
+                    else:
+                        snapshot_players.append(player)
+                self.broadcast(msg, snapshot_players)
+                if len(delta_players) > 0:
+                    self.broadcast(self.get_delta_msg(msg, panels), delta_players)
+                self.delta_panels = panels
+                self.delta_resets = self.renderer.resets
+                self.call_later(SECOND_PER_WORD, self.stream_next)
+
+    def get_display_panels(self):
+        '''
+        Get the guesses, matches and autopilot prediction for display. These
+        only change with the cache keyframe; the snapshot renders them once
+        per keyframe, or reads them from the render bundle. Positions
+        without a keyframe show empty panels, the words keep streaming.
+        '''
+        if self.cache_entry is None:
+            self.panels = EMPTY_PANELS
+        else:
+            self.panels = self.snapshot.panels(self.position)
+        return self.panels
 
-    def get_player_list(self):
-        player_list = []
-        for p in self.db.query(Player):
-            active = (p.id in self.players) and (self.players[p.id].active)
-            if not active:
-                continue
+    def get_delta_msg(self, msg, panels):
+        '''
+        RESUME message for PROTOCOL_DELTA players: the new token and its
+        highlight, plus the panels only if they changed since the last
+        frame. If the highlight of words already displayed changed, the
+        indices of all highlighted words are included.
+        '''
+        delta = {
+            'type': MSG_TYPE_RESUME,
+            'qid': msg['qid'],
+            'position': msg['position'],
+            'length': msg['length'],
+            'token': self.question.tokens[self.position - 1],
+            'highlight': self.renderer.flags[-1],
+            'sent_at': msg['sent_at'],
+        }
+        if self.renderer.resets != self.delta_resets:
+            delta['highlights'] = [i for i, x in enumerate(self.renderer.flags) if x]
+        if panels is not self.delta_panels:
+            delta.update(panels)
+        return delta
 
-            if self.room_id_and_round is not None:
-                round_stat = self.db.query(PlayerRoundStat).get((p.id, self.room_id_and_round))
-                if round_stat is None:
-                    round_stat = PlayerRoundStat(
-                        player_id=p.id,
-                        room_id=self.room_id_and_round,
-                        qb_score=0,
-                        ew_score=0,
-                        questions_answered=[],
-                        questions_correct=[],
-                    )
-                    self.db.add(round_stat)
-                    self.db.commit()
-                qb_score = round_stat.qb_score
-                ew_score = round_stat.ew_score
-                questions_answered = len(set(round_stat.questions_answered))
-                questions_correct = len(set(round_stat.questions_correct))
-            else:
-                qb_score = 0
-                ew_score = 0
-                questions_answered = 0
-                questions_correct = 0
-
-            player_list.append({
-                'player_id': p.id,
-                'player_name': p.name,
-                'score': qb_score,
-                'ew_score': round(ew_score, 2),
-                'questions_answered': questions_answered,
-                'questions_correct': questions_correct,
-                'active': active,
-            })
-        player_list = sorted(player_list, key=lambda x: (x['active'], x['score']), reverse=True)
-        return player_list
+    def get_snapshot_msg(self, player):
+        '''
+        Latest RESUME message for a player who joins in the middle of a
+        question. PROTOCOL_DELTA players also get the tokens, highlights
+        and bells they need to apply later deltas.
+        '''
+        msg = self.latest_resume_msg
+        if player.protocol == PROTOCOL_DELTA:
+            position = self.renderer.position
+            msg = dict(
+                msg,
+                tokens=self.question.tokens[:position],
+                highlights=[i for i, x in enumerate(self.renderer.flags) if x],
+                bells=sorted(x for x in self.renderer.bell_positions if 0 < x <= position),
+            )
+        return msg
+
+    def get_player_list(self):
+        return self.leaderboard.player_list(self.players.values())
 
     def _buzzing(self, buzzing_ids, end_of_question):
         random.shuffle(buzzing_ids)
@@ -683,7 +788,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
         self.info_text += NEW_LINE + BADGE_BUZZ
         self.info_text += ' {}: '.format(boldify(green_player.player_name))
-        self.bell_positions.append(self.position)
+        self.renderer.add_bell(self.position)
 
         msg = {
             'qid': self.question.id,
@@ -693,49 +798,35 @@ class BroadcastServerFactory(WebSocketServerFactory):
 
         msg['type'] = MSG_TYPE_BUZZING_GREEN
         green_player.sendMessage(msg)
+        if green_player.buzz_requested is not None:
+            metrics.BUZZ_TO_GREEN_SECONDS.observe(time.perf_counter() - green_player.buzz_requested)
+        # the players who lost the race are timed again from their next request
+        for player in self.players.values():
+            player.buzz_requested = None
         green_player.buzzed = True
         green_player.position_buzz = self.position
         green_player.questions_answered.append(self.question.id)
 
-        msg['type'] = MSG_TYPE_BUZZING_RED
-        for player in self.players.values():
-            if player.player_id != buzzing_id:
-                player.sendMessage(msg)
+        msg = dict(msg, type=MSG_TYPE_BUZZING_RED)
+        self.broadcast(msg, [x for x in self.players.values() if x.player_id != buzzing_id])
 
         self.latest_buzzing_msg = msg
 
-        condition = partial(
-            self.check_player_response,
-            green_player,
-            'type',
-            MSG_TYPE_BUZZING_ANSWER,
-        )
-
         def callback(x):
             self._buzzing_after(buzzing_id, end_of_question, timed_out=False)
 
         def errback(x):
+            if x.check(CancelledError):
+                # everyone left, see pause
+                return
             logger.info(f'{self.room_id_base} [buzzing] player {green_player.player_name} answer time out')
             self._buzzing_after(buzzing_id, end_of_question, timed_out=True)
 
-        if condition():
-            callback(None)
-        else:
-            deferred = Deferred()
-            deferred.addTimeout(ANSWER_TIME_OUT, reactor)
-            deferred.addCallbacks(callback, errback)
-            self.deferreds.append((deferred, condition))
+        deferred = self.deferreds.wait(green_player, 'type', MSG_TYPE_BUZZING_ANSWER, ANSWER_TIME_OUT)
+        deferred.addCallbacks(callback, errback)
 
     def judge(self, guess):
-        answer = self.question.answer.strip().lower()
-        if guess.strip().lower() == answer:
-            return True
-
-        alternatives = [x.strip().lower() for x in self.question.meta.get('alternative_answers', [])]
-        if guess.strip().lower() in alternatives:
-            return True
-
-        return False
+        return self.factory.answers.judge(self.question.id, guess)
 
     def _buzzing_after(self, buzzing_id, end_of_question, timed_out):
         try:
@@ -788,13 +879,10 @@ class BroadcastServerFactory(WebSocketServerFactory):
             msg['type'] = MSG_TYPE_RESULT_MINE
             green_player.sendMessage(msg)
 
-            msg['type'] = MSG_TYPE_RESULT_OTHER
-            can_buzz_players = 0
-            for player in self.players.values():
-                if player.player_id != green_player.player_id:
-                    player.sendMessage(msg)
-                    if player.can_buzz(self.question.id):
-                        can_buzz_players += 1
+            msg = dict(msg, type=MSG_TYPE_RESULT_OTHER)
+            other_players = [x for x in self.players.values() if x.player_id != green_player.player_id]
+            self.broadcast(msg, other_players)
+            can_buzz_players = sum(x.can_buzz(self.question.id) for x in other_players)
 
             if can_buzz_players == 0:
                 end_of_question = True
@@ -804,7 +892,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
         if end_of_question or result:
             self._end_of_question()
         else:
-            reactor.callLater(SECOND_PER_WORD * 2, self.stream_next)
+            self.call_later(SECOND_PER_WORD * 2, self.stream_next)
 
     def _end_of_question(self):
         # notify players of end of game and send correct answer
@@ -814,7 +902,9 @@ class BroadcastServerFactory(WebSocketServerFactory):
         # but show guesses & matches where the question ended
         self.position = self.question.length
         text_plain, text_highlighted = self.get_display_question()
-        matches_plain, matches_highlighted = self.get_display_matches()
+        self.release_snapshot()
+        self.cache_entry = None
+        self.panels = None
 
         history = {
             'header': self.question.answer,
@@ -838,20 +928,22 @@ class BroadcastServerFactory(WebSocketServerFactory):
             'history_entries': self.history_entries
         }
 
-        for player in self.players.values():
-            player.sendMessage(msg)
+        self.broadcast(msg)
 
+        # standings before this question, its results are added below
         self.player_list = self.get_player_list()
 
+        writes = QuestionWrites()
         try:
             to_remove = []  # list of inactive users to be removed
             for player_id, player in self.players.items():
-                player_in_db = self.db.query(Player).get(player_id)
-                player_in_db.score = player.score
-                player_in_db.questions_seen = player.questions_seen
-                player_in_db.questions_answered = player.questions_answered
-                player_in_db.questions_correct = player.questions_correct
-                self.db.commit()
+                writes.update_player(
+                    player_id,
+                    score=player.score,
+                    questions_seen=player.questions_seen,
+                    questions_answered=player.questions_answered,
+                    questions_correct=player.questions_correct,
+                )
 
                 if not player.active:
                     to_remove.append(player_id)
@@ -860,11 +952,11 @@ class BroadcastServerFactory(WebSocketServerFactory):
                 date = datetime.now()
                 record_id = json.dumps({
                     'question_id': self.question.id,
-                    'player_id': player_in_db.id,
+                    'player_id': player_id,
                     'date': str(date),
                 })
 
-                record = Record(
+                writes.add_record(
                     id=record_id,
                     player_id=player.player_id,
                     question_id=self.question.id,
@@ -880,34 +972,29 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     player_list=self.player_list,
                     date=date,
                 )
-                self.db.add(record)
-                self.db.commit()
-
-                round_stat = self.db.query(PlayerRoundStat).get((player.player_id, self.room_id_and_round))
-                if round_stat is None:
-                    round_stat = PlayerRoundStat(
-                        player_id=player.player_id,
-                        room_id=self.room_id_and_round,
-                        qb_score=0,
-                        ew_score=0,
-                        questions_answered=[],
-                        questions_correct=[],
-                    )
-                    self.db.add(round_stat)
-                    self.db.commit()
-
-                round_stat.qb_score += player.buzz_info.get('qb_score', 0)
-                round_stat.ew_score += player.buzz_info.get('ew_score', 0)
-                if 'result' in player.buzz_info:
-                    round_stat.questions_answered = round_stat.questions_answered + [self.question.id]
-                    if player.buzz_info['result']:
-                        round_stat.questions_correct = round_stat.questions_correct + [self.question.id]
 
-                self.db.commit()
+                answered = 'result' in player.buzz_info
+                writes.add_round_stat(
+                    player.player_id,
+                    self.room_id_and_round,
+                    qb_score=player.buzz_info.get('qb_score', 0),
+                    ew_score=player.buzz_info.get('ew_score', 0),
+                    answered=self.question.id if answered else None,
+                    correct=self.question.id if answered and player.buzz_info['result'] else None,
+                )
+                if answered:
+                    self.leaderboard.add(
+                        player,
+                        self.question.id,
+                        player.buzz_info['qb_score'],
+                        player.buzz_info['ew_score'],
+                        player.buzz_info['result'],
+                    )
 
                 # clear player response
                 player.response = None
                 player.buzzed = False
+                player.buzz_requested = None
                 player.position_start = 0
                 player.position_buzz = -1
                 player.buzz_info = dict()
@@ -932,10 +1019,13 @@ class BroadcastServerFactory(WebSocketServerFactory):
         except Exception:
             traceback.print_exc(file=sys.stdout)
 
+        # committed off the reactor thread, see WriteBehindWriter
+        self.writer.submit(writes)
+
         logger.info(self.room_id_base + '-' * 60)
         self.pbar.close()
 
-        reactor.callLater(SECONDS_TILL_NEW_QUESTION, self.new_question)
+        self.call_later(SECONDS_TILL_NEW_QUESTION, self.new_question)
 
         # if len(self.players) > 0:
         #     reactor.callLater(PLAYER_RESPONSE_TIME_OUT, self.new_question)
@@ -944,12 +1034,114 @@ class BroadcastServerFactory(WebSocketServerFactory):
         #     pass
 
 
+class BroadcastServerFactory(WebSocketServerFactory):
+    '''
+    Hosts many independent rooms in one reactor. Clients are routed to a
+    room by the path of the URL they connect to, rooms are created when
+    their first client connects and closed once they have been empty for
+    `room_idle_timeout` seconds.
+    '''
+
+    def __init__(
+        self,
+        url: str,
+        default_room: str = 'room_1',
+        max_rooms: int = settings.MAX_ROOMS,
+        room_idle_timeout: float = settings.ROOM_IDLE_TIMEOUT,
+    ):
+        WebSocketServerFactory.__init__(self, url)
+        # the connection of an in-memory database cannot be used by two threads
+        self.writer = WriteBehindWriter(SessionLocal, reactor, threaded=not single_connection(engine))
+        self.writer.start()
+
+        self.default_room = default_room
+        self.max_rooms = max_rooms
+        self.room_idle_timeout = room_idle_timeout
+        self.rooms = dict()  # room_id -> Room
+        self.questions = dict()  # tournament prefix -> questions, shared by rooms
+        with session_scope() as db:
+            self.answers = AnswerIndex.load_vocabulary(db)  # acceptable answers of the loaded questions
+        self.snapshots = SnapshotCache(load_bundles(settings.RENDER_BUNDLE_DIR))
+        self.wheel = TimingWheel(reactor)  # word ticks and countdowns of all rooms
+        self.wheel.observers.append(metrics.TICK_LATENESS_SECONDS.observe)
+        metrics.watch_rooms(self)
+
+    def route(self, path: str) -> str:
+        '''
+        Room id for the URL path of a connection. Handshakes for a new room
+        are refused when the process is full: sending them to another room
+        could start a copy of a room that another worker owns. Empty rooms
+        waiting to be closed do not count.
+        '''
+        room_id = parse_room_id(path, self.default_room)
+        if room_id not in self.rooms and self.active_rooms() >= self.max_rooms:
+            logger.warning(f'too many rooms, refusing client of {room_id}')
+            raise ConnectionDeny(ConnectionDeny.SERVICE_UNAVAILABLE, 'server full')
+        return room_id
+
+    def active_rooms(self) -> int:
+        return sum(room.active() for room in self.rooms.values())
+
+    def get_room(self, room_id: str) -> Room:
+        room = self.rooms.get(room_id)
+        if room is None:
+            logger.info(f'[rooms] open {room_id}')
+            room = self.rooms[room_id] = Room(room_id, self)
+        return room
+
+    def close_later(self, room: Room):
+        if room.close_call is None or not room.close_call.active():
+            room.close_call = reactor.callLater(self.room_idle_timeout, self.close_room, room)
+
+    def close_room(self, room: Room):
+        '''forget `room` if it is still empty, once its writes are committed'''
+        room.close_call = None
+
+        def close(_):
+            if not room.active() and self.rooms.get(room.room_id_base) is room:
+                logger.info(f'[rooms] close {room.room_id_base}')
+                self.rooms.pop(room.room_id_base)
+
+        if not room.active():
+            self.writer.flush().addCallback(close)
+
+    def get_questions(self, tournament_str: str):
+        if tournament_str not in self.questions:
+            # kept for the life of the process, read after the session is closed
+            with session_scope() as db:
+                self.questions[tournament_str] = db.query(Question) \
+                    .filter(Question.tournament.startswith(tournament_str)) \
+                    .all()
+            self.answers.add_questions(self.questions[tournament_str])
+        return self.questions[tournament_str]
+
+    def register(self, client):
+        room_id = getattr(client, 'room_id', self.default_room)
+        client.room = self.get_room(room_id)
+        if client.room.close_call is not None and client.room.close_call.active():
+            client.room.close_call.cancel()
+            client.room.close_call = None
+        client.room.register(client)
+
+    def unregister(self, client):
+        if client.room is not None:
+            client.room.unregister(client)
+
+    def receive(self, payload, client, isBinary=False):
+        if client.room is None:
+            logger.warning("Message from {} before it joined a room".format(client.peer))
+            return
+        client.room.receive(payload, client, isBinary)
+
+
 if __name__ == '__main__':
     factory = BroadcastServerFactory(u"ws://127.0.0.1:9000")
     factory.protocol = BroadcastServerProtocol
     listenWS(factory)
 
     webdir = File("web/index.html")
+    webdir.putChild(b'autocomplete', AutocompleteResource(AnswerCompleter.load(settings.ANSWER_VOCABULARY)))
+    webdir.putChild(b'metrics', metrics.MetricsResource())
     web = Site(webdir)
     reactor.listenTCP(8080, web)
 
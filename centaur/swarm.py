@@ -0,0 +1,321 @@
+'''
+Load test a running server with a swarm of simulated players.
+
+    python -m centaur.swarm --url ws://127.0.0.1:9000 --players 2000 --rooms 8 --processes 4 --duration 120
+
+Players buzz with the expected wins back-solve of
+`SimulatedPlayerProtocol` and are spread over `--rooms` rooms. The first
+player of each room starts a round if the room is paused. Each process
+runs its own reactor; they are forked before any reactor exists, like the
+workers of `centaur/launcher.py`.
+
+Reported:
+- word latency: from the server building a RESUME message (its `sent_at`)
+  to a player receiving it. The swarm must run on the server host, the
+  two clocks are compared.
+- buzz latency: from a player sending a buzz request to receiving the
+  green or red light. Buzzes are arbitrated on the next word tick, so
+  this includes up to `SECOND_PER_WORD` of waiting.
+- lost words: for every question that ended during the run, positions a
+  player did not receive between the first one it saw and the last one
+  sent in its room.
+- swarm lag: how late a 100 ms timer of each swarm process runs. If it is
+  high, the swarm is saturated and the latencies measure the swarm, so
+  add processes.
+
+The server stops after a round until an admin starts the next one, keep
+`--duration` below the length of a round.
+'''
+import sys
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+
+import numpy as np
+
+from centaur.config import settings
+from centaur.utils import PROTOCOL_SNAPSHOT, PROTOCOL_DELTA
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('swarm')
+
+PERCENTILES = (50, 90, 99, 99.9)
+LAG_INTERVAL = 0.1  # seconds between checks of the swarm event loop
+PROTOCOLS = {'snapshot': PROTOCOL_SNAPSHOT, 'delta': PROTOCOL_DELTA}
+CODECS = ('msgpack', 'cbor', 'json')
+
+
+def load_answers() -> dict:
+    '''question id -> answer, so that players can answer correctly'''
+    from centaur.db.session import SessionLocal
+    from centaur.models import Question
+
+    db = SessionLocal()
+    try:
+        return dict(db.query(Question.id, Question.answer))
+    except Exception:
+        logger.warning('cannot load the answers, players will answer wrong', exc_info=True)
+        return dict()
+    finally:
+        db.close()
+
+
+class SwarmStats:
+    '''Measurements of the players of one swarm process.'''
+
+    def __init__(self):
+        self.word_latency = []  # seconds
+        self.buzz_latency = []  # seconds
+        self.lag = []  # seconds
+        self.received = 0  # messages
+        self.buzzes = 0
+        self.greens = 0
+        self.correct = 0
+        self.answered = 0
+        self.connected = 0
+        self.failed = 0  # connections that never opened
+        self.closed = 0  # connections closed by the server or the network
+        # (room, qid) -> last position sent, of questions that ended
+        self.ended = dict()
+        # (room, qid, first position seen, positions seen) per player and question
+        self.questions = []
+
+    def result(self) -> dict:
+        '''what a process sends back to the parent'''
+        result = dict(vars(self))
+        for key in ('word_latency', 'buzz_latency', 'lag'):
+            result[key] = np.array(result[key], dtype=np.float64)
+        return result
+
+
+def merge_results(results: list) -> dict:
+    merged = dict()
+    for result in results:
+        for key, value in result.items():
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, np.ndarray):
+                merged[key] = np.concatenate([merged[key], value])
+            elif isinstance(value, dict):
+                for k, v in value.items():
+                    merged[key][k] = max(merged[key].get(k, 0), v)
+            else:
+                merged[key] = merged[key] + value
+    return merged
+
+
+def lost_words(result: dict):
+    '''(words expected, words lost) in the questions that ended during the run'''
+    expected, lost = 0, 0
+    for room_id, qid, first, seen in result['questions']:
+        last = result['ended'].get((room_id, qid))
+        if last is None or first is None:
+            continue
+        n = last - first + 1
+        expected += n
+        lost += max(0, n - seen)
+    return expected, lost
+
+
+def format_latency(name: str, values: np.ndarray) -> str:
+    if len(values) == 0:
+        return f'{name:<16} no samples'
+    cells = [f'p{p:g} {np.percentile(values, p) * 1000:8.2f}ms' for p in PERCENTILES]
+    return f'{name:<16} n={len(values):<8} ' + '  '.join(cells) + f'  max {values.max() * 1000:8.2f}ms'
+
+
+def report(result: dict, duration: float) -> str:
+    expected, lost = lost_words(result)
+    lines = [
+        f'players connected {result["connected"]}, failed {result["failed"]}, closed early {result["closed"]}',
+        f'messages received {result["received"]} ({result["received"] / duration:.0f}/s)',
+        f'buzzes {result["buzzes"]}, green {result["greens"]}, answered {result["answered"]}, correct {result["correct"]}',
+        format_latency('word latency', result['word_latency']),
+        format_latency('buzz latency', result['buzz_latency']),
+        format_latency('swarm lag', result['lag']),
+        f'words lost {lost} of {expected} ({lost / max(expected, 1):.4%}) in {len(result["ended"])} questions',
+    ]
+    return '\n'.join(lines)
+
+
+def run_swarm(url: str, players: list, n_rooms: int, duration: float, ramp: float,
+              protocol: str, answers: dict, queue=None, codec: str = 'json') -> dict:
+    '''
+    Run `players` (global player indices) until `duration` seconds after
+    the last one connected, and return or put on `queue` their results.
+    '''
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from autobahn.twisted.websocket import connectWS
+    from centaur.client import PlayerFactory, SimulatedPlayerProtocol
+    from centaur.expected_wins import ExpectedWins
+
+    stats = SwarmStats()
+    protocols = []
+    stopping = False
+
+    class SwarmPlayerProtocol(SimulatedPlayerProtocol):
+
+        def onOpen(self):
+            SimulatedPlayerProtocol.onOpen(self)
+            stats.connected += 1
+            protocols.append(self)
+            self.opened = True
+            self.room_id = self.factory.room_id
+            if self.factory.starters > 0:
+                self.factory.starters -= 1
+                self.start_new_round = True
+            self.buzz_sent = None  # perf_counter() of the pending buzz request
+            self.first = None  # first position seen of the current question
+            self.seen = set()
+
+        def onClose(self, wasClean, code, reason):
+            if stopping:
+                return
+            if getattr(self, 'opened', False):
+                stats.closed += 1
+            else:
+                stats.failed += 1
+
+        def onMessage(self, payload, isBinary):
+            stats.received += 1
+            try:
+                SimulatedPlayerProtocol.onMessage(self, payload, isBinary)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+        def finish_question(self):
+            if self.qid is not None and len(self.seen) > 0:
+                stats.questions.append((self.room_id, self.qid, self.first, len(self.seen)))
+            self.first = None
+            self.seen = set()
+
+        def new_question(self, msg):
+            if msg['qid'] != self.qid:
+                self.finish_question()
+            SimulatedPlayerProtocol.new_question(self, msg)
+
+        def update_question(self, msg):
+            if 'sent_at' in msg and msg['qid'] == self.qid:
+                if self.first is None:
+                    # players joining mid-question first get the latest word again
+                    self.first = msg['position']
+                else:
+                    stats.word_latency.append(time.time() - msg['sent_at'])
+                self.seen.add(msg['position'])
+            buzzed = self.buzzed
+            SimulatedPlayerProtocol.update_question(self, msg)
+            if self.buzzed and not buzzed:
+                stats.buzzes += 1
+                self.buzz_sent = time.perf_counter()
+
+        def arbitrated(self):
+            if self.buzz_sent is not None:
+                stats.buzz_latency.append(time.perf_counter() - self.buzz_sent)
+                self.buzz_sent = None
+
+        def send_answer(self, msg):
+            self.arbitrated()
+            stats.greens += 1
+            SimulatedPlayerProtocol.send_answer(self, msg)
+
+        def buzz_denied(self, msg):
+            self.arbitrated()
+
+        def handle_result(self, msg):
+            stats.answered += 1
+            stats.correct += bool(msg['result'])
+
+        def end_of_question(self, msg):
+            if msg['qid'] == self.qid and len(self.seen) > 0:
+                # the question may end before its last word, on a correct buzz
+                key = (self.room_id, self.qid)
+                stats.ended[key] = max(stats.ended.get(key, 0), max(self.seen))
+            self.finish_question()
+
+    ids = set(players)
+    ew = ExpectedWins()
+    factories = []
+    for room in range(n_rooms):
+        factory = PlayerFactory(f'{url}/swarm_{room}', answers=answers, ew=ew, protocol=protocol, codecs=(codec,))
+        factory.protocol = SwarmPlayerProtocol
+        factory.room_id = f'swarm_{room}'
+        # the first player of each room starts its round, in one process only
+        factory.starters = int(room in ids)
+        factories.append(factory)
+
+    for i, index in enumerate(players):
+        reactor.callLater(i / ramp, connectWS, factories[index % n_rooms])
+
+    last_check = [time.perf_counter()]
+
+    def check_lag():
+        now = time.perf_counter()
+        stats.lag.append(max(0.0, now - last_check[0] - LAG_INTERVAL))
+        last_check[0] = now
+
+    def stop():
+        nonlocal stopping
+        stopping = True
+        for protocol in protocols:
+            protocol.finish_question()
+        reactor.stop()
+
+    LoopingCall(check_lag).start(LAG_INTERVAL, now=False)
+    reactor.callLater(len(players) / ramp + duration, stop)
+    reactor.run()
+
+    result = stats.result()
+    if queue is not None:
+        queue.put(result)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='load test a running server with simulated players')
+    parser.add_argument('--url', default='ws://127.0.0.1:9000')
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--rooms', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=60, help='seconds after the last player connected')
+    parser.add_argument('--ramp', type=float, default=200, help='connections per second of each process')
+    parser.add_argument('--protocol', choices=sorted(PROTOCOLS), default='delta', help='format of RESUME messages')
+    parser.add_argument('--codec', choices=CODECS, default='msgpack', help='encoding of messages, JSON if the server does not offer it')
+    args = parser.parse_args(argv)
+    protocol = PROTOCOLS[args.protocol]
+
+    if 'twisted.internet.reactor' in sys.modules:
+        raise RuntimeError('the reactor must not be installed before forking the swarm')
+    answers = load_answers()
+    logging.getLogger('client').setLevel(logging.WARNING)
+
+    start = time.time()
+    shares = [list(range(p, args.players, args.processes)) for p in range(args.processes)]
+    if args.processes == 1:
+        results = [run_swarm(args.url, shares[0], args.rooms, args.duration, args.ramp, protocol, answers, codec=args.codec)]
+    else:
+        context = multiprocessing.get_context(settings.MP_CONTEXT)
+        queue = context.Queue()
+        processes = [
+            context.Process(
+                target=run_swarm,
+                args=(args.url, share, args.rooms, args.duration, args.ramp, protocol, answers, queue, args.codec),
+                daemon=True,
+            )
+            for share in shares
+        ]
+        for process in processes:
+            process.start()
+        # read before joining, a process does not exit until its result is read
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    print(report(merge_results(results), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
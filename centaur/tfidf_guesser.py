@@ -0,0 +1,174 @@
+'''
+An in-process guesser: TF-IDF over a local corpus of evidence passages,
+in place of the guesser service, for machines without it or without a
+network.
+
+    python scripts/build_guesser_index.py --exclude spring_novice
+    python scripts/cache_qanta.py --guesser tfidf
+
+The evidence of an answer is all its passages. A text is guessed by the
+cosine similarity of its TF-IDF vector with the vector of each answer,
+and highlighted with the passages closest to it, matched words in <em>
+like Elasticsearch highlights. Texts are scored in batches with one
+sparse matrix product, see `settings.GUESSER_BATCH`.
+
+The index is read only once built, one instance can be shared by threads.
+'''
+import re
+import json
+import hashlib
+
+import numpy as np
+from scipy import sparse
+
+from centaur.config import settings
+
+
+WORD_PATTERN = re.compile(r'\w+')
+SENTENCE_PATTERN = re.compile(r'(?<=[.?!])\s+')
+
+
+def words(text: str) -> list:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def split_passages(text: str, min_words: int = 4) -> list:
+    '''sentences of `text` long enough to be evidence'''
+    return [x for x in SENTENCE_PATTERN.split(text.strip()) if len(x.split()) >= min_words]
+
+
+def tf_idf(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    '''sublinear term frequencies times `idf`, rows of unit norm'''
+    matrix = counts.astype(np.float32)
+    matrix.data = 1 + np.log(matrix.data)
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def top(scores: sparse.csr_matrix, n: int) -> list:
+    '''for each row of `scores`, (column, score) of its `n` best columns, best first'''
+    result = []
+    for i in range(scores.shape[0]):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        data, columns = scores.data[start:end], scores.indices[start:end]
+        if len(data) > n:
+            best = np.argpartition(-data, n)[:n]
+            data, columns = data[best], columns[best]
+        order = np.argsort(-data, kind='stable')
+        result.append([(int(columns[j]), float(data[j])) for j in order])
+    return result
+
+
+class TfidfGuesser:
+
+    def __init__(self, vocabulary: list, idf: np.ndarray, answers: list, answer_matrix,
+                 passages: list, passage_matrix, digest: str):
+        self.vocabulary = vocabulary
+        self.term_ids = {x: i for i, x in enumerate(vocabulary)}
+        self.idf = idf
+        self.answers = answers
+        self.passages = passages
+        # terms x answers and terms x passages, so that texts x terms products stay CSR
+        self.answer_terms = sparse.csr_matrix(answer_matrix.T)
+        self.passage_terms = sparse.csr_matrix(passage_matrix.T)
+        self.version = f'tfidf-{digest[:12]}'  # stamped on cached questions
+
+    @classmethod
+    def build(cls, documents):
+        '''from (answer, passage) pairs'''
+        answer_ids, term_ids = dict(), dict()
+        rows, columns, passage_answer, passages = [], [], [], []
+        for answer, passage in documents:
+            terms = words(passage)
+            if len(terms) == 0:
+                continue
+            passage_answer.append(answer_ids.setdefault(answer, len(answer_ids)))
+            columns.extend(term_ids.setdefault(x, len(term_ids)) for x in terms)
+            rows.extend([len(passages)] * len(terms))
+            passages.append(passage)
+
+        shape = (len(passages), len(term_ids))
+        counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+        counts.sum_duplicates()
+        df = np.bincount(counts.indices, minlength=len(term_ids))
+        idf = (np.log((1 + len(passages)) / (1 + df)) + 1).astype(np.float32)
+
+        # answers x passages, sums the counts of the passages of each answer
+        owner = sparse.csr_matrix(
+            (np.ones(len(passages), dtype=np.float32), (passage_answer, np.arange(len(passages)))),
+            shape=(len(answer_ids), len(passages)))
+        vocabulary = sorted(term_ids, key=term_ids.get)
+        answers = sorted(answer_ids, key=answer_ids.get)
+        digest = hashlib.sha1(json.dumps([answers, passages], ensure_ascii=False).encode('utf-8')).hexdigest()
+        return cls(vocabulary, idf, answers, tf_idf(owner @ counts, idf), passages, tf_idf(counts, idf), digest)
+
+    def save(self, path: str):
+        answer_matrix = sparse.csr_matrix(self.answer_terms.T)
+        passage_matrix = sparse.csr_matrix(self.passage_terms.T)
+        strings = json.dumps({'vocabulary': self.vocabulary, 'answers': self.answers, 'passages': self.passages},
+                             ensure_ascii=False)
+        np.savez_compressed(
+            path,
+            strings=np.array(strings),
+            digest=np.array(self.version[len('tfidf-'):]),
+            idf=self.idf,
+            **{f'answer_{k}': v for k, v in matrix_arrays(answer_matrix).items()},
+            **{f'passage_{k}': v for k, v in matrix_arrays(passage_matrix).items()},
+        )
+
+    @classmethod
+    def load(cls, path: str = settings.GUESSER_INDEX):
+        with np.load(path, allow_pickle=False) as f:
+            strings = json.loads(str(f['strings']))
+            return cls(
+                strings['vocabulary'], f['idf'], strings['answers'], load_matrix(f, 'answer'),
+                strings['passages'], load_matrix(f, 'passage'), str(f['digest']),
+            )
+
+    def vectors(self, texts: list) -> sparse.csr_matrix:
+        '''texts x terms, words outside the vocabulary are dropped'''
+        rows, columns = [], []
+        for i, text in enumerate(texts):
+            ids = [self.term_ids[x] for x in words(text) if x in self.term_ids]
+            columns.extend(ids)
+            rows.extend([i] * len(ids))
+        counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                   shape=(len(texts), len(self.vocabulary)))
+        counts.sum_duplicates()
+        return tf_idf(counts, self.idf)
+
+    def scores(self, texts: list, terms: sparse.csr_matrix, n: int, batch: int):
+        for start in range(0, len(texts), batch):
+            yield from top(self.vectors(texts[start:start + batch]) @ terms, n)
+
+    def guess(self, texts: list, n: int = 10, batch: int = settings.GUESSER_BATCH) -> list:
+        '''answer -> score for each text, its `n` best answers'''
+        return [
+            {self.answers[j]: score for j, score in best}
+            for best in self.scores(texts, self.answer_terms, n, batch)
+        ]
+
+    def highlight(self, texts: list, n: int = 4, batch: int = settings.GUESSER_BATCH) -> list:
+        '''for each text, its `n` closest passages with the words of the text in <em>'''
+        results = []
+        for text, best in zip(texts, self.scores(texts, self.passage_terms, n, batch)):
+            query = set(words(text))
+
+            def mark(match):
+                return f'<em>{match.group()}</em>' if match.group().lower() in query else match.group()
+
+            # under 'wiki' like the service, read by GuesserBuzzer.get_matched
+            results.append({'wiki': [WORD_PATTERN.sub(mark, self.passages[j]) for j, _ in best]})
+        return results
+
+
+def matrix_arrays(matrix: sparse.csr_matrix) -> dict:
+    return {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr, 'shape': np.array(matrix.shape)}
+
+
+def load_matrix(f, prefix: str) -> sparse.csr_matrix:
+    return sparse.csr_matrix(
+        (f[f'{prefix}_data'], f[f'{prefix}_indices'], f[f'{prefix}_indptr']),
+        shape=tuple(f[f'{prefix}_shape']))
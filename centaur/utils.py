@@ -3,6 +3,7 @@ import json
 import string
 import itertools
 import subprocess
+import unicodedata
 from nltk import word_tokenize
 
 
@@ -18,6 +19,9 @@ MSG_TYPE_RESULT_OTHER = 8       # result of someone else's answer
 MSG_TYPE_COMPLETE = 9           # answered all questions
 MSG_TYPE_NEW_ROUND = 10         # start next round
 
+PROTOCOL_SNAPSHOT = 1           # RESUME carries the full text and panels
+PROTOCOL_DELTA = 2              # RESUME carries the new token, panels only when changed
+
 BADGE_CORRECT = ' <span class="badge badge-success">Correct</span>'
 BADGE_WRONG = ' <span class="badge badge-warning">Wrong</span>'
 BADGE_BUZZ = '<span class="badge badge-danger">Buzz</span>'
@@ -58,6 +62,17 @@ highlight_template = highlight_prefix + '{}' + highlight_suffix
 # highlight_template = '<mark data-entity=\"norp\">{}</mark>'
 
 
+ROOM_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def parse_room_id(path: str, default_room: str = 'room_1') -> str:
+    '''room id in the path of a URL, `default_room` if there is none'''
+    room_id = path.split('?')[0].strip('/')
+    if room_id == '' or not ROOM_ID_PATTERN.match(room_id):
+        return default_room
+    return room_id
+
+
 def boldify(text):
     return '<b>{}</b>'.format(text)
 
@@ -101,6 +116,23 @@ def clean_question(question: str):
     return re.sub(regex_pattern, '', question.strip().lower())
 
 
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+APOSTROPHE_PATTERN = re.compile(r"['’`´]")
+# letters that do not decompose into a base letter and an accent
+FOLDED_LETTERS = str.maketrans({
+    'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'ħ': 'h', 'ı': 'i',
+    'æ': 'ae', 'œ': 'oe', 'þ': 'th',
+})
+
+
+def normalize_answer(text: str) -> str:
+    '''casefold, strip accents and punctuation, collapse whitespace'''
+    text = unicodedata.normalize('NFKD', text.casefold()).translate(FOLDED_LETTERS)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = APOSTROPHE_PATTERN.sub('', text)
+    return ' '.join(NON_WORD_PATTERN.sub(' ', text).split())
+
+
 def tokenize_question(text):
     return word_tokenize(clean_question(text))
 
@@ -0,0 +1,596 @@
+'''
+Benchmarks of the server hot paths on synthetic questions, guesser
+keyframes and players, across room sizes and question lengths.
+
+    python scripts/benchmark.py --save baseline.json
+    python scripts/benchmark.py --compare baseline.json
+    python scripts/benchmark.py --filter stream_next
+
+Each case reports the median and minimum time per operation over
+`--repeat` runs. The codec cases also report the size of a message, and
+the cache_load cases the size of a question's guesser output in the
+legacy per-position rows or in keyframes. `--save` writes them as JSON;
+`--compare` prints the ratio to a saved baseline and exits with status 1
+if a case got slower than `--threshold` times its baseline. Baselines
+only compare on the same machine.
+
+The tfidf_guess cases time guessing and highlighting one prefix of a
+question with the in-process guesser of scripts/cache_qanta.py.
+
+Database work runs against an in-memory SQLite database, unless
+CENTAUR_SQLALCHEMY_DATABASE_URL is set. Cases whose dependencies are
+missing are skipped.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from datetime import datetime
+
+os.environ.setdefault('CENTAUR_SQLALCHEMY_DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import Table, MetaData, Column, String, Integer, select, func  # noqa: E402
+
+from centaur.db.session import SessionLocal, session_scope  # noqa: E402
+from centaur.db.types import JSONType  # noqa: E402
+from centaur.models import Question, QantaKeyframe, Player  # noqa: E402
+from centaur.cache_snapshot import CacheEntry, QantaSnapshot, compress, keyframe_records  # noqa: E402
+
+
+ROOM_SIZES = (1, 10, 100, 1000)
+QUESTION_LENGTHS = (50, 150, 400)
+CODECS = ('json', 'msgpack', 'cbor')
+KEYFRAME_EVERY = 5  # positions between calls to the guesser, like scripts/cache_qanta.py
+VOCABULARY = [f'word{i}' for i in range(2000)]
+
+
+def make_text(rng: random.Random, n: int) -> list:
+    return [rng.choice(VOCABULARY) for _ in range(n)]
+
+
+def make_match(rng: random.Random, n: int = 40) -> str:
+    '''a retrieved passage with some words in <em>, as the guesser returns them'''
+    return ' '.join(f'<em>{x}</em>' if rng.random() < 0.1 else x for x in make_text(rng, n))
+
+
+def make_entries(length: int, seed: int = 0):
+    '''question tokens and the guesser output at each position, which changes every KEYFRAME_EVERY words'''
+    rng = random.Random(seed)
+    tokens = make_text(rng, length)
+    entries = []
+    for position in range(1, length + 1):
+        if (position - 1) % KEYFRAME_EVERY == 0:
+            guesses = [(f'guess {rng.randrange(10000)}', rng.random()) for _ in range(10)]
+            buzz_scores = [rng.random(), rng.random()]
+            highlight = [rng.random() < 0.2 for _ in range(position)]
+            matches = [make_match(rng).split() for _ in range(4)]
+            matches_highlight = [[rng.random() < 0.1 for _ in x] for x in matches]
+        else:
+            highlight = highlight + [False]
+        entries.append(CacheEntry(
+            position=position,
+            guesses=guesses,
+            buzz_scores=buzz_scores,
+            matches=matches,
+            matches_highlight=matches_highlight,
+            text_highlight=highlight,
+        ))
+    return tokens, entries
+
+
+def make_question(qid: str, length: int, seed: int = 0):
+    '''a question with its QantaKeyframe rows'''
+    tokens, entries = make_entries(length, seed)
+    question = Question(
+        id=qid,
+        answer=f'answer {qid}',
+        raw_text=tokens,
+        length=length,
+        tokens=tokens,
+        tournament='benchmark',
+        meta={'alternative_answers': [f'alias {qid}']},
+    )
+    rows = [QantaKeyframe(**x) for x in keyframe_records(qid, compress(entries))]
+    return question, rows
+
+
+class FakeTransport:
+    '''stands in for the WebSocket of a player'''
+
+    def __init__(self, peer: str):
+        self.peer = peer
+        self.sent = 0
+
+    def sendMessage(self, payload, isBinary=False):
+        self.sent += len(payload)
+
+
+class InlineWriter:
+    '''commits `QuestionWrites` right away, one session each like `WriteBehindWriter`'''
+
+    def submit(self, writes):
+        with session_scope() as session:
+            writes.apply(session)
+
+    def pending_player(self, player_id: str) -> dict:
+        return dict()
+
+    def flush(self):
+        from twisted.internet.defer import succeed
+        return succeed(None)
+
+
+class BenchFactory:
+    '''what a `Room` uses of `BroadcastServerFactory`'''
+
+    def __init__(self):
+        from twisted.internet.task import Clock
+        from centaur.answers import AnswerIndex
+        from centaur.cache_snapshot import SnapshotCache
+        from centaur.scheduler import TimingWheel
+
+        self.writer = InlineWriter()
+        self.clock = Clock()  # timers are scheduled, never run
+        self.wheel = TimingWheel(self.clock, now=self.clock.seconds)
+        self.answers = AnswerIndex(aliases=dict())
+        self.snapshots = SnapshotCache()
+        self.rooms = dict()
+
+
+def make_room(db, question, n_players: int, in_db: bool = False):
+    '''a room streaming `question` to `n_players` players'''
+    from tqdm import tqdm
+    from centaur.server import Room, PlayerClient
+    from centaur.renderer import QuestionRenderer
+
+    factory = BenchFactory()
+    room = Room('benchmark', factory)
+    room.questions = [question]
+    room.question_index = 0
+    room.round_number_index = 0
+    room.room_id_and_round = 'benchmark_round'
+    room.question = question
+    room.renderer = QuestionRenderer(question.tokens)
+    room.snapshot = factory.snapshots.acquire(db, question.id)
+    room.pbar = tqdm(total=question.length, disable=True)
+    factory.answers.add_questions([question])
+    for i in range(n_players):
+        player = PlayerClient(FakeTransport(f'peer{i}'), player_id=f'player{i}', player_name=f'Player {i}')
+        room.players[player.player_id] = player
+        room.socket_to_player[player.client.peer] = player
+        room.leaderboard.add(player, question.id, 10 * (i % 3), 0.1 * i, bool(i % 2))
+        if in_db and db.query(Player).get(player.player_id) is None:
+            db.add(Player(
+                id=player.player_id,
+                ip_addr=player.client.peer,
+                name=player.player_name,
+                email=player.player_email,
+                mediator_name='RandomDynamicMediator',
+                score=0,
+                questions_seen=[],
+                questions_answered=[],
+                questions_correct=[],
+            ))
+    db.commit()
+    return room
+
+
+def load_question(db, length: int):
+    qid = f'q{length}'
+    question = db.query(Question).get(qid)
+    if question is None:
+        question, rows = make_question(qid, length, seed=length)
+        db.add(question)
+        db.add_all(rows)
+        db.commit()
+    return question
+
+
+def timed(n: int):
+    '''decorator: the case runs `n` operations and returns its elapsed time'''
+    def decorator(f):
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            f(*args, **kwargs)
+            return (time.perf_counter() - start) / n
+        return run
+    return decorator
+
+
+# cases: name, parameters -> function that runs once and returns seconds per operation
+
+def case_display_question(db, length):
+    question = load_question(db, length)
+    room = make_room(db, question, 0)
+
+    def run():
+        from centaur.renderer import QuestionRenderer
+        room.renderer = QuestionRenderer(question.tokens)
+        start = time.perf_counter()
+        for position in range(1, length + 1):
+            room.position = position
+            room.cache_entry = room.snapshot.keyframe(position)
+            room.get_display_question()
+        return (time.perf_counter() - start) / length
+    return run
+
+
+def case_display_panels(db, length):
+    question = load_question(db, length)
+    room = make_room(db, question, 0)
+    keyframes = QantaSnapshot.load(db, question.id).keyframes
+
+    def run():
+        # a new snapshot renders every keyframe again
+        room.snapshot = QantaSnapshot.from_keyframes(question.id, keyframes, length)
+        start = time.perf_counter()
+        for position in range(1, length + 1):
+            room.position = position
+            room.get_display_panels()
+        return (time.perf_counter() - start) / length
+    return run
+
+
+def case_stream_next(db, players, length):
+    from centaur.renderer import QuestionRenderer
+    from centaur.scheduler import TimingWheel
+    question = load_question(db, length)
+    room = make_room(db, question, players)
+
+    def run():
+        room.renderer = QuestionRenderer(question.tokens)
+        room.position = 0
+        room.delta_panels = None
+        room.delta_resets = 0
+        room.factory.wheel = TimingWheel(room.factory.clock, now=room.factory.clock.seconds)
+        start = time.perf_counter()
+        for _ in range(length):
+            room.stream_next()
+        return (time.perf_counter() - start) / length
+    return run
+
+
+def case_judge(db, questions):
+    from centaur.answers import AnswerIndex
+    rng = random.Random(questions)
+    answers = dict()
+    for i in range(questions):
+        answers[f'q{i}'] = ' '.join(make_text(rng, rng.randint(1, 4)))
+    index = AnswerIndex(aliases=dict(), vocabulary=answers.values())
+    for qid, answer in answers.items():
+        index.add(qid, answer, [f'{answer} (alias)'])
+    guesses = []
+    for qid, answer in answers.items():
+        guesses.append((qid, answer.upper()))  # exact
+        guesses.append((qid, answer[:-1] + 'x'))  # typo
+        guesses.append((qid, rng.choice(VOCABULARY)))  # wrong
+
+    @timed(len(guesses))
+    def run():
+        for qid, guess in guesses:
+            index.judge(qid, guess)
+    return run
+
+
+def case_player_list(db, players):
+    question = load_question(db, QUESTION_LENGTHS[0])
+    room = make_room(db, question, players)
+
+    @timed(1)
+    def run():
+        room.get_player_list()
+    return run
+
+
+def case_end_of_question(db, players):
+    question = load_question(db, QUESTION_LENGTHS[0])
+    room = make_room(db, question, players, in_db=True)
+
+    def run():
+        room.snapshot = room.factory.snapshots.acquire(db, question.id)
+        room.position = question.length
+        room.latest_resume_msg = {'guesses': [], 'matches_highlighted': []}
+        room.history_entries = []
+        for i, player in enumerate(room.players.values()):
+            player.questions_seen.append(question.id)
+            if i % 10 == 0:
+                player.buzz_info = {'position': 10, 'guess': 'x', 'result': 0, 'qb_score': -5, 'ew_score': 0}
+        start = time.perf_counter()
+        room._end_of_question()
+        return time.perf_counter() - start
+    return run
+
+
+def case_expected_wins(db, length):
+    from centaur.expected_wins import ExpectedWins
+    ew = ExpectedWins()
+    scores = [ew.score(p, length) for p in range(1, length)]
+
+    @timed(2 * len(scores))
+    def run():
+        for position, score in enumerate(scores, 1):
+            ew.score(position, length)
+            ew.solve(min(max(score, 0.01), 0.99), length)
+    return run
+
+
+def case_clean_question(db, length):
+    from centaur.utils import clean_question
+    text = ' '.join(make_text(random.Random(length), length)) + ' (pronounced [foo]).'
+
+    @timed(1)
+    def run():
+        clean_question(text)
+    return run
+
+
+def case_tokenize_question(db, length):
+    from centaur.utils import tokenize_question
+    text = ' '.join(make_text(random.Random(length), length))
+    tokenize_question(text)  # load the tokenizer
+
+    @timed(1)
+    def run():
+        tokenize_question(text)
+    return run
+
+
+def case_get_matched(db, length):
+    from centaur.machine_client import GuesserBuzzer
+    rng = random.Random(length)
+    tokens = make_text(rng, length)
+    matches = {'wiki': [make_match(rng, 60) for _ in range(4)]}
+    guesser = GuesserBuzzer()
+
+    @timed(1)
+    def run():
+        guesser.get_matched(tokens, length, matches)
+    return run
+
+
+def case_tfidf_guess(db, length):
+    from centaur.tfidf_guesser import TfidfGuesser
+    rng = random.Random(length)
+    documents = [(f'answer {i % 1000}', ' '.join(make_text(rng, 20))) for i in range(5000)]
+    guesser = TfidfGuesser.build(documents)
+    tokens = make_text(rng, length)
+    texts = [' '.join(tokens[:i]) for i in range(1, length + 1, KEYFRAME_EVERY)]
+
+    @timed(len(texts))
+    def run():
+        guesser.guess(texts)
+        guesser.highlight(texts)
+    return run
+
+
+# QantaCache before keyframes, one row per position, to compare with
+LEGACY_CACHE = Table(
+    'legacy_qantacache', MetaData(),
+    Column('question_id', String, primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('answer', String, nullable=False),
+    Column('guesses', JSONType),
+    Column('buzz_scores', JSONType),
+    Column('matches', JSONType),
+    Column('text_highlight', JSONType),
+    Column('matches_highlight', JSONType),
+)
+CACHE_COLUMNS = ('guesses', 'buzz_scores', 'matches', 'matches_highlight', 'text_highlight')
+
+
+def stored_bytes(rows) -> int:
+    '''size of the guesser output of `rows` as stored, JSON text or bitmaps'''
+    total = 0
+    for row in rows:
+        for column in CACHE_COLUMNS:
+            value = getattr(row, column)
+            total += len(value) if isinstance(value, bytes) else len(json.dumps(value))
+    return total
+
+
+def case_cache_load(db, format, length):
+    question = load_question(db, length)
+    if format == 'rows':
+        LEGACY_CACHE.create(db.get_bind(), checkfirst=True)
+        where = LEGACY_CACHE.c.question_id == question.id
+        if db.execute(select(func.count()).select_from(LEGACY_CACHE).where(where)).scalar() == 0:
+            _, entries = make_entries(length, seed=length)  # same as load_question
+            db.execute(LEGACY_CACHE.insert(), [
+                dict(x._asdict(), question_id=question.id, answer=question.answer) for x in entries
+            ])
+            db.commit()
+
+        def load(session):
+            rows = session.execute(select(LEGACY_CACHE).where(where).order_by(LEGACY_CACHE.c.position)).fetchall()
+            return QantaSnapshot.from_entries(question.id, rows), rows
+    else:
+        def load(session):
+            rows = session.query(QantaKeyframe).filter(QantaKeyframe.question_id == question.id).all()
+            return QantaSnapshot.load(session, question.id), rows
+
+    @timed(1)
+    def run():
+        # a new session, so that nothing is read from an identity map
+        with SessionLocal() as session:
+            snapshot = load(session)[0]
+        for position in range(1, length + 1):
+            snapshot[position]
+
+    with SessionLocal() as session:
+        run.bytes = stored_bytes(load(session)[1])
+    return run
+
+
+SAMPLE_MESSAGES = dict()  # protocol -> message, built once
+
+
+def sample_messages(db) -> dict:
+    '''RESUME messages of both protocols, with the overlay of a player, halfway through a question'''
+    cache = SAMPLE_MESSAGES
+    if len(cache) == 0:
+        from centaur.renderer import QuestionRenderer
+        from centaur.utils import EXPLANATIONS
+        question = load_question(db, QUESTION_LENGTHS[1])
+        room = make_room(db, question, 0)
+        room.renderer = QuestionRenderer(question.tokens)
+        room.position = 0
+        room.delta_panels = None
+        room.delta_resets = 0
+        for _ in range(question.length // 2):
+            room.stream_next()
+        overlay = {
+            'can_buzz': True,
+            'explanation_config': {x: True for x in EXPLANATIONS + ['allow_player_choice']},
+        }
+        cache['snapshot'] = dict(room.latest_resume_msg, **overlay)
+        cache['delta'] = dict(room.get_delta_msg(room.latest_resume_msg, room.panels), **overlay)
+    return cache
+
+
+def get_codec(name: str):
+    from centaur.codec import CODECS
+    if name not in CODECS:
+        raise ImportError(f'codec {name} is not installed')
+    return CODECS[name]
+
+
+def case_encode(db, codec, message):
+    encoder = get_codec(codec)
+    msg = sample_messages(db)[message]
+
+    @timed(100)
+    def run():
+        for _ in range(100):
+            encoder.encode(msg)
+    run.bytes = len(encoder.encode(msg))
+    return run
+
+
+def case_decode(db, codec, message):
+    decoder = get_codec(codec)
+    payload = decoder.encode(sample_messages(db)[message])
+
+    @timed(100)
+    def run():
+        for _ in range(100):
+            decoder.decode(payload)
+    run.bytes = len(payload)
+    return run
+
+
+def case_broadcast(db, players, codec):
+    encoder = get_codec(codec)
+    question = load_question(db, QUESTION_LENGTHS[1])
+    room = make_room(db, question, players)
+    for player in room.players.values():
+        player.codec = encoder
+    msg = sample_messages(db)['snapshot']
+
+    @timed(1)
+    def run():
+        room.broadcast(msg)
+    return run
+
+
+CASES = [
+    ('display_question', case_display_question, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('display_panels', case_display_panels, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('stream_next', case_stream_next, [
+        {'players': p, 'length': x} for p in ROOM_SIZES for x in QUESTION_LENGTHS
+    ]),
+    ('judge', case_judge, [{'questions': x} for x in (100, 1000)]),
+    ('player_list', case_player_list, [{'players': x} for x in ROOM_SIZES]),
+    ('end_of_question', case_end_of_question, [{'players': x} for x in ROOM_SIZES]),
+    ('expected_wins', case_expected_wins, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('clean_question', case_clean_question, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('tokenize_question', case_tokenize_question, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('get_matched', case_get_matched, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('tfidf_guess', case_tfidf_guess, [{'length': x} for x in QUESTION_LENGTHS]),
+    ('cache_load', case_cache_load, [{'format': f, 'length': x} for f in ('rows', 'keyframes') for x in QUESTION_LENGTHS]),
+    ('encode', case_encode, [{'codec': c, 'message': m} for c in CODECS for m in ('snapshot', 'delta')]),
+    ('decode', case_decode, [{'codec': c, 'message': m} for c in CODECS for m in ('snapshot', 'delta')]),
+    ('broadcast', case_broadcast, [{'players': p, 'codec': c} for p in ROOM_SIZES[1:] for c in CODECS]),
+]
+
+
+def case_name(name: str, params: dict) -> str:
+    return name + ''.join(f'[{k}={v}]' for k, v in params.items())
+
+
+def run_cases(pattern: str = None, repeat: int = 5) -> dict:
+    db = SessionLocal()
+    results = dict()
+    for name, make_case, param_list in CASES:
+        for params in param_list:
+            full_name = case_name(name, params)
+            if pattern is not None and pattern not in full_name:
+                continue
+            try:
+                run = make_case(db, **params)
+                run()  # warm up
+                times = sorted(run() for _ in range(repeat))
+            except ImportError as e:
+                print(f'{full_name:<50} skipped ({e})')
+                continue
+            except LookupError as e:
+                # nltk data not downloaded, the message is framed in lines of '*'
+                lines = [x.strip() for x in str(e).splitlines() if x.strip().strip('*')]
+                print(f'{full_name:<50} skipped ({lines[0] if lines else "LookupError"})')
+                continue
+            results[full_name] = {'median': times[len(times) // 2], 'min': times[0]}
+            size = ''
+            if hasattr(run, 'bytes'):
+                # cases of a message also report its size
+                results[full_name]['bytes'] = run.bytes
+                size = f'  {run.bytes} bytes'
+            print(f'{full_name:<50} {times[len(times) // 2] * 1e6:12.2f}us  (min {times[0] * 1e6:.2f}us){size}')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    '''names of the cases slower than `threshold` times the baseline'''
+    slower = []
+    print()
+    print(f'{"case":<50} {"baseline":>12} {"now":>12} {"ratio":>7}')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median']
+        ratio = result['median'] / before if before > 0 else float('inf')
+        flag = '  SLOWER' if ratio > threshold else ''
+        print(f'{name:<50} {before * 1e6:10.2f}us {result["median"] * 1e6:10.2f}us {ratio:7.2f}{flag}')
+        if ratio > threshold:
+            slower.append(name)
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', default=None, help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', default=None, help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous --save')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = run_cases(args.filter, args.repeat)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'date': str(datetime.now()),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        slower = compare(results, baseline, args.threshold)
+        if len(slower) > 0:
+            print(f'{len(slower)} cases slower than {args.threshold}x the baseline')
+            sys.exit(1)
@@ -0,0 +1,34 @@
+'''
+Precompile the render bundles of the tournaments played by the server.
+
+    python scripts/build_bundles.py spring_novice_round_03 spring_novice_round_04
+
+Rebuild the bundles of a tournament after regenerating its cache with
+scripts/cache_qanta.py. Until then, the server loads the regenerated
+questions from the database.
+'''
+import os
+import argparse
+
+from centaur.bundle import build_bundle
+from centaur.config import settings
+from centaur.db.session import SessionLocal
+from centaur.models import Question
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tournaments', nargs='+', help='tournament name prefixes')
+    parser.add_argument('--out', default=settings.RENDER_BUNDLE_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    session = SessionLocal()
+    for tournament in args.tournaments:
+        questions = session.query(Question) \
+            .filter(Question.tournament.startswith(tournament)) \
+            .all()
+        path = os.path.join(args.out, f'{tournament}.bundle')
+        index = build_bundle(session, questions, path, tournament)
+        print(f'{path}: {len(index["questions"])} questions, {os.path.getsize(path)} bytes')
+    session.close()
@@ -0,0 +1,64 @@
+'''
+Build the TF-IDF index of the in-process guesser, see
+centaur/tfidf_guesser.py.
+
+    python scripts/build_guesser_index.py --exclude spring_novice
+    python scripts/build_guesser_index.py --no-questions --corpus wiki.jsonl
+
+The evidence is the sentences of the questions in the database, under
+their answer, and of the JSON lines `{"answer": ..., "text": ...}` of
+each `--corpus` file. Exclude the tournaments to be cached with the
+index, or their questions would match themselves.
+'''
+import os
+import json
+import time
+import argparse
+
+from centaur.config import settings
+from centaur.db.session import SessionLocal
+from centaur.models import Question
+from centaur.tfidf_guesser import TfidfGuesser, split_passages
+
+
+def question_documents(exclude: list):
+    session = SessionLocal()
+    query = session.query(Question.answer, Question.raw_text)
+    for prefix in exclude:
+        query = query.filter(~Question.tournament.startswith(prefix) | Question.tournament.is_(None))
+    for answer, raw_text in query.yield_per(1000):
+        for passage in split_passages(' '.join(raw_text)):
+            yield answer, passage
+    session.close()
+
+
+def corpus_documents(path: str):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                document = json.loads(line)
+                for passage in split_passages(document['text']):
+                    yield document['answer'], passage
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default=settings.GUESSER_INDEX)
+    parser.add_argument('--exclude', nargs='*', default=[], help='prefixes of tournaments left out of the evidence')
+    parser.add_argument('--corpus', nargs='*', default=[], help='JSON lines files of answer and text')
+    parser.add_argument('--no-questions', action='store_true', help='do not use the questions in the database')
+    args = parser.parse_args()
+
+    documents = []
+    if not args.no_questions:
+        documents.extend(question_documents(args.exclude))
+    for path in args.corpus:
+        documents.extend(corpus_documents(path))
+
+    start = time.time()
+    guesser = TfidfGuesser.build(documents)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    guesser.save(args.out)
+    print(f'{args.out}: {len(guesser.answers)} answers, {len(guesser.passages)} passages, '
+          f'{len(guesser.vocabulary)} words, {os.path.getsize(args.out)} bytes in {time.time() - start:.1f}s '
+          f'({guesser.version})')
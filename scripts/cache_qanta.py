@@ -1,45 +1,248 @@
+'''
+Cache the guesses, buzzes and highlights of the guesser at every position
+of the questions of a tournament, as QantaKeyframe rows.
+
+    python scripts/cache_qanta.py --tournament spring_novice_round --workers 8
+
+Questions are cached concurrently by `--workers` threads, each with its
+own `GuesserBuzzer` and keep-alive connection to the guesser at `--url`.
+A few questions are queued ahead of the workers, so finished questions do
+not pile up in memory. The positions of a question where the guesser is
+called are sent to it as one batch.
+
+Without the guesser service or a network, `--guesser tfidf` guesses with
+the in-process TF-IDF index built by scripts/build_guesser_index.py,
+shared by the workers:
+
+    python scripts/build_guesser_index.py --exclude spring_novice
+    python scripts/cache_qanta.py --guesser tfidf --workers 1
+
+The main thread writes the keyframes of finished questions with bulk
+inserts, about `CACHE_BATCH_ROWS` rows per transaction. A question is
+written whole in one transaction, replacing its old rows, and its
+keyframes are stamped with the hash of its tokens and the version of the
+guesser. The table is the checkpoint: before calling the guesser, the
+questions of the tournament are compared with their stamps, and only
+questions that are missing, were edited since, or were cached by another
+guesser version are regenerated. An interrupted run resumes where it
+stopped. `--plan` only prints what would be regenerated, `--force`
+regenerates every question of the tournament. Other tournaments' rows are
+never touched.
+
+Bump `GUESSER_VERSION` when the guesser is retrained.
+
+Without the guesser, run it against the stub:
+
+    python scripts/stub_guesser.py --port 6000 --delay 0.05
+    python scripts/cache_qanta.py --url http://127.0.0.1:6000
+'''
+import sys
+import time
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from tqdm import tqdm
 from nltk.corpus import stopwords as sw
 
-from centaur.machine_client import GuesserBuzzer
-from centaur.models import Question, QantaCache
+from centaur.config import settings
+from centaur.machine_client import GuesserBuzzer, make_guesser
+from centaur.models import Question, QantaKeyframe
+from centaur.cache_snapshot import CacheEntry, compress, keyframe_records, hash_tokens
 from centaur.db.session import SessionLocal
 
 stopwords = set(sw.words('english'))
 
+KEYFRAME_EVERY = 5  # positions between calls to the guesser
+
+
+class Guessers:
+    '''
+    One `GuesserBuzzer` per worker thread. Each has its own connection to
+    the guesser service, since a requests Session is not thread safe; an
+    in-process guesser is loaded once and shared.
+    '''
+
+    def __init__(self, url: str = None, guesser: str = 'http', index: str = None):
+        self.url = url
+        self.shared = None if guesser == 'http' else make_guesser(guesser, url, index)
+        self.local = threading.local()
+        self.models = []
+
+    def get(self) -> GuesserBuzzer:
+        model = getattr(self.local, 'model', None)
+        if model is None:
+            model = self.local.model = GuesserBuzzer(url=self.url, guesser=self.shared)
+            self.models.append(model)
+        return model
+
+    @property
+    def requests(self) -> int:
+        return sum(x.requests for x in self.models)
+
+
+def cache_version(model: GuesserBuzzer) -> str:
+    '''stamp of the keyframes made by `model`, with the positions it is called at'''
+    return f'{model.version}/every-{KEYFRAME_EVERY}'
+
 
-def generate_cache():
+def cache_question(model: GuesserBuzzer, qid: str, tokens: list, length: int) -> list:
+    '''the QantaKeyframe rows of one question, as dicts, stamped'''
+    model.new_question(qid)
+    guesses, buzz_scores, matches, text_highlight, matches_highlight = None, None, None, None, None
+    entries = []
+    buzzes = model.buzz_prefixes(tokens, range(1, length + 1, KEYFRAME_EVERY))
+    for i in range(1, length + 1):  # +1 because we take [:i]
+        if (i - 1) % KEYFRAME_EVERY == 0:
+            guesses = [(x.replace('_', ' '), s) for x, s in model.guesses]
+            buzz_scores = next(buzzes)
+            matches = model.tokenized_matches
+            text_highlight = model.text_highlight
+            matches_highlight = model.matches_highlight
+        else:
+            # a new list, the entries of a question are compressed together
+            text_highlight = text_highlight + [False]
+        entries.append(CacheEntry(
+            position=i,
+            guesses=guesses,
+            buzz_scores=buzz_scores,
+            matches=matches,
+            matches_highlight=matches_highlight,
+            text_highlight=text_highlight,
+        ))
+    return keyframe_records(qid, compress(entries), hash_tokens(tokens, length), cache_version(model))
+
+
+def cached_questions(session, tournament: str) -> dict:
+    '''question id -> (tokens hash, guesser version), of the cached questions of `tournament`'''
+    rows = session.query(QantaKeyframe.question_id, QantaKeyframe.tokens_hash, QantaKeyframe.guesser_version) \
+        .join(Question, Question.id == QantaKeyframe.question_id) \
+        .filter(Question.tournament.startswith(tournament)) \
+        .distinct()
+    return {x.question_id: (x.tokens_hash, x.guesser_version) for x in rows}
+
+
+def plan_cache(questions, cached: dict, version: str) -> dict:
+    '''
+    The `questions` by what their cache needs, given the stamps `cached`:
+    'missing' questions have no keyframes, 'edited' questions changed since
+    they were cached (or were cached before stamps), 'guesser' questions
+    were cached by another guesser version, 'fresh' questions are up to date.
+    '''
+    plan = {'missing': [], 'edited': [], 'guesser': [], 'fresh': []}
+    for q in questions:
+        stamp = cached.get(q.id)
+        if stamp is None:
+            plan['missing'].append(q)
+        elif stamp[0] != hash_tokens(q.tokens, q.length):
+            plan['edited'].append(q)
+        elif stamp[1] != version:
+            plan['guesser'].append(q)
+        else:
+            plan['fresh'].append(q)
+    return plan
+
+
+def write_questions(session, questions: dict):
+    '''replace the rows of `questions`, question id -> rows, in one transaction'''
+    table = QantaKeyframe.__table__
+    try:
+        session.execute(table.delete().where(table.c.question_id.in_(list(questions))))
+        # one executemany, batched into multi-row inserts by the driver
+        session.execute(table.insert(), [row for rows in questions.values() for row in rows])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def generate_cache(tournament: str = 'spring_novice_round', workers: int = settings.CACHE_WORKERS, url: str = None,
+                   force: bool = False, batch_rows: int = settings.CACHE_BATCH_ROWS, dry_run: bool = False,
+                   guesser: str = settings.GUESSER, index: str = None):
     session = SessionLocal()
-    model = GuesserBuzzer()
+    guessers = Guessers(url, guesser, index)
+    version = cache_version(guessers.get())
+
+    questions = session.query(Question.id, Question.tokens, Question.length) \
+        .filter(Question.tournament.startswith(tournament)).all()
+    plan = plan_cache(questions, cached_questions(session, tournament), version)
+    session.commit()  # do not hold the read transaction while the guesser works
+    print(f'{len(questions)} questions: {len(plan["missing"])} missing, {len(plan["edited"])} edited, '
+          f'{len(plan["guesser"])} cached by another guesser, {len(plan["fresh"])} fresh ({version})')
+    if dry_run:
+        for reason in ('missing', 'edited', 'guesser'):
+            if len(plan[reason]) > 0:
+                print(f'{reason}: {" ".join(q.id for q in plan[reason])}')
+        session.close()
+        return
+    if not force:
+        questions = plan['missing'] + plan['edited'] + plan['guesser']
+    if len(questions) == 0:
+        session.close()
+        return
+
+    start = time.time()
+    n_questions, n_rows, failed = 0, 0, []
+    batch = dict()  # question id -> rows, finished but not written yet
+    pbar = tqdm(total=len(questions), unit='question')
+
+    def flush():
+        nonlocal n_questions, n_rows
+        if len(batch) == 0:
+            return
+        write_questions(session, batch)
+        n_questions += len(batch)
+        n_rows += sum(len(x) for x in batch.values())
+        pbar.update(len(batch))
+        batch.clear()
+        elapsed = time.time() - start
+        pbar.set_postfix(requests_per_s=f'{guessers.requests / elapsed:.1f}', refresh=False)
 
-    questions = session.query(Question).filter(Question.tournament.startswith('spring_novice_round'))
-    for q in tqdm(questions, total=questions.count()):
-        model.new_question(q.id)
-        guesses, buzz_scores, matches, text_highlight, matches_highlight = None, None, None, None, None
-        for i in range(1, q.length + 1):  # +1 because we take [:i]
-            if i % 5 == 1:
-                guesses = [(x.replace('_', ' '), s) for x, s in model.guesses]
-                buzz_scores = model.buzz(q.tokens[:i], i)
-                matches = model.tokenized_matches
-                text_highlight = model.text_highlight
-                matches_highlight = model.matches_highlight
-            else:
-                text_highlight.append(False)
-            entry = QantaCache(
-                question_id=q.id,
-                position=i,
-                answer=q.answer,
-                guesses=guesses,
-                buzz_scores=buzz_scores,
-                matches=matches,
-                text_highlight=text_highlight,
-                matches_highlight=matches_highlight,
-            )
-            session.add(entry)
-            session.commit()
-
-    session.commit()
-    session.close()
+    def collect(future, qid):
+        try:
+            batch[qid] = future.result()
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            failed.append(qid)
+            return
+        if sum(len(x) for x in batch.values()) >= batch_rows:
+            flush()
+
+    def work(q):
+        return cache_question(guessers.get(), q.id, q.tokens, q.length)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = dict()  # future -> question id
+            try:
+                for q in questions:
+                    if len(pending) >= 2 * workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future, pending.pop(future))
+                    pending[executor.submit(work, q)] = q.id
+                while len(pending) > 0:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+            except BaseException:
+                # on ^C, only wait for the questions already started
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        # questions finished before an error or ^C are kept, the next run skips them
+        flush()
+        pbar.close()
+        session.close()
+
+    elapsed = time.time() - start
+    print(f'{n_questions} questions, {n_rows} keyframes in {elapsed:.1f}s: '
+          f'{n_questions / elapsed:.2f} questions/s, '
+          f'{guessers.requests / elapsed:.1f} requests/s with {workers} workers')
+    if len(failed) > 0:
+        print(f'{len(failed)} questions failed, run again to retry them: {" ".join(failed)}')
 
 
 def test():
@@ -57,13 +260,27 @@ def test():
     print(model.text_highlight)
 
 
-def clear_cache():
+def clear_cache(tournament: str):
+    '''delete the cached rows of the questions of `tournament`'''
     db = SessionLocal()
-    db.query(QantaCache).delete()
+    ids = db.query(Question.id).filter(Question.tournament.startswith(tournament))
+    db.query(QantaKeyframe).filter(QantaKeyframe.question_id.in_(ids)).delete(synchronize_session=False)
     db.commit()
+    db.close()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tournament', default='spring_novice_round', help='prefix of the tournaments to cache')
+    parser.add_argument('--workers', type=int, default=settings.CACHE_WORKERS, help='questions cached concurrently')
+    parser.add_argument('--guesser', default=settings.GUESSER, choices=['http', 'tfidf'])
+    parser.add_argument('--url', default=settings.GUESSER_URL, help='guesser service, with --guesser http')
+    parser.add_argument('--index', default=settings.GUESSER_INDEX, help='TF-IDF index, with --guesser tfidf')
+    parser.add_argument('--force', action='store_true', help='regenerate questions that are already cached')
+    parser.add_argument('--batch-rows', type=int, default=settings.CACHE_BATCH_ROWS, help='rows per bulk insert')
+    parser.add_argument('--plan', action='store_true', help='only print the questions that would be regenerated')
+    args = parser.parse_args()
+
     # test()
-    clear_cache()
-    generate_cache()
+    generate_cache(args.tournament, args.workers, args.url, args.force, args.batch_rows, args.plan,
+                   args.guesser, args.index)
@@ -0,0 +1,65 @@
+'''
+Check a running launcher over loopback: every room gets a WebSocket
+handshake through the router and shows up on the worker that owns it.
+
+    python -m centaur.launcher --workers 3 --port 9000 --health-port 9100
+    python scripts/check_launcher.py --port 9000 --health-port 9100 --workers 3
+'''
+import os
+import json
+import time
+import base64
+import socket
+import argparse
+import urllib.request
+
+from centaur.launcher import worker_for_room
+
+
+def handshake(port: int, path: str) -> socket.socket:
+    sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: 127.0.0.1:{port}\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        f'Sec-WebSocket-Key: {key}\r\n'
+        'Sec-WebSocket-Version: 13\r\n\r\n'
+    ).encode())
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data
+    status = response.split(b'\r\n', 1)[0].decode('latin-1')
+    assert ' 101 ' in status, f'{path}: {status}'
+    return sock
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--health-port', type=int, default=9100)
+    parser.add_argument('--workers', type=int, required=True)
+    parser.add_argument('--rooms', type=int, default=8)
+    args = parser.parse_args()
+
+    rooms = [f'check_{i}' for i in range(args.rooms)]
+    sockets = [handshake(args.port, f'/{room_id}') for room_id in rooms]
+
+    # rooms appear in the next heartbeat
+    time.sleep(3)
+    url = f'http://127.0.0.1:{args.health_port}/health'
+    report = json.load(urllib.request.urlopen(url))
+    for room_id in rooms:
+        index = worker_for_room(room_id, args.workers)
+        worker = report['workers'][index]
+        assert worker['alive'], f'worker {index} is down'
+        assert room_id in worker['rooms'], f'{room_id} not on worker {index}'
+        print(f'{room_id} -> worker {index} (pid {worker["pid"]})')
+
+    for sock in sockets:
+        sock.close()
+    print('ok')
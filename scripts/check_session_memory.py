@@ -0,0 +1,94 @@
+'''
+Check that database sessions do not grow with the number of questions a
+room plays.
+
+    python scripts/check_session_memory.py --questions 2000 --players 10
+
+Questions are played through `Room.new_question` and
+`Room._end_of_question` on an in-memory SQLite database, with the
+synthetic questions of `scripts/benchmark.py`. Every `--every`
+questions the sessions alive, the objects in their identity maps and the
+Python memory allocated are sampled. Exits with status 1 if the sessions
+or their objects grow after the first sample.
+
+Python memory still grows a little with every question, because players
+keep the list of questions they have seen; it is reported per question.
+'''
+import gc
+import sys
+import logging
+import argparse
+import tracemalloc
+
+from sqlalchemy.orm import Session
+
+from benchmark import make_question, make_room, SessionLocal
+
+
+def live_sessions():
+    '''(number of sessions alive, objects in their identity maps)'''
+    gc.collect()
+    sessions = [x for x in gc.get_objects() if isinstance(x, Session)]
+    return len(sessions), sum(len(x.identity_map) for x in sessions)
+
+
+def play(room, question_index: int):
+    '''play one question without streaming its words'''
+    from tqdm import tqdm
+    from twisted.internet.task import Clock
+    from centaur.scheduler import TimingWheel
+
+    room.question_index = question_index % len(room.questions) - 1
+    question = room.questions[question_index % len(room.questions)]
+    for player in room.players.values():
+        player.response = {'qid': question.id}  # everyone is ready right away
+    room.new_question()
+
+    room.position = question.length
+    room.latest_resume_msg = {'guesses': [], 'matches_highlighted': []}
+    room.pbar = tqdm(total=question.length, disable=True)
+    room._end_of_question()
+
+    # drop the timers of the next word and question, they are never run
+    room.factory.clock = Clock()
+    room.factory.wheel = TimingWheel(room.factory.clock, now=room.factory.clock.seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--every', type=int, default=500)
+    parser.add_argument('--bank', type=int, default=50, help='distinct questions, played in turn')
+    args = parser.parse_args()
+    logging.getLogger('server').setLevel(logging.WARNING)
+
+    with SessionLocal() as db:
+        questions = []
+        for i in range(args.bank):
+            question, rows = make_question(f'memory_{i}', 40, seed=i)
+            db.add(question)
+            db.add_all(rows)
+            questions.append(question)
+        db.commit()
+        room = make_room(db, questions[0], args.players, in_db=True)
+    room.questions = questions
+    room.factory.snapshots.release(questions[0].id)
+
+    tracemalloc.start()
+    samples = []  # (questions played, sessions, objects, bytes)
+    for i in range(args.questions):
+        play(room, i)
+        if (i + 1) % args.every == 0:
+            sessions, objects = live_sessions()
+            current, _ = tracemalloc.get_traced_memory()
+            samples.append((i + 1, sessions, objects, current))
+            print(f'{i + 1:>8} questions  {sessions:>3} sessions  {objects:>6} objects  {current / 1024:10.1f} KiB')
+
+    first, last = samples[0], samples[-1]
+    per_question = (last[3] - first[3]) / max(last[0] - first[0], 1)
+    print(f'python memory {per_question:.1f} bytes per question after {first[0]} questions')
+    if last[1] > first[1] or last[2] > first[2]:
+        print(f'sessions grew from {first[1]} ({first[2]} objects) to {last[1]} ({last[2]} objects)')
+        sys.exit(1)
+    print('sessions flat')
@@ -1,9 +1,9 @@
-from sqlalchemy import Column, ForeignKey, Integer, Float, String, TIMESTAMP
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, ForeignKey, Integer, Float, String, TIMESTAMP, LargeBinary
 from sqlalchemy import Table, MetaData
 
 from centaur.models import Player, Question
 from centaur.db.session import engine
+from centaur.db.types import JSONType
 
 meta = MetaData()
 
@@ -12,11 +12,11 @@ Table(
     'question', meta,
     Column('id', String, primary_key=True, index=True),
     Column('answer', String, nullable=False),
-    Column('raw_text', JSONB, nullable=False),
+    Column('raw_text', JSONType, nullable=False),
     Column('length', Integer, nullable=False),
-    Column('tokens', JSONB, nullable=False),
+    Column('tokens', JSONType, nullable=False),
     Column('tournament', String),
-    Column('meta', JSONB),
+    Column('meta', JSONType),
 )
 
 Table(
@@ -27,37 +27,38 @@ Table(
     Column('email', String),
     Column('mediator_name', String),
     Column('score', Integer),
-    Column('questions_seen', JSONB),
-    Column('questions_answered', JSONB),
-    Column('questions_correct', JSONB),
+    Column('questions_seen', JSONType),
+    Column('questions_answered', JSONType),
+    Column('questions_correct', JSONType),
 )
 
 Table(
     'features', meta,
     Column('id', String, ForeignKey(Player.id, ondelete="CASCADE"), primary_key=True, index=True),
-    Column('enabled_explanation', JSONB),
-    Column('enabled_config', JSONB),
+    Column('enabled_explanation', JSONType),
+    Column('enabled_config', JSONType),
     Column('n_seen', Integer),
     Column('n_answered', Integer),
     Column('n_correct', Integer),
-    Column('n_seen_by_explanation', JSONB),
-    Column('n_seen_by_config', JSONB),
-    Column('n_answered_by_explanation', JSONB),
-    Column('n_answered_by_config', JSONB),
-    Column('n_correct_by_explanation', JSONB),
-    Column('n_correct_by_config', JSONB),
+    Column('n_seen_by_explanation', JSONType),
+    Column('n_seen_by_config', JSONType),
+    Column('n_answered_by_explanation', JSONType),
+    Column('n_answered_by_config', JSONType),
+    Column('n_correct_by_explanation', JSONType),
+    Column('n_correct_by_config', JSONType),
 )
 
 Table(
-    'qantacache', meta,
+    'qantakeyframe', meta,
     Column('question_id', String, ForeignKey(Question.id), primary_key=True),
     Column('position', Integer, primary_key=True),
-    Column('answer', String, nullable=False),
-    Column('guesses', JSONB),
-    Column('buzz_scores', JSONB),
-    Column('matches', JSONB),
-    Column('text_highlight', JSONB),
-    Column('matches_highlight', JSONB),
+    Column('guesses', JSONType),
+    Column('buzz_scores', JSONType),
+    Column('matches', JSONType),
+    Column('matches_highlight', JSONType),
+    Column('text_highlight', LargeBinary),
+    Column('tokens_hash', String),
+    Column('guesser_version', String),
 )
 
 
@@ -75,7 +76,7 @@ Table(
     Column('explanation_config', String),
     Column('mediator_name', String),
     Column('room_id', String),
-    Column('player_list', JSONB),
+    Column('player_list', JSONType),
     Column('date', TIMESTAMP(timezone=True)),
 )
 
@@ -85,8 +86,8 @@ Table(
     Column('room_id', String, primary_key=True, nullable=False, index=True),
     Column('qb_score', Integer),
     Column('ew_score', Float),
-    Column('questions_answered', JSONB),
-    Column('questions_correct', JSONB),
+    Column('questions_answered', JSONType),
+    Column('questions_correct', JSONType),
 )
 
 meta.create_all(engine)
@@ -1,7 +1,8 @@
 import json
 from nltk import word_tokenize
 
-from centaur.models import Question, QantaCache
+from centaur.models import Question, QantaKeyframe
+from centaur.cache_snapshot import CacheEntry, compress, keyframe_records, hash_tokens
 from centaur.db.session import SessionLocal
 from centaur.utils import remove_power
 
@@ -35,26 +36,29 @@ def load_question_to_db():
     with open('data/old/pace_cache_one.json') as f:
         cache = json.load(f)
     cache_entries = cache[qid]
+    entries = []
     for i, x in cache_entries.items():
         print(x['position'])
-        entry = QantaCache(
-            question_id=f'pace_question_{qid}',
+        entries.append(CacheEntry(
             position=int(i),
-            answer=x['answer'],
             guesses=x['guesses'],
             buzz_scores=x['buzz_scores'],
             matches=x['matches'],
-            text_highlight=x['text_highlight'],
             matches_highlight=x['matches_highlight'],
-        )
-        db.add(entry)
-        db.commit()
+            text_highlight=x['text_highlight'],
+        ))
+    entries.sort(key=lambda x: x.position)
+    keyframes = compress(entries)
+    # made by the PACE guesser, scripts/cache_qanta.py regenerates them if asked
+    records = keyframe_records(f'pace_question_{qid}', keyframes, hash_tokens(tokens, len(tokens)), 'pace')
+    db.add_all([QantaKeyframe(**x) for x in records])
+    db.commit()
     db.close()
 
 
 if __name__ == '__main__':
     db = SessionLocal()
-    entries = db.query(QantaCache).filter(QantaCache.question_id.startswith('pace'))
+    entries = db.query(QantaKeyframe).filter(QantaKeyframe.question_id.startswith('pace'))
     for x in entries:
         db.delete(x)
     db.commit()
@@ -3,7 +3,7 @@ from bs4 import BeautifulSoup
 from sqlalchemy.exc import IntegrityError
 from nltk import word_tokenize
 
-from centaur.models import Question, QantaCache, Record
+from centaur.models import Question, QantaKeyframe, Record
 from centaur.db.session import SessionLocal
 from centaur.utils import shell, remove_power
 
@@ -86,7 +86,7 @@ if __name__ == '__main__':
     # parse_questions_for_inspection()
 
     db = SessionLocal()
-    db.query(QantaCache).delete()
+    db.query(QantaKeyframe).delete()
     db.commit()
 
     db.query(Record).delete()
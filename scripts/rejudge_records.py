@@ -0,0 +1,26 @@
+'''
+Judge the guesses in the Record table again, after the alias table in
+centaur/alternative.py or the alternative answers of questions changed.
+
+    python scripts/rejudge_records.py --dry-run
+'''
+import argparse
+
+from centaur.answers import AnswerIndex, rejudge_records
+from centaur.db.session import SessionLocal
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true', help='only print what would change')
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    index = AnswerIndex.load(db)
+    changes = rejudge_records(db, index, dry_run=args.dry_run)
+    for question_id, guess, result, new_result, count in changes:
+        print(f'{question_id} [{guess}] {result} -> {new_result} ({count} records)')
+    print(f'{sum(x[4] for x in changes)} records changed')
+    if not args.dry_run:
+        db.commit()
+    db.close()
@@ -0,0 +1,105 @@
+'''
+A stand-in for the guesser service, to run scripts/cache_qanta.py without
+the real models.
+
+    python scripts/stub_guesser.py --port 6000 --delay 0.05
+
+Answers /api/centaur_answer_question with guesses and /api/get_highlights
+with passages made from the words of the text, after `--delay` seconds
+like a busy model. Connections are kept alive. The number of connections
+and requests served is printed on exit, so that connection reuse by the
+client can be checked.
+'''
+import json
+import time
+import zlib
+import signal
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Counters:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+
+def make_guesses(words: list) -> dict:
+    '''answer -> score, a few candidates that change with the last words'''
+    guesses = dict()
+    for word in words[-8:]:
+        h = zlib.crc32(word.encode('utf-8'))
+        guesses[f'Answer_{h % 97}'] = 1 + h % 13
+    return guesses
+
+
+def make_highlights(words: list) -> dict:
+    '''passages with some words of the text in <em>, as Elasticsearch returns them'''
+    passages = []
+    for i in range(4):
+        picked = words[i::4][-12:]
+        passages.append(' '.join(f'<em>{x}</em>' if j % 3 == 0 else x for j, x in enumerate(picked)))
+    return {'wiki': passages, 'qb': passages[:2]}
+
+
+class StubGuesserHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # headers and body are written separately
+    delay = 0.0
+    counters = None
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.counters.lock:
+            self.counters.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        words = form.get('text', [''])[0].split()
+        if self.path == '/api/centaur_answer_question':
+            result = make_guesses(words)
+        elif self.path == '/api/get_highlights':
+            result = make_highlights(words)
+        else:
+            self.send_error(404)
+            return
+        with self.counters.lock:
+            self.counters.requests += 1
+        time.sleep(self.delay)
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6000)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds per request')
+    args = parser.parse_args()
+
+    StubGuesserHandler.delay = args.delay
+    StubGuesserHandler.counters = counters = Counters()
+    server = ThreadingHTTPServer((args.host, args.port), StubGuesserHandler)
+    print(f'stub guesser on http://{args.host}:{args.port}', flush=True)
+    # stop on kill too, background jobs of a shell ignore ^C
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'served {counters.requests} requests on {counters.connections} connections')
@@ -1,25 +1,17 @@
 import json
-from tqdm import tqdm
 from centaur.db.session import SessionLocal
-from centaur.models import Question
+from centaur.autocomplete import answer_vocabulary
+from centaur.config import settings
 
 db = SessionLocal()
 tournament_str = 'spring_novice'
-questions = db.query(Question).filter(Question.tournament.startswith(tournament_str)).all()
 
 with open('fixtures/elasticsearch_instance_of_answers.json') as f:
     answers = json.load(f)
 
 print(len(answers))
-for question in tqdm(questions):
-    answer = question.answer.strip().title()
-    if answer not in answers:
-        answers.append(answer)
-    for answer in question.meta.get('alternative_answers', []):
-        answer = answer.strip().title()
-        if answer not in answers:
-            answers.append(answer)
+answers = answer_vocabulary(db, tournament_str, answers)
 print(len(answers))
 
-with open('web/answers.0515.json', 'w') as f:
+with open(settings.ANSWER_VOCABULARY, 'w') as f:
     json.dump(answers, f)
@@ -1,8 +1,13 @@
 var sockt;
 var socket_addr = "ws://localhost:9000";
 // var socket_addr = "ws://play.qanta.org:9000";
-var answer_json_dir = "http://localhost:8000/answers.0515.json";
-// var answer_json_dir = "http://play.qanta.org/answers.0212.json";
+// the room is picked by the path, e.g. index.html?room=room_2 joins ws://.../room_2
+var room_param = new URLSearchParams(window.location.search).get("room");
+if (room_param) {
+    socket_addr += "/" + encodeURIComponent(room_param);
+}
+var autocomplete_url = "http://localhost:8080/autocomplete";
+// var autocomplete_url = "http://play.qanta.org:8080/autocomplete";
 // $("#consent_form").load("consent_form.html"); 
 
 
@@ -19,6 +24,10 @@ var MSG_TYPE_RESULT_OTHER = 8; // result of someone else's answer
 var MSG_TYPE_COMPLETE = 9; // answered all questions
 var MSG_TYPE_NEW_ROUND = 10; // start_new_round
 
+///////// Protocol versions ///////// 
+var PROTOCOL_SNAPSHOT = 1; // RESUME carries the full text and panels
+var PROTOCOL_DELTA = 2; // RESUME carries the new token, panels only when changed
+
 
 ///////// CONFIGS ///////// 
 var SECOND_PER_WORD = 0.3;
@@ -79,6 +88,10 @@ var pause_countdown = PAUSE_COUNTDOWN;
 var task_completed = false;
 var start_new_round = false;  // when this is true, send a start new round signal to server on register
 var chosen_round = 0;  // when this is 0, go to default next round
+var top_guess = "";  // top guess of the latest guesses panel
+var question_tokens = [];  // PROTOCOL_DELTA: displayed tokens
+var question_flags = [];  // PROTOCOL_DELTA: highlight of each displayed token
+var question_bells = [];  // PROTOCOL_DELTA: positions of the buzzes
 
 
 ///////// Constants ///////// 
@@ -260,41 +273,33 @@ highlight_question_checkbox.onclick = function() {
 };
 
 ///////// Autocomplete ///////// 
-var fuzzyhound = new FuzzySearch();
+// completions are ranked by the server, only the top few are downloaded
+var autocomplete_request = null;
 
-fuzzyhound.setOptions({
-    score_test_fused: true
-});
+function answer_source(query, sync_results, async_results) {
+    if (autocomplete_request !== null) {
+        autocomplete_request.abort();
+    }
+    autocomplete_request = $.getJSON(autocomplete_url, {q: query, k: 10});
+    autocomplete_request.done(function(response) {
+        async_results(response);
+    });
+}
 
 $('#answer_area').typeahead({
     minLength: 2,
-    highlight: false //let FuzzySearch handle highlight
+    highlight: true
 }, {
     name: 'answers',
-    source: fuzzyhound,
-    templates: {
-        suggestion: function(result) {
-            return "<div>" + fuzzyhound.highlight(result) + "</div>"
-        }
-    }
+    source: answer_source,
+    async: true,
+    limit: 10
 });
 
 $.ajaxSetup({
     cache: true
 });
 
-function setsource(url, keys, output) {
-    $.getJSON(url).then(function(response) {
-        fuzzyhound.setOptions({
-            source: response,
-            keys: keys,
-            output_map: output
-        })
-    });
-}
-
-setsource(answer_json_dir);
-
 ///////// Speech synthesis ///////// 
 window.addEventListener('beforeunload', function(){
     window.speechSynthesis.cancel();});
@@ -321,6 +326,10 @@ function new_question(msg) {
     curr_answer = ""
     question_text = '';
     question_text_color = '';
+    question_tokens = [];
+    question_flags = [];
+    question_bells = [];
+    top_guess = '';
     info_text = '';
     answer_area.value = "";
     buzzing_on_guess = false;
@@ -375,6 +384,7 @@ function new_question(msg) {
             player_name: player_name,
             player_email: player_email,
             player_id: player_id,
+            protocol: PROTOCOL_DELTA,
             start_new_round: true,
             chosen_round: chosen_round,
         };
@@ -387,6 +397,7 @@ function new_question(msg) {
             player_name: player_name,
             player_email: player_email,
             player_id: player_id,
+            protocol: PROTOCOL_DELTA,
         };
     }
 
@@ -498,6 +509,38 @@ function update_history_entries(history_entries) {
     }
 }
 
+function set_highlights(highlights) {
+    question_flags = [];
+    for (var i = 0; i < question_tokens.length; i++) {
+        question_flags.push(false);
+    }
+    for (var i = 0; i < highlights.length; i++) {
+        question_flags[highlights[i]] = true;
+    }
+}
+
+function render_token(i) {
+    var token = question_tokens[i];
+    question_text += token + ' ';
+    if (question_flags[i]) {
+        question_text_color += highlight_prefix + token + highlight_suffix + ' ';
+    } else {
+        question_text_color += token + ' ';
+    }
+    if (question_bells.indexOf(i + 1) != -1) {
+        question_text += bell_str;
+        question_text_color += bell_str;
+    }
+}
+
+function render_question_text() {
+    question_text = '';
+    question_text_color = '';
+    for (var i = 0; i < question_tokens.length; i++) {
+        render_token(i);
+    }
+}
+
 function update_interpretation(msg) {
     // update text and colored text
     if (typeof msg.text_highlighted != 'undefined') {
@@ -508,6 +551,26 @@ function update_interpretation(msg) {
         question_text = msg.text;
         update_question_display();
     }
+    // PROTOCOL_DELTA: snapshot for a player joining mid-question
+    if (typeof msg.tokens != 'undefined') {
+        question_tokens = msg.tokens.slice();
+        question_bells = msg.bells.slice();
+        set_highlights(msg.highlights);
+        render_question_text();
+        update_question_display();
+    }
+    // PROTOCOL_DELTA: append the new token, re-render if highlights changed
+    if (typeof msg.token != 'undefined') {
+        question_tokens.push(msg.token);
+        question_flags.push(msg.highlight);
+        if (typeof msg.highlights != 'undefined') {
+            set_highlights(msg.highlights);
+            render_question_text();
+        } else {
+            render_token(question_tokens.length - 1);
+        }
+        update_question_display();
+    }
 
     // update the list of guesses
     if (typeof msg.guesses !== 'undefined') {
@@ -538,9 +601,8 @@ function update_interpretation(msg) {
             alternatives_table.rows[i + 1].onclick = createClickHandler(guess);
         }
 
-        if (guesses.length > 0 && is_buzzing == false) {
-            // to make sure the auto-complete is pre-filled by machine prediction
-            curr_answer = guesses[0][0];
+        if (guesses.length > 0) {
+            top_guess = guesses[0][0];
         }
 
         if (guesses.length > 0) {
@@ -556,6 +618,11 @@ function update_interpretation(msg) {
         }
     }
 
+    if (top_guess != "" && is_buzzing == false) {
+        // to make sure the auto-complete is pre-filled by machine prediction
+        curr_answer = top_guess;
+    }
+
     //update the evidence 
     if (typeof msg.matches !== 'undefined') {
         var matches = msg.matches;
@@ -622,8 +689,11 @@ function handle_buzzing(msg) {
     progress(msg.length, msg.length, true);
     timer_set = true;
     buzz_button.disabled = true;
-    question_text += bell_str;
-    question_text_color += bell_str;
+    if (question_bells.indexOf(position) == -1) {
+        question_bells.push(position);
+        question_text += bell_str;
+        question_text_color += bell_str;
+    }
     update_question_display();
 }
 